@@ -0,0 +1,25 @@
+# Options of the IP tests in my_design/ips, registered here so that they are known however
+# pytest is run: from the repository root (as `pdm test` does) or from the IP directory.
+import os
+
+
+_OPTIONS = [
+    ("--ips-trace", "IPS_TRACE", "trace waveforms: 0 (default), 1 for every test, fail to re-run failing tests traced"),
+    ("--ips-trace-signals", "IPS_TRACE_SIGNALS", "comma-separated signals to trace, as attribute paths from the DUT"),
+    ("--ips-trace-window", "IPS_TRACE_WINDOW", "START:END range of clock cycles to trace"),
+    ("--ips-trace-dir", "IPS_TRACE_DIR", "directory for the traced VCD and GTKWave files"),
+]
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("ips", "waveform tracing for the IP tests (see sim_trace.py)")
+    for option, _, help in _OPTIONS:
+        group.addoption(option, default=None, help=help)
+
+
+def pytest_configure(config):
+    # the tests read the settings from the environment, so that they behave the same under unittest
+    for option, variable, _ in _OPTIONS:
+        value = config.getoption(option)
+        if value is not None:
+            os.environ[variable] = value
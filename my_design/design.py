@@ -19,6 +19,8 @@ from amaranth_orchard.io import I2CSignature, I2CPeripheral
 from amaranth_cv32e40p.cv32e40p import CV32E40P, DebugModule
 from chipflow_lib.platforms import InputPinSignature, OutputPinSignature
 from .ips.pwm import PWMPins, PWMPeripheral
+from .ips.pwm_bank import PWMBank
+from .ips.wishbone_csr_split import WishboneCSRSplit
 # from .ips.pdm import PDMPeripheral
 
 __all__ = ["JTAGSignature", "MySoC"]
@@ -44,6 +46,13 @@ class MySoC(wiring.Component):
         self.user_spi_count = 3
         self.i2c_count = 2
         self.motor_count = 10
+        # one PWMBank for all motors instead of a PWMPeripheral each
+        self.motor_bank = False
+        self.motor_shared_timebase = False
+        # 8, or 32 to put the project IPs (motor drivers and pdm_ao) on a 32-bit CSR bus of their
+        # own, at the same addresses, so that a register access takes one CSR cycle instead of
+        # four; their registers must then be written with 32-bit stores
+        self.csr_data_width = 8
         self.pdm_ao_count = 6
         self.uart_count = 2
 
@@ -89,6 +98,7 @@ class MySoC(wiring.Component):
         self.csr_i2c_base      = 0xb6000000
         self.csr_motor_base    = 0xb7000000
         self.csr_pdm_ao_base   = 0xb8000000
+        self.csr_ips_end       = 0xb9000000
 
         self.periph_offset     = 0x00100000
         self.motor_offset      = 0x00000100
@@ -100,6 +110,9 @@ class MySoC(wiring.Component):
     def elaborate(self, platform):
         m = Module()
 
+        if self.csr_data_width not in (8, 32):
+            raise ValueError(f"MySoC CSR data width must be 8 or 32, not {self.csr_data_width}")
+
         wb_arbiter  = wishbone.Arbiter(addr_width=30, data_width=32, granularity=8)
         wb_decoder  = wishbone.Decoder(addr_width=30, data_width=32, granularity=8)
         csr_decoder = csr.Decoder(addr_width=28, data_width=8)
@@ -108,6 +121,14 @@ class MySoC(wiring.Component):
         m.submodules.wb_decoder  = wb_decoder
         m.submodules.csr_decoder = csr_decoder
 
+        # CSR decoder of the project IPs, which addresses them in bus words
+        if self.csr_data_width == 32:
+            csr_ips_decoder = csr.Decoder(addr_width=26, data_width=32)
+            m.submodules.csr_ips_decoder = csr_ips_decoder
+        else:
+            csr_ips_decoder = csr_decoder
+        csr_ips_word = self.csr_data_width // 8
+
         connect(m, wb_arbiter.bus, wb_decoder.bus)
 
         # Software
@@ -210,19 +231,30 @@ class MySoC(wiring.Component):
             setattr(m.submodules, f"i2c_{i}", i2c)
 
         # Motor drivers
-        for i in range(self.motor_count):
-            motor_pwm = PWMPeripheral(pins=getattr(self, f"motor_pwm{i}"))
-            base_addr = self.csr_motor_base + i * self.motor_offset
-            csr_decoder.add(motor_pwm.bus, name=f"motor_pwm{i}", addr=base_addr - self.csr_base)
-
-            sw.add_periph("motor_pwm", f"MOTOR_PWM{i}", base_addr)
-            setattr(m.submodules, f"motor_pwm{i}", motor_pwm)
+        if self.motor_bank:
+            motor_pwm_bank = PWMBank(pins=[getattr(self, f"motor_pwm{i}") for i in range(self.motor_count)],
+                                     shared_timebase=self.motor_shared_timebase,
+                                     data_width=self.csr_data_width)
+            csr_ips_decoder.add(motor_pwm_bank.bus, name="motor_pwm_bank",
+                                addr=(self.csr_motor_base - self.csr_base) // csr_ips_word)
+
+            sw.add_periph("pwm_bank", "MOTOR_PWM_BANK", self.csr_motor_base)
+            m.submodules.motor_pwm_bank = motor_pwm_bank
+        else:
+            for i in range(self.motor_count):
+                motor_pwm = PWMPeripheral(pins=getattr(self, f"motor_pwm{i}"), data_width=self.csr_data_width)
+                base_addr = self.csr_motor_base + i * self.motor_offset
+                csr_ips_decoder.add(motor_pwm.bus, name=f"motor_pwm{i}",
+                                    addr=(base_addr - self.csr_base) // csr_ips_word)
+
+                sw.add_periph("motor_pwm", f"MOTOR_PWM{i}", base_addr)
+                setattr(m.submodules, f"motor_pwm{i}", motor_pwm)
 
         # # pdm_ao
         # for i in range(self.pdm_ao_count):
-        #     pdm = PDMPeripheral(bitwidth=10)
+        #     pdm = PDMPeripheral(bitwidth=10, data_width=self.csr_data_width)
         #     base_addr = self.csr_pdm_ao_base + i * self.pdm_ao_offset
-        #     csr_decoder.add(pdm.bus, name=f"pdm{i}", addr=base_addr  - self.csr_base)
+        #     csr_ips_decoder.add(pdm.bus, name=f"pdm{i}", addr=(base_addr - self.csr_base) // csr_ips_word)
         # 
         #     sw.add_periph("pdm", f"PDM{i}", base_addr)
         #     setattr(m.submodules, f"pdm{i}", pdm)
@@ -238,10 +270,21 @@ class MySoC(wiring.Component):
         # Wishbone-CSR bridge
 
         wb_to_csr = WishboneCSRBridge(csr_decoder.bus, data_width=32)
-        wb_decoder.add(wb_to_csr.wb_bus, name="csr", addr=self.csr_base, sparse=False)
-
         m.submodules.wb_to_csr = wb_to_csr
 
+        if self.csr_data_width == 32:
+            wb_to_csr_ips = WishboneCSRBridge(csr_ips_decoder.bus, data_width=32)
+            csr_split = WishboneCSRSplit(addr_width=26, wide_start=self.csr_motor_base - self.csr_base,
+                                         wide_end=self.csr_ips_end - self.csr_base)
+            connect(m, csr_split.narrow, wb_to_csr.wb_bus)
+            connect(m, csr_split.wide, wb_to_csr_ips.wb_bus)
+            wb_decoder.add(csr_split.bus, name="csr", addr=self.csr_base, sparse=False)
+
+            m.submodules.wb_to_csr_ips = wb_to_csr_ips
+            m.submodules.csr_split = csr_split
+        else:
+            wb_decoder.add(wb_to_csr.wb_bus, name="csr", addr=self.csr_base, sparse=False)
+
         # Debug support
 
         # m.submodules.jtag_provider = platform.providers.JTAGProvider(debug)
@@ -0,0 +1,108 @@
+"""Compare the area and retargeting bus cycles of a PWMBank against separate PWMPeripherals.
+
+    cd my_design/ips && python bench_pwm_bank.py [--channels 10]
+
+The area is the number of cells and flip-flops after a generic `synth` in Yosys (yowasp-yosys) of
+the motor drivers as `MySoC` instantiates them, including the CSR decoder windows they need.
+The bus cycles are those of the 8-bit CSR bus for firmware to retarget every channel through the
+32-bit Wishbone to CSR bridge, which spends one CSR cycle on each byte lane of a Wishbone access,
+so that a register store costs 4 cycles whatever its width.
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+
+from amaranth import *
+from amaranth.back import rtlil
+from amaranth.lib import wiring
+from amaranth.lib.wiring import In, Out, flipped, connect
+from amaranth_soc import csr
+
+from pwm import PWMPeripheral, PWMPins
+from pwm_bank import PWMBank
+
+
+BUS_WORD_BYTES = 4
+
+
+class Motors(wiring.Component):
+    """The motor drivers of `MySoC` behind their part of the CSR decoder."""
+    def __init__(self, channels, *, bank, shared_timebase=False):
+        self._channels = channels
+        self._bank = bank
+        self._shared_timebase = shared_timebase
+        super().__init__({
+            "bus": In(csr.Signature(addr_width=12, data_width=8)),
+            **{f"motor_pwm{i}": Out(PWMPins.Signature()) for i in range(channels)},
+        })
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.decoder = decoder = csr.Decoder(addr_width=12, data_width=8)
+        pins = [getattr(self, f"motor_pwm{i}") for i in range(self._channels)]
+        if self._bank:
+            m.submodules.motor_pwm_bank = motor_pwm_bank = PWMBank(pins=pins, shared_timebase=self._shared_timebase)
+            decoder.add(motor_pwm_bank.bus, name="motor_pwm_bank", addr=0)
+        else:
+            for i in range(self._channels):
+                motor_pwm = PWMPeripheral(pins=pins[i])
+                decoder.add(motor_pwm.bus, name=f"motor_pwm{i}", addr=i * 0x100)
+                m.submodules[f"motor_pwm{i}"] = motor_pwm
+        connect(m, flipped(self.bus), decoder.bus)
+        return m
+
+
+def synth_stat(top):
+    """Cell and flip-flop counts of `top` after a generic `synth`."""
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "top.il"), "w") as f:
+            f.write(rtlil.convert(top, name="top"))
+        subprocess.run(["yowasp-yosys", "-q", "-p",
+                        "read_rtlil top.il; synth -flatten -top top; tee -q -o stat.json stat -json"],
+                       cwd=directory, check=True)
+        with open(os.path.join(directory, "stat.json")) as f:
+            design = json.load(f)["design"]
+    cells_by_type = design["num_cells_by_type"]
+    flops = sum(count for cell, count in cells_by_type.items() if "DFF" in cell.upper())
+    return int(design["num_cells"]), flops
+
+
+def retarget_cycles(channels, *, bank, shared_timebase=False, denom=False):
+    """CSR bus cycles for firmware to write `numr` (and with `denom`, `denom`) of every channel.
+
+    Separate peripherals take one store per register. The bank packs two 16-bit registers in a
+    bus word and takes one more store to `apply` them."""
+    if not bank:
+        stores = channels * (2 if denom else 1)
+    else:
+        pairs = (channels + 1) // 2
+        stores = pairs + 1
+        if denom:
+            stores += 1 if shared_timebase else pairs
+    return stores * BUS_WORD_BYTES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=10)
+    args = parser.parse_args()
+
+    configs = [
+        (f"{args.channels} x PWMPeripheral", dict(bank=False)),
+        ("PWMBank", dict(bank=True)),
+        ("PWMBank, shared timebase", dict(bank=True, shared_timebase=True)),
+    ]
+    baseline = None
+    for name, config in configs:
+        cells, flops = synth_stat(Motors(args.channels, **config))
+        if baseline is None:
+            baseline = cells
+        print(f"{name:28} {cells:6} cells ({100 * cells / baseline:5.1f}%), {flops:5} flip-flops, "
+              f"retarget numr in {retarget_cycles(args.channels, **config):3} CSR cycles, "
+              f"numr and denom in {retarget_cycles(args.channels, denom=True, **config):3}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measure how many cycles per second the reference models check, against simulating them.
+
+    cd my_design/ips && python bench_reference.py [--cycles 10000000] [--sim-cycles 20000]
+
+For a random register write schedule, the reference model is evaluated over `--cycles` cycles
+and compared with previously captured outputs, which is the cost of checking that many cycles.
+The Amaranth simulation is run and checked over `--sim-cycles` cycles for comparison.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import pdm_reference
+import pwm_reference
+import test_pdm
+from test_pwm import random_stop, simulate_schedule
+
+
+def bench_pwm(cycles, sim_cycles, seed):
+    rng = np.random.default_rng(seed)
+    bus_writes = pwm_reference.random_bus_writes(rng, cycles - 8, count=max(cycles // 5000, 1), max_denom=1000)
+    stop = random_stop(rng, cycles, pulses=max(cycles // 50000, 1))
+    captured = pwm_reference.pwm_reference(cycles, pwm_reference.effective_writes(bus_writes), stop)
+    start = time.perf_counter()
+    pwm, dir = pwm_reference.pwm_reference(cycles, pwm_reference.effective_writes(bus_writes), stop)
+    assert np.array_equal(pwm, captured[0]) and np.array_equal(dir, captured[1])
+    reference_rate = cycles / (time.perf_counter() - start)
+
+    bus_writes = pwm_reference.random_bus_writes(rng, sim_cycles - 8, count=max(sim_cycles // 50, 1), max_denom=40)
+    stop = random_stop(rng, sim_cycles, pulses=max(sim_cycles // 1000, 1))
+    start = time.perf_counter()
+    sim_pwm, sim_dir = simulate_schedule(sim_cycles, bus_writes, stop)
+    ref_pwm, ref_dir = pwm_reference.pwm_reference(sim_cycles, pwm_reference.effective_writes(bus_writes), stop)
+    matches = np.array_equal(sim_pwm, ref_pwm) and np.array_equal(sim_dir, ref_dir)
+    sim_rate = sim_cycles / (time.perf_counter() - start)
+    return reference_rate, sim_rate, matches
+
+
+def bench_pdm(cycles, sim_cycles, seed, bitwidth=10):
+    # a sine updated every 256 cycles, so that the modulator is stepped through many levels
+    writes = pdm_reference.sine_writes(cycles, bitwidth=bitwidth, period=256 * 977.3, update=256)
+    captured = pdm_reference.pdm_reference(cycles, writes, bitwidth=bitwidth)
+    start = time.perf_counter()
+    pdm = pdm_reference.pdm_reference(cycles, writes, bitwidth=bitwidth)
+    assert np.array_equal(pdm, captured)
+    reference_rate = cycles / (time.perf_counter() - start)
+
+    rng = np.random.default_rng(seed)
+    bus_writes = test_pdm.random_bus_writes(rng, sim_cycles - 8, count=max(sim_cycles // 60, 1), bitwidth=bitwidth)
+    start = time.perf_counter()
+    sim_pdm = test_pdm.simulate_schedule(sim_cycles, bus_writes, bitwidth=bitwidth)
+    matches = np.array_equal(sim_pdm, pdm_reference.pdm_reference(
+        sim_cycles, pdm_reference.effective_writes(bus_writes), bitwidth=bitwidth))
+    sim_rate = sim_cycles / (time.perf_counter() - start)
+    return reference_rate, sim_rate, matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=10_000_000)
+    parser.add_argument("--sim-cycles", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for name, bench in (("PWMPeripheral", bench_pwm), ("PDMPeripheral", bench_pdm)):
+        reference_rate, sim_rate, matches = bench(args.cycles, args.sim_cycles, args.seed)
+        print(f"{name}: reference {reference_rate:12.0f} cycles/s, "
+              f"simulation {sim_rate:10.0f} cycles/s ({'matches' if matches else 'MISMATCH'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Time the IP test suites with waveform tracing off and with every signal traced.
+
+    cd my_design/ips && python bench_trace.py [--repeat 3] [test_pwm test_pdm]
+
+Each suite runs in a fresh interpreter under unittest, with its traces written to a temporary
+directory.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_suite(module, trace, trace_dir):
+    env = dict(os.environ, IPS_TRACE=trace, IPS_TRACE_DIR=trace_dir)
+    env.pop("IPS_TRACE_SIGNALS", None)
+    env.pop("IPS_TRACE_WINDOW", None)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "unittest", "-q", module], env=env, check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=["test_pwm", "test_pdm"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        with tempfile.TemporaryDirectory() as trace_dir:
+            traced = min(run_suite(module, "1", trace_dir) for _ in range(args.repeat))
+            size = sum(os.path.getsize(os.path.join(trace_dir, name)) for name in os.listdir(trace_dir))
+            untraced = min(run_suite(module, "0", trace_dir) for _ in range(args.repeat))
+        print(f"{module}: traced {traced:.2f} s ({size / 1024:.0f} KiB of traces), "
+              f"untraced {untraced:.2f} s, speedup {traced / untraced:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import numpy as np
+
+from amaranth.hdl import Shape
+
+__all__ = ["CSRDriver", "sample", "simulate_schedule", "WRITE_LATENCY", "effective_writes",
+           "register_values", "bus_registers"]
+
+
+# Cycles from the bus cycle that writes the last word of a register to the first cycle in which
+# its fields hold the new value: one in the `csr.Bridge` multiplexer and one in the field.
+WRITE_LATENCY = 2
+
+
+class CSRDriver:
+    """Drives a `csr.Signature` bus from an async testbench.
+
+    Registers wider than the bus are accessed one bus word at a time, lowest address first, as the
+    CPU does. `size` is the number of bus words a register occupies (4 for a 32-bit register on an
+    8-bit bus).
+    """
+    def __init__(self, ctx, bus):
+        self._ctx = ctx
+        self._bus = bus
+        self._data_width = len(bus.w_data)
+        self._mask = (1 << self._data_width) - 1
+
+    async def _write_words(self, addr, value, size):
+        for i in range(size):
+            self._ctx.set(self._bus.addr, addr + i)
+            self._ctx.set(self._bus.w_data, (value >> (self._data_width * i)) & self._mask)
+            self._ctx.set(self._bus.w_stb, 1)
+            await self._ctx.tick()
+
+    async def _read_words(self, addr, size):
+        result = 0
+        for i in range(size):
+            self._ctx.set(self._bus.addr, addr + i)
+            self._ctx.set(self._bus.r_stb, 1)
+            await self._ctx.tick()
+            result |= self._ctx.get(self._bus.r_data) << (self._data_width * i)
+        return result
+
+    async def write(self, addr, value, size=4):
+        await self._write_words(addr, value, size)
+        self._ctx.set(self._bus.w_stb, 0)
+
+    async def read(self, addr, size=4):
+        result = await self._read_words(addr, size)
+        self._ctx.set(self._bus.r_stb, 0)
+        return result
+
+    async def write_burst(self, writes):
+        """Write a sequence of `(addr, value)` or `(addr, value, size)` back to back, with the write
+        strobe held between registers."""
+        for addr, value, *size in writes:
+            await self._write_words(addr, value, size[0] if size else 4)
+        self._ctx.set(self._bus.w_stb, 0)
+
+    async def read_burst(self, reads):
+        """Read a sequence of `addr` or `(addr, size)` back to back; returns the values in order."""
+        results = []
+        for read in reads:
+            addr, size = read if isinstance(read, tuple) else (read, 4)
+            results.append(await self._read_words(addr, size))
+        self._ctx.set(self._bus.r_stb, 0)
+        return results
+
+
+async def sample(ctx, signal, cycles, *, domain="sync"):
+    """Capture `signal` on each of the next `cycles` clock cycles, starting with its current value.
+
+    Returns a NumPy array, so that a whole waveform can be checked at once; the simulation is left
+    `cycles` clock cycles later.
+    """
+    shape = Shape.cast(signal.shape())
+    if shape.width > 63:
+        dtype = object
+    else:
+        dtype = np.int64 if shape.signed else np.uint64
+    values = np.empty(cycles, dtype=dtype)
+    ticks = ctx.tick(domain).sample(signal).__aiter__()
+    try:
+        for n in range(cycles):
+            _, _, values[n] = await ticks.__anext__()
+    finally:
+        await ticks.aclose()
+    return values
+
+
+def simulate_schedule(dut, cycles, bus_writes, *, outputs, inputs=(), name, expected=None):
+    """Simulate `dut` for `cycles` cycles, performing `(cycle, addr, value, size)` writes on its bus
+    with `CSRDriver.write` and driving each `(signal, levels)` of `inputs` from `levels`, one per
+    cycle. `outputs` maps keys to signals; returns a dict of the same keys to their sampled values.
+
+    `expected` maps keys of `outputs` to the values they should have. They are compared at the end
+    of the testbench, so that a mismatch fails the simulation, which `sim_trace.simulate` can then
+    re-run with tracing.
+    """
+    from sim_trace import simulate
+
+    sampled = {}
+    def drive(signal, levels):
+        async def process(ctx):
+            for level in levels.tolist():
+                ctx.set(signal, level)
+                await ctx.tick()
+        return process
+    def sample_output(key, signal):
+        async def process(ctx):
+            sampled[key] = await sample(ctx, signal, cycles)
+        return process
+    async def testbench(ctx):
+        csr = CSRDriver(ctx, dut.bus)
+        cycle = 0
+        for start, addr, value, size in bus_writes:
+            if start > cycle:
+                await ctx.tick().repeat(start - cycle)
+            await csr.write(addr, value, size)
+            cycle = start + size
+        # one more cycle, so that the samplers see the last edge
+        await ctx.tick().repeat(cycles + 1 - cycle)
+        for key, values in (expected or {}).items():
+            np.testing.assert_array_equal(sampled[key], values, err_msg=f"{key} differs")
+    processes = ([drive(signal, levels) for signal, levels in inputs] +
+                 [sample_output(key, signal) for key, signal in outputs.items()])
+    simulate(dut, testbench, name, processes=processes)
+    return sampled
+
+
+def bus_registers(registers, data_width):
+    """Convert a map of register names to byte address and size, to address and size in words of a
+    `data_width`-bit bus, as `CSRDriver` and `effective_writes` take them."""
+    word_bytes = data_width // 8
+    return {name: (addr // word_bytes, -(-size // word_bytes)) for name, (addr, size) in registers.items()}
+
+
+def effective_writes(bus_writes, registers):
+    """Convert `(cycle, register, value)` writes, where `cycle` is the first bus cycle of a write
+    performed with `CSRDriver.write`, to the first cycle in which the register holds `value`.
+    `registers` maps each register name to its address and size in bus words."""
+    return [(cycle + registers[register][1] - 1 + WRITE_LATENCY, register, value)
+            for cycle, register, value in bus_writes]
+
+
+def register_values(cycles, writes, name):
+    """Value of register `name` in every cycle, given `(cycle, register, value)` writes that take
+    effect at `cycle` (see `effective_writes`). Registers reset to 0."""
+    updates = sorted((cycle, index, value) for index, (cycle, register, value) in enumerate(writes)
+                     if register == name and cycle < cycles)
+    if not updates:
+        return np.zeros(cycles, dtype=np.int64)
+    update_cycles = np.array([cycle for cycle, _, _ in updates])
+    update_values = np.array([0] + [value for _, _, value in updates], dtype=np.int64)
+    return update_values[np.searchsorted(update_cycles, np.arange(cycles), side="right")]
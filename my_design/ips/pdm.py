@@ -4,6 +4,8 @@ from amaranth.build import Platform
 
 from amaranth.lib import wiring
 from amaranth.lib.wiring import In, Out, flipped, connect
+from amaranth.lib.fifo import SyncFIFO
+from amaranth.utils import exact_log2
 from amaranth_soc import csr
 
 from chipflow_lib.platforms import OutputPinSignature
@@ -11,6 +13,10 @@ from chipflow_lib.platforms import OutputPinSignature
 __all__ = ["PDMPeripheral"]
 
 
+# Feedback taps of the 16-bit Galois LFSR that dithers the quantizer
+LFSR_TAPS = 0xB400
+
+
 class PDMPeripheral(wiring.Component):
     class OutVal(csr.Register, access="rw"):
         """Analog sample value"""
@@ -20,18 +26,76 @@ class PDMPeripheral(wiring.Component):
         """Configuration register """
         en: csr.Field(csr.action.RW, unsigned(1))
 
+    class StreamConf(csr.Register, access="rw"):
+        """Configuration register, with the modulator fed from the sample FIFO while `stream` is set"""
+        en: csr.Field(csr.action.RW, unsigned(1))
+        stream: csr.Field(csr.action.RW, unsigned(1))
+
+    class Fifo(csr.Register, access="w"):
+        """Sample FIFO, ignores writes while full"""
+        val: csr.Field(csr.action.W, unsigned(16))
+
+    class Rate(csr.Register, access="rw"):
+        """Sample rate divider: a sample is taken from the FIFO every `val + 1` cycles"""
+        val: csr.Field(csr.action.RW, unsigned(16))
+
+    class FifoStatus(csr.Register, access="r"):
+        """FIFO status register"""
+        def __init__(self, depth):
+            super().__init__({
+                "half_empty": csr.Field(csr.action.R, unsigned(1)),
+                "level": csr.Field(csr.action.R, range(depth + 1)),
+            })
+
+    class FifoInt(csr.Register, access="rw"):
+        """FIFO interrupt register"""
+        underrun: csr.Field(csr.action.RW1C, unsigned(1))
+        overflow: csr.Field(csr.action.RW1C, unsigned(1))
+
+    class FifoDepth(csr.Register, access="r"):
+        """FIFO depth, in samples"""
+        val: csr.Field(csr.action.R, unsigned(16))
+
     WiringSignature = OutputPinSignature(1)
 
-    def __init__(self, *, bitwidth):
+    def __init__(self, *, bitwidth, order=1, divider=1, dither=False, fifo_depth=0, data_width=8):
+        """`order` 1 without `dither` is the original first-order modulator. Orders 2 and 3, or
+        `dither`, use a cascade of saturating integrators with the 1-bit output fed back to each,
+        cleared while disabled; order 3 is only stable for `outval` within about 10% to 90% of
+        full scale. With `dither`, an LFSR adds noise of up to half full scale to the quantizer.
+        The modulator steps once every `divider` clock cycles.
+
+        With a `fifo_depth`, samples written to `fifo` are played at the rate set in `rate` while
+        `stream` is set in `conf`; an empty FIFO sets `underrun` and holds the last sample.
+
+        The registers are at the same byte offsets whatever the `data_width` of the CSR bus (8, 16
+        or 32 bits)."""
+        if order not in (1, 2, 3):
+            raise ValueError(f"PDMPeripheral order must be 1, 2 or 3, not {order}")
+        if divider < 1:
+            raise ValueError(f"PDMPeripheral divider must be at least 1, not {divider}")
+        if data_width not in (8, 16, 32):
+            raise ValueError(f"PDMPeripheral data width must be 8, 16 or 32, not {data_width}")
         self._bitwidth = bitwidth
+        self._order = order
+        self._divider = divider
+        self._dither = dither
+        self._fifo_depth = fifo_depth
 
-        addr_width=3
-        data_width=8
+        addr_width=(5 if fifo_depth else 3) - exact_log2(data_width // 8)
 
         regs = csr.Builder(addr_width=addr_width, data_width=data_width)
 
         self._outval = regs.add("outval", self.OutVal(), offset=0x0)
-        self._conf = regs.add("conf", self.Conf(), offset=0x4)
+        if fifo_depth:
+            self._conf = regs.add("conf", self.StreamConf(), offset=0x4)
+            self._fifo = regs.add("fifo", self.Fifo(), offset=0x8)
+            self._rate = regs.add("rate", self.Rate(), offset=0xC)
+            self._fifo_status = regs.add("fifo_status", self.FifoStatus(fifo_depth), offset=0x10)
+            self._fifo_int = regs.add("fifo_int", self.FifoInt(), offset=0x14)
+            self._fifo_depth_reg = regs.add("fifo_depth", self.FifoDepth(), offset=0x18)
+        else:
+            self._conf = regs.add("conf", self.Conf(), offset=0x4)
 
         self._bridge = csr.Bridge(regs.as_memory_map())
 
@@ -46,20 +110,98 @@ class PDMPeripheral(wiring.Component):
     def bitwidth(self):
         return self._bitwidth
 
+    @property
+    def order(self):
+        return self._order
+
+    @property
+    def divider(self):
+        return self._divider
+
+    @property
+    def dither(self):
+        return self._dither
+
+    @property
+    def fifo_depth(self):
+        return self._fifo_depth
+
     def elaborate(self, platform):
         m = Module()
         m.submodules.bridge = self._bridge
+        connect(m, flipped(self.bus), self._bridge.bus)
+
+        # clock enable of the modulator
+        step = Signal()
+        if self._divider == 1:
+            m.d.comb += step.eq(1)
+        else:
+            divide = Signal(range(self._divider))
+            with m.If(divide == self._divider - 1):
+                m.d.sync += divide.eq(0)
+            with m.Else():
+                m.d.sync += divide.eq(divide + 1)
+            m.d.comb += step.eq(divide == self._divider - 1)
+
+        # value being modulated
+        value = Signal(unsigned(16))
+        if self._fifo_depth:
+            sample = self._elaborate_fifo(m)
+            m.d.comb += value.eq(Mux(self._conf.f.stream.data, sample, self._outval.f.val.data))
+        else:
+            m.d.comb += value.eq(self._outval.f.val.data)
+
+        pdm_ao = Signal()
+        with m.If(step):
+            if self._order == 1 and not self._dither:
+                self._elaborate_first_order(m, value, pdm_ao)
+            else:
+                self._elaborate_cascade(m, value, pdm_ao)
+
+        with m.If(self._conf.f.en.data == 1):
+            m.d.comb += self.pdm.o.eq(pdm_ao)
+        with m.Else():
+            m.d.comb += self.pdm.o.eq(0)
+        return m
+
+    def _elaborate_fifo(self, m):
+        m.submodules.fifo = fifo = SyncFIFO(width=16, depth=self._fifo_depth)
+        m.d.comb += [
+            fifo.w_data.eq(self._fifo.f.val.w_data),
+            fifo.w_en.eq(self._fifo.f.val.w_stb),
+            self._fifo_int.f.overflow.set.eq(self._fifo.f.val.w_stb & ~fifo.w_rdy),
+            self._fifo_status.f.level.r_data.eq(fifo.level),
+            self._fifo_status.f.half_empty.r_data.eq(fifo.level <= self._fifo_depth // 2),
+            self._fifo_depth_reg.f.val.r_data.eq(self._fifo_depth),
+        ]
+
+        # rate timer, taking a sample every `rate + 1` cycles while streaming
+        timer = Signal(unsigned(16))
+        sample = Signal(unsigned(16))
+        with m.If((self._conf.f.en.data == 1) & (self._conf.f.stream.data == 1)):
+            with m.If(timer == self._rate.f.val.data):
+                m.d.sync += timer.eq(0)
+                with m.If(fifo.r_rdy):
+                    m.d.comb += fifo.r_en.eq(1)
+                    m.d.sync += sample.eq(fifo.r_data)
+                with m.Else():
+                    m.d.comb += self._fifo_int.f.underrun.set.eq(1)
+            with m.Else():
+                m.d.sync += timer.eq(timer + 1)
+        with m.Else():
+            m.d.sync += timer.eq(0)
+        return sample
+
+    def _elaborate_first_order(self, m, value, pdm_ao):
         maxval = Const(int((2**self._bitwidth)-1), unsigned(self._bitwidth))        
         error = Signal(unsigned(self._bitwidth), init=0x0)
         error_0 = Signal(unsigned(self._bitwidth), init=0x0)
         error_1 = Signal(unsigned(self._bitwidth), init=0x0)
-        pdm_ao = Signal()
-        connect(m, flipped(self.bus), self._bridge.bus)
         m.d.sync += [
-            error_1.eq(error + maxval - self._outval.f.val.data),
-            error_0.eq(error - self._outval.f.val.data),
+            error_1.eq(error + maxval - value),
+            error_0.eq(error - value),
         ]
-        with m.If(self._outval.f.val.data >= error):
+        with m.If(value >= error):
             m.d.sync += [
                 pdm_ao.eq(1),
                 error.eq(error_1),
@@ -70,8 +212,42 @@ class PDMPeripheral(wiring.Component):
                 error.eq(error_0),
             ]
 
+    def _elaborate_cascade(self, m, value, pdm_ao):
+        full_scale = (1 << self._bitwidth) - 1
+        width = self._bitwidth + 6 # see pdm_reference.integrator_width
+        low, high = -(1 << (width - 1)), (1 << (width - 1)) - 1
+
+        # input and output around mid-scale, doubled to stay integers
+        x2 = Signal(signed(self._bitwidth + 2))
+        y2 = Signal(signed(self._bitwidth + 1))
+        m.d.comb += [
+            x2.eq(2 * Mux(value > full_scale, full_scale, value) - full_scale),
+            y2.eq(Mux(pdm_ao, full_scale, -full_scale)),
+        ]
+
+        integrators = [Signal(signed(width), name=f"integrator_{i}") for i in range(self._order)]
+        if self._order == 1:
+            sums = [integrators[0] + x2 - y2]
+        elif self._order == 2:
+            sums = [integrators[0] + x2 - y2, integrators[1] + integrators[0] - 2 * y2]
+        else:
+            sums = [integrators[0] + x2 - y2, integrators[1] + (integrators[0] >> 3) - y2,
+                    integrators[2] + integrators[1] - 3 * y2]
+        saturated = [Signal(signed(width), name=f"saturated_{i}") for i in range(self._order)]
+        for clamped, total in zip(saturated, sums):
+            m.d.comb += clamped.eq(Mux(total > high, high, Mux(total < low, low, total)))
+
+        quantizer = Signal(signed(width + 1))
+        if self._dither:
+            lfsr = Signal(16, init=1)
+            m.d.sync += lfsr.eq((lfsr >> 1) ^ Mux(lfsr[0], LFSR_TAPS, 0))
+            m.d.comb += quantizer.eq(saturated[-1] + lfsr[:self._bitwidth].as_signed())
+        else:
+            m.d.comb += quantizer.eq(saturated[-1])
+
         with m.If(self._conf.f.en.data == 1):
-            m.d.comb += self.pdm.o.eq(pdm_ao)
+            m.d.sync += [integrator.eq(clamped) for integrator, clamped in zip(integrators, saturated)]
+            m.d.sync += pdm_ao.eq(quantizer >= 0)
         with m.Else():
-            m.d.comb += self.pdm.o.eq(0)
-        return m
+            m.d.sync += [integrator.eq(0) for integrator in integrators]
+            m.d.sync += pdm_ao.eq(0)
@@ -0,0 +1,282 @@
+import argparse
+import collections
+import itertools
+
+import numpy as np
+
+import csr_driver
+
+__all__ = ["REGISTERS", "LFSR_TAPS", "integrator_width", "stream_samples", "pdm_reference",
+           "effective_writes", "target_density", "running_error", "snr_db", "sine_writes"]
+
+
+# Address and size in bytes of each writable register of `PDMPeripheral`, which are bus words on an
+# 8-bit bus (see `csr_driver.bus_registers` for wider buses)
+REGISTERS = {
+    "outval":   (0x00, 2),
+    "conf":     (0x04, 1),
+    "fifo":     (0x08, 2),
+    "rate":     (0x0C, 2),
+    "fifo_int": (0x14, 1),
+}
+
+# Feedback taps of the 16-bit Galois LFSR that dithers the quantizer
+LFSR_TAPS = 0xB400
+
+
+def integrator_width(bitwidth):
+    """Width of the signed integrators of the cascade modulators, which saturate when overloaded."""
+    return bitwidth + 6
+
+
+def _first_order_step(bitwidth):
+    """The original modulator. State: `error`, `error_0`, `error_1`, `pdm_ao`."""
+    mask = (1 << bitwidth) - 1
+    maxval = mask
+    def step(state, inputs):
+        value, _ = inputs
+        error, error_0, error_1, _ = state
+        # `error_0` and `error_1` are registered, so `error` is updated from the values computed
+        # from it on the previous step
+        if value >= error:
+            return (error_1, (error - value) & mask, (error + maxval - value) & mask, 1)
+        return (error_0, (error - value) & mask, (error + maxval - value) & mask, 0)
+    return step, (0, 0, 0, 0)
+
+
+def _lfsr_next(lfsr):
+    return (lfsr >> 1) ^ (LFSR_TAPS if lfsr & 1 else 0)
+
+
+def _cifb_step(bitwidth, order, dither):
+    """Cascade of `order` saturating integrators with feedback of the 1-bit output to each.
+    State: the dither LFSR (with `dither`), the integrators and `pdm_ao`."""
+    full_scale = (1 << bitwidth) - 1
+    width = integrator_width(bitwidth)
+    low, high = -(1 << (width - 1)), (1 << (width - 1)) - 1
+    def step(state, inputs):
+        value, en = inputs
+        if dither:
+            lfsr, *integrators, y = state
+            lfsr = (_lfsr_next(lfsr),)
+        else:
+            lfsr = ()
+            *integrators, y = state
+        if not en:
+            return (*lfsr, *[0] * order, 0)
+        # input and output around mid-scale, doubled to stay integers
+        x2 = 2 * min(value, full_scale) - full_scale
+        y2 = full_scale if y else -full_scale
+        if order == 1:
+            sums = [integrators[0] + x2 - y2]
+        elif order == 2:
+            sums = [integrators[0] + x2 - y2, integrators[1] + integrators[0] - 2 * y2]
+        else:
+            sums = [integrators[0] + x2 - y2, integrators[1] + (integrators[0] >> 3) - y2,
+                    integrators[2] + integrators[1] - 3 * y2]
+        sums = [min(max(total, low), high) for total in sums]
+        quantizer = sums[-1]
+        if dither:
+            noise = state[0] & ((1 << bitwidth) - 1)
+            quantizer += noise - (1 << bitwidth) if noise >> (bitwidth - 1) else noise
+        return (*lfsr, *sums, int(quantizer >= 0))
+    return step, (*((1,) if dither else ()), *[0] * order, 0)
+
+
+def _modulate(inputs, step, state):
+    """The `pdm_ao` register before each step of the modulator, for its `(outval, en)` on each step.
+
+    The modulator is a non-linear recurrence, so it is stepped one at a time; but while its inputs
+    are constant its state is periodic, so each run of constant inputs is only stepped until its
+    state repeats, and the rest of the run is tiled from the step found.
+    """
+    steps = len(inputs)
+    pdm_ao = np.empty(steps, dtype=np.uint8)
+    bounds = np.flatnonzero((inputs[1:] != inputs[:-1]).any(axis=1)) + 1
+    for start, end in zip([0, *bounds], [*bounds, steps]):
+        value = (int(inputs[start, 0]), int(inputs[start, 1]))
+        seen = {}
+        states = []
+        index = start
+        while index < end:
+            if state in seen:
+                first = seen[state]
+                period = index - first
+                pdm_ao[index:end] = np.resize(pdm_ao[first:index], end - index)
+                state = states[first - start + (end - first) % period]
+                break
+            seen[state] = index
+            states.append(state)
+            pdm_ao[index] = state[-1]
+            state = step(state, value)
+            index += 1
+    return pdm_ao
+
+
+def _rate_ticks(streaming, rate):
+    """Cycles in which the rate timer takes a sample: it counts while streaming, and wraps after
+    reaching `rate`. Computed a run of constant `streaming` and `rate` at a time."""
+    cycles = len(streaming)
+    ticks = []
+    bounds = np.flatnonzero((streaming[1:] != streaming[:-1]) | (rate[1:] != rate[:-1])) + 1
+    timer = 0
+    for start, end in zip([0, *bounds], [*bounds, cycles]):
+        if not streaming[start]:
+            timer = 0
+            continue
+        period = int(rate[start]) + 1
+        # a timer above `rate` counts up to its 16-bit wrap first
+        first = start + (period - 1 - timer if timer < period else (1 << 16) - timer + period - 1)
+        run_ticks = np.arange(first, end, period)
+        ticks.append(run_ticks)
+        timer = end - 1 - run_ticks[-1] if len(run_ticks) else (timer + end - start) & 0xFFFF
+    return np.concatenate(ticks) if ticks else np.zeros(0, dtype=np.int64)
+
+
+def stream_samples(cycles, writes, *, depth):
+    """The sample played from the FIFO of `PDMPeripheral(fifo_depth=depth)` in every cycle, for
+    `writes` as for `pdm_reference`, with the cycles in which an underrun and an overflow set their
+    flags. Samples are pushed on the cycle before their write takes effect, and each tick of the
+    rate timer pops one for the next cycle."""
+    conf = csr_driver.register_values(cycles, writes, "conf")
+    rate = csr_driver.register_values(cycles, writes, "rate") & 0xFFFF
+    ticks = _rate_ticks((conf & 3) == 3, rate)
+    pushes = [(cycle - 1, 0, value & 0xFFFF) for cycle, register, value in writes
+              if register == "fifo" and 0 < cycle <= cycles]
+    events = sorted(pushes + [(int(tick), 1, 0) for tick in ticks])
+
+    fifo = collections.deque()
+    sample_cycles, sample_values, underruns, overflows = [0], [0], [], []
+    for cycle, group in itertools.groupby(events, key=lambda event: event[0]):
+        # the FIFO is read and written on the same edge, from its level before it
+        level = len(fifo)
+        for _, kind, value in group:
+            if kind == 1 and level:
+                sample_cycles.append(cycle + 1)
+                sample_values.append(fifo.popleft())
+            elif kind == 1:
+                underruns.append(cycle + 1)
+            elif level < depth:
+                fifo.append(value)
+            else:
+                overflows.append(cycle + 1)
+    sample = np.array(sample_values, dtype=np.int64)[
+        np.searchsorted(np.array(sample_cycles), np.arange(cycles), side="right") - 1]
+    return sample, np.array(underruns, dtype=np.int64), np.array(overflows, dtype=np.int64)
+
+
+def pdm_reference(cycles, writes=(), *, bitwidth, order=1, divider=1, dither=False, fifo_depth=0):
+    """Compute the `pdm` output of `PDMPeripheral(bitwidth=bitwidth, ...)` over `cycles` clock cycles.
+
+    `writes` is a sequence of `(cycle, register, value)`, where `register` is a key of `REGISTERS`
+    and `cycle` is the first cycle in which the register holds `value` (see `effective_writes`).
+    Returns an array of `cycles` bits, as `sample()` would capture them from the simulation.
+    """
+    outval = csr_driver.register_values(cycles, writes, "outval") & 0xFFFF
+    conf = csr_driver.register_values(cycles, writes, "conf")
+    en = conf & 1
+    if fifo_depth:
+        sample, _, _ = stream_samples(cycles, writes, depth=fifo_depth)
+        outval = np.where(conf & 2, sample, outval)
+    if order == 1 and not dither:
+        step, state = _first_order_step(bitwidth)
+    else:
+        step, state = _cifb_step(bitwidth, order, dither)
+    # the modulator steps at the end of every `divider`-th cycle, on the inputs of that cycle, and
+    # one more step gives the output of the cycles after the last one
+    step_cycles = np.minimum(np.arange(cycles // divider + 1) * divider + divider - 1, cycles - 1)
+    pdm_ao = _modulate(np.stack([outval[step_cycles], en[step_cycles]], axis=1), step, state)
+    return pdm_ao[np.arange(cycles) // divider] & en.astype(np.uint8)
+
+
+def effective_writes(bus_writes, *, data_width=8):
+    """Convert `(cycle, register, value)` bus writes, where `cycle` is the first bus cycle of the
+    write on a `data_width`-bit bus, to the cycles at which they take effect, for `pdm_reference`."""
+    return csr_driver.effective_writes(bus_writes, csr_driver.bus_registers(REGISTERS, data_width))
+
+
+def target_density(outval, bitwidth):
+    """The density of ones the modulator converges to for `outval`: each one adds the full scale
+    `2**bitwidth - 1` to the error, and every cycle subtracts `outval`."""
+    return np.minimum(np.asarray(outval) / ((1 << bitwidth) - 1), 1.0)
+
+
+def running_error(bits, density):
+    """Accumulated difference between the output and the target density, in cycles of output:
+    bounded for a working modulator, however long the run."""
+    return np.cumsum(bits - np.asarray(density, dtype=np.float64))
+
+
+def snr_db(bits, frequency, bandwidth):
+    """Signal to noise ratio in dB of a bitstream that encodes a sine of `frequency` (in cycles per
+    clock cycle), counting the noise below `bandwidth` (in the same units) after removing DC.
+
+    The power in the bins of a Hann window around the sine counts as signal, everything else in
+    the band as noise; so the result also reflects the in-band noise floor of the modulator.
+    """
+    bits = np.asarray(bits, dtype=np.float64)
+    spectrum = np.abs(np.fft.rfft((bits - bits.mean()) * np.hanning(len(bits)))) ** 2
+    bins = np.fft.rfftfreq(len(bits))
+    signal_bin = int(round(frequency * len(bits)))
+    signal = np.zeros(len(bins), dtype=bool)
+    signal[max(signal_bin - 2, 1):signal_bin + 3] = True
+    # DC and the bins it leaks into through the window are not noise either
+    in_band = (np.arange(len(bins)) > 2) & (bins <= bandwidth)
+    noise = spectrum[in_band & ~signal].sum()
+    return 10 * np.log10(spectrum[signal].sum() / noise)
+
+
+def sine_writes(cycles, *, bitwidth, period, update, amplitude=0.45):
+    """Writes of a sine of `period` cycles around mid-scale to `outval`, one every `update` cycles,
+    after enabling the output."""
+    full_scale = (1 << bitwidth) - 1
+    times = np.arange(0, cycles, update)
+    values = np.round((0.5 + amplitude * np.sin(2 * np.pi * times / period)) * full_scale).astype(int)
+    return [(0, "conf", 1)] + [(int(time), "outval", int(value)) for time, value in zip(times, values)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the long-run output quality of the PDMPeripheral modulator.")
+    parser.add_argument("--bitwidth", type=int, default=10)
+    parser.add_argument("--order", type=int, default=1, choices=(1, 2, 3))
+    parser.add_argument("--divider", type=int, default=1)
+    parser.add_argument("--dither", action="store_true")
+    parser.add_argument("--samples", type=int, default=10_000_000)
+    parser.add_argument("--levels", type=int, default=64,
+        help="number of constant output levels to sweep for the density error")
+    parser.add_argument("--update", type=int, default=256,
+        help="cycles between updates of `outval` for the sine, i.e. the oversampling ratio")
+    parser.add_argument("--amplitude", type=float, default=0.4,
+        help="amplitude of the sine, as a fraction of full scale (order 3 overloads above about 0.4)")
+    args = parser.parse_args()
+    options = dict(bitwidth=args.bitwidth, order=args.order, divider=args.divider, dither=args.dither)
+
+    full_scale = (1 << args.bitwidth) - 1
+    worst = (0.0, 0, 0.0)
+    for level in np.unique(np.linspace(0, full_scale, args.levels).astype(int)):
+        bits = pdm_reference(args.samples // args.levels, [(0, "conf", 1), (0, "outval", int(level))], **options)
+        density = target_density(level, args.bitwidth)
+        error = bits.mean() - density
+        drift = np.abs(running_error(bits, density)).max()
+        if abs(error) >= abs(worst[0]):
+            worst = (error, level, drift)
+        print(f"outval {level:6}: density {bits.mean():.6f} (target {density:.6f}, error {error:+.6f}), "
+              f"max running error {drift:.1f}")
+    print(f"worst density error {worst[0]:+.6f} at outval {worst[1]}")
+
+    # a whole number of periods, not a multiple of the update interval
+    period = args.samples / (round(args.samples / (args.update * 977.3)) | 1)
+    writes = sine_writes(args.samples, bitwidth=args.bitwidth, period=period, update=args.update,
+                         amplitude=args.amplitude)
+    print(f"sine over {args.samples} clock cycles, SNR in a band of 1/{2 * args.update} of the clock:")
+    for order in (1, 2, 3):
+        for dither in (False, True):
+            bits = pdm_reference(args.samples, writes, bitwidth=args.bitwidth, order=order,
+                                 divider=args.divider, dither=dither)
+            print(f"  order {order}, divider {args.divider}{', dither' if dither else ''}: "
+                  f"{snr_db(bits, 1 / period, 1 / (2 * args.update)):.1f} dB")
+
+
+if __name__ == "__main__":
+    main()
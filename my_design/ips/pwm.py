@@ -5,6 +5,7 @@ from amaranth.build import Platform
 from amaranth.lib import wiring
 from amaranth.lib.wiring import In, Out, flipped, connect
 from amaranth.lib.cdc import FFSynchronizer
+from amaranth.utils import exact_log2
 from amaranth_soc import csr
 
 from chipflow_lib.platforms import OutputPinSignature, InputPinSignature
@@ -54,11 +55,17 @@ class PWMPeripheral(wiring.Component):
         """
         stop_pin: csr.Field(csr.action.R, unsigned(1))   
       
-    """pwm peripheral."""
-    def __init__(self, *, pins):
+    """pwm peripheral.
+
+    The registers are at the same byte offsets whatever the `data_width` of the CSR bus (8, 16 or
+    32 bits); a 32-bit bus accesses each of them in a single cycle.
+    """
+    def __init__(self, *, pins, data_width=8):
+        if data_width not in (8, 16, 32):
+            raise ValueError(f"PWMPeripheral data width must be 8, 16 or 32, not {data_width}")
         self.pins = pins
 
-        regs = csr.Builder(addr_width=5, data_width=8)
+        regs = csr.Builder(addr_width=5 - exact_log2(data_width // 8), data_width=data_width)
 
         self._numr = regs.add("numr", self.Numr(), offset=0x0)
         self._denom = regs.add("denom", self.Denom(), offset=0x4)
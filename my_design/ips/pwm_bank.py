@@ -0,0 +1,197 @@
+from amaranth import *
+
+from amaranth.lib import wiring
+from amaranth.lib.wiring import In, flipped, connect
+from amaranth.lib.cdc import FFSynchronizer
+from amaranth.utils import exact_log2
+from amaranth_soc import csr
+
+__all__ = ["PWMBank"]
+
+
+class PWMBank(wiring.Component):
+    """Bank of PWM channels behind a single CSR bridge, driving one `PWMPins` per channel.
+
+    Each channel behaves as a `PWMPeripheral`, except that writes to `numr` and `denom` are staged:
+    they take effect when a write to `apply` has the channel's bit set, so that the duty cycles of
+    several channels change on the same clock cycle. `conf` takes effect immediately. `stop_int`,
+    `status` and `apply` hold one bit per channel.
+
+    With `shared_timebase`, the channels share one counter and one `denom` (applied by any write
+    to `apply`), so that their periods start together. The counter runs while any channel is
+    enabled and not stopped.
+
+    Register map (byte offsets), fixed for up to `MAX_CHANNELS` channels:
+
+    * `numr`     `0x00 + 2*i` (16 bits, staged)
+    * `denom`    `0x20 + 2*i` (16 bits, staged; only `0x20` with `shared_timebase`)
+    * `conf`     `0x40 + i`   (`en`, `dir`)
+    * `stop_int` `0x60`
+    * `status`   `0x64`
+    * `apply`    `0x68`       (write-only channel mask)
+
+    The offsets are the same whatever the `data_width` of the CSR bus (8, 16 or 32 bits). On a bus
+    wider than a register, the registers of consecutive channels that share a bus word are fields
+    of one register, so that a single word write sets them all; the bits of `conf` above `dir` are
+    then reserved.
+    """
+    MAX_CHANNELS = 16
+
+    class Numr(csr.Register, access="rw"):
+        """Staged numerator value for PWM duty cycle"""
+        val: csr.Field(csr.action.RW, unsigned(16))
+
+    class Denom(csr.Register, access="rw"):
+        """Staged denominator value for PWM duty cycle
+        """
+        val: csr.Field(csr.action.RW, unsigned(16))
+
+    class Conf(csr.Register, access="rw"):
+        """Enable register
+        """
+        en: csr.Field(csr.action.RW, unsigned(1))
+        dir: csr.Field(csr.action.RW, unsigned(1))
+
+    class NumrWord(csr.Register, access="rw"):
+        """Staged numerator values of the channels in a bus word
+        """
+        def __init__(self, lanes):
+            super().__init__([csr.Field(csr.action.RW, unsigned(16)) for _ in range(lanes)])
+
+    class DenomWord(csr.Register, access="rw"):
+        """Staged denominator values of the channels in a bus word
+        """
+        def __init__(self, lanes):
+            super().__init__([csr.Field(csr.action.RW, unsigned(16)) for _ in range(lanes)])
+
+    class ConfWord(csr.Register, access="rw"):
+        """Enable registers of the channels in a bus word, one byte each
+        """
+        def __init__(self, lanes):
+            super().__init__([{"en": csr.Field(csr.action.RW, unsigned(1)),
+                               "dir": csr.Field(csr.action.RW, unsigned(1)),
+                               "reserved": csr.Field(csr.action.ResR0W0, unsigned(6))}
+                              for _ in range(lanes)])
+
+    class Stop_int(csr.Register, access="rw"):
+        """Stop_int register, one bit per channel
+        """
+        def __init__(self, channels):
+            super().__init__({"stopped": csr.Field(csr.action.RW1C, unsigned(channels))})
+
+    class Status(csr.Register, access="r"):
+        """Status register, one bit per channel
+        """
+        def __init__(self, channels):
+            super().__init__({"stop_pin": csr.Field(csr.action.R, unsigned(channels))})
+
+    class Apply(csr.Register, access="w"):
+        """Apply register: the channels whose staged numr and denom take effect
+        """
+        def __init__(self, channels):
+            super().__init__({"mask": csr.Field(csr.action.W, unsigned(channels))})
+
+    def __init__(self, *, pins, shared_timebase=False, data_width=8):
+        if not 1 <= len(pins) <= self.MAX_CHANNELS:
+            raise ValueError(f"PWMBank has 1 to {self.MAX_CHANNELS} channels, not {len(pins)}")
+        if data_width not in (8, 16, 32):
+            raise ValueError(f"PWMBank data width must be 8, 16 or 32, not {data_width}")
+        self.pins = list(pins)
+        self.channels = len(self.pins)
+        self.shared_timebase = shared_timebase
+
+        regs = csr.Builder(addr_width=7 - exact_log2(data_width // 8), data_width=data_width)
+
+        # the fields of each channel, wherever the bus width puts them
+        self._numr = []
+        self._denom = []
+        self._conf = []
+        if data_width == 8:
+            for i in range(self.channels):
+                self._numr.append(regs.add(f"numr{i}", self.Numr(), offset=0x00 + 2 * i).f.val)
+        else:
+            self._add_words(regs, "numr", self.NumrWord, self._numr, 0x00, 2, self.channels)
+        if shared_timebase or data_width == 8:
+            for i in range(1 if shared_timebase else self.channels):
+                self._denom.append(regs.add(f"denom{i}", self.Denom(), offset=0x20 + 2 * i).f.val)
+        else:
+            self._add_words(regs, "denom", self.DenomWord, self._denom, 0x20, 2, self.channels)
+        if data_width == 8:
+            for i in range(self.channels):
+                self._conf.append(regs.add(f"conf{i}", self.Conf(), offset=0x40 + i).f)
+        else:
+            self._add_words(regs, "conf", self.ConfWord, self._conf, 0x40, 1, self.channels)
+        self._stop_int = regs.add("stop_int", self.Stop_int(self.channels), offset=0x60)
+        self._status = regs.add("status", self.Status(self.channels), offset=0x64)
+        self._apply = regs.add("apply", self.Apply(self.channels), offset=0x68)
+
+        self._bridge = csr.Bridge(regs.as_memory_map())
+
+        super().__init__({
+            "bus": In(csr.Signature(addr_width=regs.addr_width, data_width=regs.data_width)),
+        })
+        self.bus.memory_map = self._bridge.bus.memory_map
+
+    @staticmethod
+    def _add_words(regs, name, register, fields, base, size, count):
+        """Add the `count` registers of `size` bytes from `base` as one `register` per bus word,
+        appending the field of each to `fields`."""
+        lanes = regs.data_width // (8 * size)
+        for word, first in enumerate(range(0, count, lanes)):
+            reg = regs.add(f"{name}{word}", register(min(lanes, count - first)), offset=base + first * size)
+            fields.extend(reg.f[lane] for lane in range(min(lanes, count - first)))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.bridge = self._bridge
+        connect(m, flipped(self.bus), self._bridge.bus)
+
+        #synchronizers
+        stop = Signal(self.channels)
+        for i, pins in enumerate(self.pins):
+            m.submodules[f"stop_sync{i}"] = FFSynchronizer(i=pins.stop.i, o=stop[i])
+        m.d.comb += self._stop_int.f.stopped.set.eq(stop)
+        m.d.comb += self._status.f.stop_pin.r_data.eq(stop)
+
+        apply = Signal(self.channels)
+        m.d.comb += apply.eq(Mux(self._apply.f.mask.w_stb, self._apply.f.mask.w_data, 0))
+
+        # duty cycles in effect, loaded from the staged registers on apply
+        numr = [Signal(unsigned(16), name=f"numr{i}") for i in range(self.channels)]
+        denom = [Signal(unsigned(16), name=f"denom{i}") for i in range(len(self._denom))]
+        for i in range(self.channels):
+            with m.If(apply[i]):
+                m.d.sync += numr[i].eq(self._numr[i].data)
+        if self.shared_timebase:
+            with m.If(apply.any()):
+                m.d.sync += denom[0].eq(self._denom[0].data)
+        else:
+            for i in range(self.channels):
+                with m.If(apply[i]):
+                    m.d.sync += denom[i].eq(self._denom[i].data)
+
+        active = Signal(self.channels)
+        for i in range(self.channels):
+            m.d.comb += active[i].eq((self._conf[i].en.data == 1) & (self._stop_int.f.stopped.data[i] == 0))
+
+        if self.shared_timebase:
+            counters = [(Signal(unsigned(16), name="count"), active.any(), denom[0])]
+            count = [counters[0][0]] * self.channels
+        else:
+            counters = [(Signal(unsigned(16), name=f"count{i}"), active[i], denom[i])
+                        for i in range(self.channels)]
+            count = [counter for counter, _, _ in counters]
+
+        for counter, run, period in counters:
+            with m.If(run):
+                m.d.sync += counter.eq(counter+1)
+            with m.Else():
+                m.d.sync += counter.eq(0)
+            with m.If(counter >= period):
+                m.d.sync += counter.eq(0)
+
+        for i, pins in enumerate(self.pins):
+            m.d.comb += pins.pwm.o.eq((numr[i] > 0) & (count[i] <= numr[i]) & active[i])
+            m.d.comb += pins.dir.o.eq(self._conf[i].dir.data)
+
+        return m
@@ -0,0 +1,103 @@
+import numpy as np
+
+import csr_driver
+
+__all__ = ["REGISTERS", "pwm_reference", "effective_writes", "random_bus_writes"]
+
+
+# Address and size in bytes of each writable register of `PWMPeripheral`, which are bus words on an
+# 8-bit bus (see `csr_driver.bus_registers` for wider buses)
+REGISTERS = {
+    "numr":     (0x00, 2),
+    "denom":    (0x04, 2),
+    "conf":     (0x08, 1),
+    "stop_int": (0x0C, 1),
+}
+
+
+def _last_before(events):
+    """For each cycle, the index of the last cycle before it in which `events` is set, or -1."""
+    last = np.maximum.accumulate(np.where(events, np.arange(len(events)), -1))
+    return np.concatenate(([-1], last[:-1]))
+
+
+def _count(active, denom):
+    """The `count` register: a counter that wraps after reaching `denom`, held at 0 while the
+    peripheral is disabled or stopped. Computed a run of constant `active` and `denom` at a time."""
+    cycles = len(active)
+    count = np.empty(cycles, dtype=np.int64)
+    bounds = np.flatnonzero((active[1:] != active[:-1]) | (denom[1:] != denom[:-1])) + 1
+    start_count = 0
+    for start, end in zip([0, *bounds], [*bounds, cycles]):
+        k = np.arange(end - start)
+        period = denom[start] + 1
+        if not active[start]:
+            run = np.where(k == 0, start_count, 0)
+        elif start_count < period:
+            run = (start_count + k) % period
+        else:
+            # `denom` was lowered below the count, which restarts from 0 on the next cycle
+            run = np.where(k == 0, start_count, (k - 1) % period)
+        count[start:end] = run
+        last = int(run[-1])
+        start_count = last + 1 if active[start] and last < denom[start] else 0
+    return count
+
+
+def pwm_reference(cycles, writes=(), stop=None):
+    """Compute the `pwm` and `dir` outputs of `PWMPeripheral` over `cycles` clock cycles.
+
+    `writes` is a sequence of `(cycle, register, value)`, where `register` is a key of `REGISTERS`
+    and `cycle` is the first cycle in which the register holds `value` (see `effective_writes`).
+    A write of 1 to `stop_int` clears the stopped flag. `stop` is the level of the stop pin in each
+    cycle, which reaches the peripheral through a two-stage synchroniser.
+
+    Returns two arrays of `cycles` bits, as `sample()` would capture them from the simulation.
+    """
+    numr  = csr_driver.register_values(cycles, writes, "numr") & 0xFFFF
+    denom = csr_driver.register_values(cycles, writes, "denom") & 0xFFFF
+    conf  = csr_driver.register_values(cycles, writes, "conf")
+    en    = (conf & 1).astype(bool)
+
+    stop_sync = np.zeros(cycles, dtype=bool)
+    if stop is not None:
+        stop_sync[2:] = np.asarray(stop, dtype=bool)[:cycles - 2]
+    # RW1C: a write of 1 clears the flag on the edge that ends the cycle before it takes effect,
+    # unless the synchronised stop pin sets it again on the same edge
+    clear = np.zeros(cycles, dtype=bool)
+    for cycle, register, value in writes:
+        if register == "stop_int" and value & 1 and 0 < cycle <= cycles:
+            clear[cycle - 1] = True
+    stopped = _last_before(stop_sync) > _last_before(clear & ~stop_sync)
+
+    active = en & ~stopped
+    count = _count(active, denom)
+    pwm = (numr > 0) & (count <= numr) & active
+    dir = (conf >> 1) & 1
+    return pwm.astype(np.uint8), dir.astype(np.uint8)
+
+
+def effective_writes(bus_writes, *, data_width=8):
+    """Convert `(cycle, register, value)` bus writes, where `cycle` is the first bus cycle of the
+    write on a `data_width`-bit bus, to the cycles at which they take effect, for `pwm_reference`."""
+    return csr_driver.effective_writes(bus_writes, csr_driver.bus_registers(REGISTERS, data_width))
+
+
+def random_bus_writes(rng, cycles, *, count, max_denom=64):
+    """Generate `count` non-overlapping random register writes within `cycles` bus cycles, as
+    `(cycle, register, value)` sorted by cycle. Small `max_denom` gives many PWM periods."""
+    names = list(REGISTERS)
+    slots = np.sort(rng.choice(cycles // 4, size=count, replace=False)) * 4
+    writes = []
+    for cycle in slots:
+        register = names[rng.integers(len(names))]
+        if register == "numr":
+            value = int(rng.integers(0, max_denom + 8))
+        elif register == "denom":
+            value = int(rng.integers(0, max_denom))
+        elif register == "conf":
+            value = int(rng.integers(0, 4))
+        else:
+            value = int(rng.integers(0, 2))
+        writes.append((int(cycle), register, value))
+    return writes
@@ -0,0 +1,157 @@
+import itertools
+import os
+import sys
+
+from amaranth.hdl import Value
+from amaranth.lib import wiring
+from amaranth.sim import Simulator
+from vcd import VCDWriter
+from vcd.gtkw import GTKWSave
+
+__all__ = ["TraceConfig", "simulate"]
+
+
+class TraceConfig:
+    """Waveform tracing settings for `simulate`, read from the environment (or the equivalent
+    `--ips-trace*` pytest options, see the conftest.py at the repository root):
+
+    * `IPS_TRACE`: `0` (default) to not trace, `1` to trace every test, `fail` to re-run a failing
+      test with tracing;
+    * `IPS_TRACE_SIGNALS`: comma-separated signals to trace, as attribute paths from the DUT such
+      as `pins.pwm.o` or `bus` (all of its ports); by default every signal in the design, or
+      with only a window set, the ports and pins of the DUT;
+    * `IPS_TRACE_WINDOW`: `START:END` range of clock cycles to trace, either end may be omitted;
+    * `IPS_TRACE_DIR`: directory for the VCD and GTKWave files (default: the current directory).
+
+    Tracing every signal goes through `Simulator.write_vcd`. A signal list or window instead
+    samples just those signals once per clock cycle, which is much cheaper.
+    """
+    MODES = ("0", "1", "fail")
+
+    def __init__(self, mode="0", signals=None, window=None, directory="."):
+        if mode not in self.MODES:
+            raise ValueError(f"IPS_TRACE must be one of {', '.join(self.MODES)}, not {mode!r}")
+        self.mode = mode
+        self.signals = signals
+        self.window = window
+        self.directory = directory
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        signals = environ.get("IPS_TRACE_SIGNALS") or None
+        if signals is not None:
+            signals = [path.strip() for path in signals.split(",") if path.strip()]
+        window = environ.get("IPS_TRACE_WINDOW") or None
+        if window is not None:
+            start, sep, end = window.partition(":")
+            if not sep:
+                raise ValueError(f"IPS_TRACE_WINDOW must be START:END, not {window!r}")
+            window = (int(start) if start else 0, int(end) if end else None)
+        return cls(environ.get("IPS_TRACE") or "0", signals, window, environ.get("IPS_TRACE_DIR") or ".")
+
+    def resolve_signals(self, dut):
+        """Map the name of each signal to trace to the signal itself."""
+        if self.signals is None:
+            roots = {name: value for name, value in vars(dut).items() if not name.startswith("_")}
+        else:
+            roots = {}
+            for path in self.signals:
+                obj = dut
+                for attr in path.split("."):
+                    try:
+                        obj = getattr(obj, attr)
+                    except AttributeError:
+                        raise ValueError(f"IPS_TRACE_SIGNALS: {type(dut).__name__} has no {path}") from None
+                roots[path] = obj
+
+        signals = {}
+        for name, obj in roots.items():
+            if isinstance(getattr(obj, "signature", None), wiring.Signature):
+                for member_path, _, value in obj.signature.flatten(obj):
+                    signals[".".join((name, *map(str, member_path)))] = value
+            elif isinstance(obj, Value):
+                signals[name] = obj
+            elif self.signals is not None:
+                raise ValueError(f"IPS_TRACE_SIGNALS: {name} is not a signal or an interface")
+        return signals
+
+
+class _SampledTrace:
+    """Writes the value of a few signals at every clock cycle in a window to a VCD file."""
+    def __init__(self, basename, signals, window, period):
+        self._basename = basename
+        self._signals = signals
+        self._start, self._end = window or (0, None)
+        self._period_ps = round(period * 1e12)
+
+    def __enter__(self):
+        self._vcd_file = open(self._basename + ".vcd", "w")
+        self._writer = VCDWriter(self._vcd_file, timescale="1 ps")
+        self._variables = []
+        for name, signal in self._signals.items():
+            scope, _, var_name = f"top.{name}".rpartition(".")
+            self._variables.append(self._writer.register_var(scope, var_name, "wire", size=len(signal)))
+        return self
+
+    def __exit__(self, *exc_info):
+        # the simulation stops as soon as the testbench returns, leaving `process` suspended
+        self._writer.close()
+        self._vcd_file.close()
+        with open(self._basename + ".gtkw", "w") as gtkw_file:
+            gtkw = GTKWSave(gtkw_file)
+            gtkw.dumpfile(os.path.abspath(self._basename + ".vcd"))
+            for name in self._signals:
+                gtkw.trace(f"top.{name}")
+
+    async def process(self, ctx):
+        if self._start > 0:
+            await ctx.tick().repeat(self._start)
+        trigger = ctx.tick().sample(*self._signals.values())
+        for cycle in itertools.count(self._start) if self._end is None else range(self._start, self._end):
+            _, _, *values = await trigger
+            for variable, value in zip(self._variables, values):
+                self._writer.change(variable, cycle * self._period_ps, value)
+
+
+def _run(dut, testbench, processes, period, basename, config):
+    sim = Simulator(dut)
+    sim.add_clock(period)
+    sim.add_testbench(testbench)
+    for process in processes:
+        sim.add_process(process)
+    if basename is None:
+        sim.run()
+    elif config.signals is None and config.window is None:
+        with sim.write_vcd(basename + ".vcd", basename + ".gtkw"):
+            sim.run()
+    else:
+        with _SampledTrace(basename, config.resolve_signals(dut), config.window, period) as trace:
+            sim.add_process(trace.process)
+            sim.run()
+
+
+def simulate(dut, testbench, name, *, processes=(), period=2e-6, config=None):
+    """Simulate `dut` with a clock of `period` seconds until the async `testbench` returns,
+    tracing waveforms to `<name>.vcd` and `<name>.gtkw` as configured by `TraceConfig`.
+    `processes` are run alongside it in the background, for example to drive or sample pins."""
+    if config is None:
+        config = TraceConfig.from_env()
+    basename = os.path.join(config.directory, name)
+    if config.mode == "1":
+        _run(dut, testbench, processes, period, basename, config)
+        return
+    try:
+        _run(dut, testbench, processes, period, None, config)
+    except Exception:
+        if config.mode == "fail":
+            print(f"{name} failed, re-running with tracing into {basename}.vcd", file=sys.stderr)
+            if os.path.exists(basename + ".vcd"):
+                os.remove(basename + ".vcd")
+            try:
+                _run(dut, testbench, processes, period, basename, config)
+            except Exception as error:
+                # usually the failure again, but it may also have kept the trace from being written
+                print(f"{name}: the traced re-run raised {type(error).__name__}: {error}", file=sys.stderr)
+            if not os.path.exists(basename + ".vcd"):
+                print(f"{name}: no trace was written", file=sys.stderr)
+        raise
@@ -1,73 +1,196 @@
 from amaranth import *
-from amaranth.sim import Simulator, Tick
+
+import numpy as np
 
 from pdm import PDMPeripheral
+from csr_driver import CSRDriver, sample, bus_registers, simulate_schedule as simulate_bus_schedule
+from pdm_reference import (REGISTERS, pdm_reference, effective_writes, stream_samples, target_density,
+                           running_error, snr_db, sine_writes)
+from sim_trace import simulate
 import unittest
 
-class TestPdmPeripheral(unittest.TestCase):
 
-    REG_OUTVAL = 0x00
-    REG_CONF = 0x04
+def simulate_schedule(cycles, bus_writes, *, bitwidth, name="pdm_schedule_test", expected=None, **options):
+    """Simulate `PDMPeripheral(bitwidth=bitwidth, **options)` for `cycles` cycles, performing
+    `(cycle, register, value)` writes on its bus; returns the sampled `pdm` output, after checking
+    it in the simulation against `expected` if given."""
+    dut = PDMPeripheral(bitwidth=bitwidth, **options)
+    registers = bus_registers(REGISTERS, options.get("data_width", 8))
+    outputs = simulate_bus_schedule(
+        dut, cycles, [(cycle, registers[register][0], value, registers[register][1])
+                      for cycle, register, value in bus_writes],
+        outputs={"pdm": dut.pdm.o}, name=name,
+        expected=None if expected is None else {"pdm": expected})
+    return outputs["pdm"]
 
 
-    def _write_reg(self, dut, reg, value, width=4):
-        for i in range(width):
-            yield dut.bus.addr.eq(reg + i)
-            yield dut.bus.w_data.eq((value >> (8 * i)) & 0xFF)
-            yield dut.bus.w_stb.eq(1)
-            yield Tick()
-        yield dut.bus.w_stb.eq(0)
+def random_bus_writes(rng, cycles, *, count, bitwidth):
+    """Generate `count` non-overlapping random writes within `cycles` bus cycles, mostly of
+    in-range output values, sorted by cycle."""
+    writes = []
+    for cycle in np.sort(rng.choice(cycles // 4, size=count, replace=False)) * 4:
+        if rng.random() < 0.2:
+            writes.append((int(cycle), "conf", int(rng.integers(0, 2))))
+        else:
+            limit = 1 << (16 if rng.random() < 0.1 else bitwidth)
+            writes.append((int(cycle), "outval", int(rng.integers(0, limit))))
+    return writes
+
+def random_stream_writes(rng, cycles, *, count, bitwidth):
+    """Like `random_bus_writes`, with bursts of samples pushed to the FIFO, changes of rate and
+    streaming turned on and off."""
+    writes = []
+    cycle = 0
+    for _ in range(count):
+        cycle += int(rng.integers(1, 40))
+        choice = rng.random()
+        if choice < 0.3:
+            for value in rng.integers(0, 1 << bitwidth, size=rng.integers(1, 20)):
+                writes.append((cycle, "fifo", int(value)))
+                cycle += 4
+        elif choice < 0.55:
+            writes.append((cycle, "rate", int(rng.integers(0, 20))))
+        elif choice < 0.85:
+            writes.append((cycle, "conf", int(rng.choice([1, 3, 3, 2]))))
+        else:
+            writes.append((cycle, "outval", int(rng.integers(0, 1 << bitwidth))))
+        cycle += 4
+    return [write for write in writes if write[0] < cycles]
+
+class TestPdmPeripheral(unittest.TestCase):
+
+    REG_OUTVAL      = 0x00
+    REG_CONF        = 0x04
+    REG_FIFO        = 0x08
+    REG_RATE        = 0x0C
+    REG_FIFO_STATUS = 0x10
+    REG_FIFO_INT    = 0x14
+    REG_FIFO_DEPTH  = 0x18
 
-    def _check_reg(self, dut, reg, value, width=4):
-        result = 0
-        for i in range(width):
-            yield dut.bus.addr.eq(reg + i)
-            yield dut.bus.r_stb.eq(1)
-            yield Tick()
-            result |= (yield dut.bus.r_data) << (8 * i)
-        yield dut.bus.r_stb.eq(0)
-        self.assertEqual(result, value)
 
     def test_pdm_ao(self):
         dut = PDMPeripheral(bitwidth=10)
-        def testbench():
-            yield from self._write_reg(dut, self.REG_OUTVAL, 0xFF, 4)
-            yield Tick()
-            yield from self._write_reg(dut, self.REG_CONF, 0x1, 1)
-            for i in range(6): yield Tick()
-            self.assertEqual((yield dut.pdm.o), 1) # assert two cycles of logic '1' (4us)
-            yield Tick()
-            self.assertEqual((yield dut.pdm.o), 1)
-            yield Tick()
-            self.assertEqual((yield dut.pdm.o), 0) # assert 6 cycles of logic '0' (12us)
-            for i in range(5): yield Tick()
-            self.assertEqual((yield dut.pdm.o), 0)
-            yield Tick()
-            self.assertEqual((yield dut.pdm.o), 1) # assert start of the next pulse
-            for i in range(50): yield Tick()
-        sim = Simulator(dut)
-        sim.add_clock(2e-6)
-        sim.add_testbench(testbench)
-        with sim.write_vcd("pdm_ao_test.vcd", "pdm_ao_test.gtkw"):
-            sim.run()
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write(self.REG_OUTVAL, 0xFF, 4)
+            await ctx.tick()
+            await csr.write(self.REG_CONF, 0x1, 1)
+            await ctx.tick().repeat(6)
+            # assert two cycles of logic '1' (4us), 6 cycles of logic '0' (12us) and the start of the next pulse
+            pdm_o = await sample(ctx, dut.pdm.o, 2 + 6 + 1)
+            np.testing.assert_array_equal(pdm_o, [1, 1, 0, 0, 0, 0, 0, 0, 1])
+            await ctx.tick().repeat(50)
+        simulate(dut, testbench, "pdm_ao_test")
 
     def test_conf(self):
         dut = PDMPeripheral(bitwidth=10)
-        def testbench():
-            yield from self._write_reg(dut, self.REG_OUTVAL, 0xFF, 4)
-            yield Tick()
-            yield from self._write_reg(dut, self.REG_CONF, 0x1, 1)
-            for i in range(6): yield Tick()
-            self.assertEqual((yield dut.pdm.o), 1)
-            yield from self._write_reg(dut, self.REG_CONF, 0x0, 1)
-            yield Tick()
-            self.assertEqual((yield dut.pdm.o), 0)
-            for i in range(50): yield Tick()
-        sim = Simulator(dut)
-        sim.add_clock(2e-6)
-        sim.add_testbench(testbench)
-        with sim.write_vcd("pdm_conf_test.vcd", "pdm_conf_test.gtkw"):
-            sim.run()
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write(self.REG_OUTVAL, 0xFF, 4)
+            await ctx.tick()
+            await csr.write(self.REG_CONF, 0x1, 1)
+            await ctx.tick().repeat(6)
+            self.assertEqual(ctx.get(dut.pdm.o), 1)
+            await csr.write(self.REG_CONF, 0x0, 1)
+            await ctx.tick()
+            pdm_o = await sample(ctx, dut.pdm.o, 51)
+            self.assertFalse(pdm_o.any()) # assert pdm_o to remain '0', once disabled
+        simulate(dut, testbench, "pdm_conf_test")
+
+    def test_reference_hand_counted(self):
+        # the schedule of test_pdm_ao, with a 4-byte outval write and a 1-byte conf write
+        pdm = pdm_reference(100, effective_writes([(0, "outval", 0xFF), (5, "conf", 0x1)]), bitwidth=10)
+        np.testing.assert_array_equal(pdm[12:21], [1, 1, 0, 0, 0, 0, 0, 0, 1])
+
+    def test_reference_random(self):
+        cycles = 3000
+        for seed, bitwidth in enumerate([4, 7, 10, 12]):
+            with self.subTest(seed=seed, bitwidth=bitwidth):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_bus_writes(rng, cycles - 8, count=50, bitwidth=bitwidth)
+                simulate_schedule(cycles, bus_writes, bitwidth=bitwidth, name=f"pdm_reference_{seed}_test",
+                                  expected=pdm_reference(cycles, effective_writes(bus_writes), bitwidth=bitwidth))
+
+    def test_reference_modes(self):
+        cycles = 3000
+        for seed, (order, divider, dither) in enumerate([(1, 3, False), (1, 1, True), (2, 1, False), (2, 4, True),
+                                                         (3, 1, False), (3, 2, True)]):
+            with self.subTest(order=order, divider=divider, dither=dither):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_bus_writes(rng, cycles - 8, count=50, bitwidth=8)
+                options = dict(order=order, divider=divider, dither=dither)
+                simulate_schedule(cycles, bus_writes, bitwidth=8, name=f"pdm_modes_{seed}_test",
+                                  expected=pdm_reference(cycles, effective_writes(bus_writes), bitwidth=8, **options),
+                                  **options)
+
+    def test_fifo_stream(self):
+        dut = PDMPeripheral(bitwidth=10, fifo_depth=8)
+        samples = [100, 900, 300, 700, 500]
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            self.assertEqual(await csr.read(self.REG_FIFO_DEPTH, 2), 8)
+            await csr.write_burst([(self.REG_FIFO, value, 2) for value in samples] + [(self.REG_RATE, 99, 2)])
+            # half_empty and level
+            self.assertEqual(await csr.read(self.REG_FIFO_STATUS, 1), 5 << 1)
+            await csr.write(self.REG_CONF, 0x3, 1)
+            # a sample is taken every 100 cycles, the first 100 cycles after streaming starts
+            await ctx.tick().repeat(250)
+            self.assertEqual(await csr.read(self.REG_FIFO_STATUS, 1), 3 << 1 | 1)
+            self.assertEqual(await csr.read(self.REG_FIFO_INT, 1), 0)
+            await ctx.tick().repeat(400)
+            self.assertEqual(await csr.read(self.REG_FIFO_INT, 1), 0b01) # underrun
+            await csr.write_burst([(self.REG_FIFO, value, 2) for value in range(9)])
+            await ctx.tick()
+            self.assertEqual(await csr.read(self.REG_FIFO_INT, 1), 0b11) # and overflow
+            await csr.write(self.REG_FIFO_INT, 0b11, 1)
+            await ctx.tick()
+            self.assertEqual(await csr.read(self.REG_FIFO_INT, 1), 0)
+        simulate(dut, testbench, "pdm_fifo_stream_test")
+
+    def test_reference_stream(self):
+        cycles = 3000
+        for seed, (order, depth) in enumerate([(1, 4), (1, 16), (2, 8)]):
+            with self.subTest(order=order, depth=depth):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_stream_writes(rng, cycles - 8, count=60, bitwidth=10)
+                options = dict(order=order, fifo_depth=depth)
+                writes = effective_writes(bus_writes)
+                _, underruns, overflows = stream_samples(cycles, writes, depth=depth)
+                self.assertTrue(len(underruns) and len(overflows)) # the schedule exercises both
+                simulate_schedule(cycles, bus_writes, bitwidth=10, name=f"pdm_stream_{seed}_test",
+                                  expected=pdm_reference(cycles, writes, bitwidth=10, **options), **options)
+
+    def test_reference_wide_bus(self):
+        cycles = 3000
+        rng = np.random.default_rng(0)
+        bus_writes = random_stream_writes(rng, cycles - 8, count=60, bitwidth=10)
+        options = dict(order=2, fifo_depth=8, data_width=32)
+        writes = effective_writes(bus_writes, data_width=32)
+        simulate_schedule(cycles, bus_writes, bitwidth=10, name="pdm_wide_bus_test",
+                          expected=pdm_reference(cycles, writes, bitwidth=10, order=2, fifo_depth=8), **options)
+
+    def test_reference_quality(self):
+        # the registered error_0/error_1 pipeline biases the density slightly upwards
+        pdm = pdm_reference(1_000_000, [(0, "conf", 1), (0, "outval", 0xFF)], bitwidth=10)
+        self.assertAlmostEqual(pdm.mean(), target_density(0xFF, 10), delta=0.002)
+        self.assertLess(abs(running_error(pdm, pdm.mean())).max(), 8)
+        pdm = pdm_reference(1_000_000, sine_writes(1_000_000, bitwidth=10, period=64 * 977.3, update=64), bitwidth=10)
+        self.assertGreater(snr_db(pdm, 1 / (64 * 977.3), 1 / 128), 30)
+
+    def test_reference_snr(self):
+        # a whole number of periods, so that the sine falls on one bin and does not leak out of it
+        cycles = 1 << 16
+        period = cycles / 37
+        writes = sine_writes(cycles, bitwidth=10, period=period, update=8, amplitude=0.4)
+        snr = {}
+        for order, divider, dither in [(1, 1, False), (1, 1, True), (2, 1, False), (3, 1, True), (2, 2, False)]:
+            pdm = pdm_reference(cycles, writes, bitwidth=10, order=order, divider=divider, dither=dither)
+            snr[order, divider, dither] = snr_db(pdm, 1 / period, 1 / 128)
+        self.assertGreater(snr[1, 1, True], snr[1, 1, False])
+        self.assertGreater(snr[2, 1, False], snr[1, 1, False] + 20)
+        self.assertGreater(snr[3, 1, True], snr[1, 1, False] + 20)
+        # at half the modulator clock, the second order modulator still resolves more than the first
+        self.assertGreater(snr[2, 2, False], snr[1, 1, False] + 10)
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,35 @@
 from amaranth import *
-from amaranth.sim import Simulator, Tick
+
+import numpy as np
 
 from pwm import PWMPeripheral, PWMPins
+from csr_driver import CSRDriver, sample, bus_registers, simulate_schedule as simulate_bus_schedule
+from pwm_reference import REGISTERS, pwm_reference, effective_writes, random_bus_writes
+from sim_trace import simulate
 import unittest
 
+
+def simulate_schedule(cycles, bus_writes, stop, name="pwm_schedule_test", *, data_width=8, expected=None):
+    """Simulate `PWMPeripheral` for `cycles` cycles, performing `(cycle, register, value)` writes
+    on its `data_width`-bit bus and driving its stop pin from `stop`; returns the sampled `pwm` and
+    `dir` outputs, after checking them in the simulation against the `expected` pair if given."""
+    dut = PWMPeripheral(pins=PWMPins(), data_width=data_width)
+    registers = bus_registers(REGISTERS, data_width)
+    outputs = simulate_bus_schedule(
+        dut, cycles, [(cycle, registers[register][0], value, registers[register][1])
+                      for cycle, register, value in bus_writes],
+        outputs={"pwm": dut.pins.pwm.o, "dir": dut.pins.dir.o}, inputs=[(dut.pins.stop.i, stop)], name=name,
+        expected=None if expected is None else dict(zip(("pwm", "dir"), expected)))
+    return outputs["pwm"], outputs["dir"]
+
+
+def random_stop(rng, cycles, pulses):
+    """A stop pin waveform with `pulses` assertions of random length."""
+    stop = np.zeros(cycles, dtype=bool)
+    for start in rng.choice(cycles, size=pulses, replace=False):
+        stop[start:start + rng.integers(1, 20)] = True
+    return stop
+
 class TestPwmPeripheral(unittest.TestCase):
         
     REG_NUMR        = 0x00
@@ -12,75 +38,86 @@ class TestPwmPeripheral(unittest.TestCase):
     REG_STOP_INT    = 0x0C
     REG_STATUS      = 0x10
 
-    def _write_reg(self, dut, reg, value, width=4):
-        for i in range(width):
-            yield dut.bus.addr.eq(reg + i)
-            yield dut.bus.w_data.eq((value >> (8 * i)) & 0xFF)
-            yield dut.bus.w_stb.eq(1)
-            yield Tick()
-        yield dut.bus.w_stb.eq(0)
-
-    def _check_reg(self, dut, reg, value, width=4):
-        result = 0
-        for i in range(width):
-            yield dut.bus.addr.eq(reg + i)
-            yield dut.bus.r_stb.eq(1)
-            yield Tick()
-            result |= (yield dut.bus.r_data) << (8 * i)
-        yield dut.bus.r_stb.eq(0)
-        self.assertEqual(result, value)
-
     def test_pwm_o(self):
         dut = PWMPeripheral(pins=PWMPins())
-        def testbench():
-            yield from self._write_reg(dut, self.REG_NUMR, 0x1F, 4)
-            yield from self._write_reg(dut, self.REG_DENOM, 0xFF, 4)
-            yield from self._write_reg(dut, self.REG_CONF, 0x03, 4)
-            self.assertEqual((yield dut.pins.pwm.o), 1) # assert 32 cycles of logic '1'; 3 cycles go into writing conf register
-            for i in range(29): yield Tick()
-            self.assertEqual((yield dut.pins.pwm.o), 1)
-            yield Tick()
-            self.assertEqual((yield dut.pins.pwm.o), 0) # assert 224 cylces of logic '0'
-            for i in range(223): yield Tick()
-            self.assertEqual((yield dut.pins.pwm.o), 0)
-            yield Tick()
-            self.assertEqual((yield dut.pins.pwm.o), 1) # assert start of the next pulse
-            for i in range(1000): yield Tick()
-        sim = Simulator(dut)
-        sim.add_clock(2e-6)
-        sim.add_testbench(testbench)
-        with sim.write_vcd("pwm_o_test.vcd", "pwm_o_test.gtkw"):
-            sim.run()
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write_burst([(self.REG_NUMR, 0x1F), (self.REG_DENOM, 0xFF), (self.REG_CONF, 0x03)])
+            # assert 32 cycles of logic '1' (3 cycles go into writing conf register), 224 cycles of logic '0'
+            # and the start of the next pulse
+            pwm_o = await sample(ctx, dut.pins.pwm.o, 30 + 224 + 1)
+            np.testing.assert_array_equal(pwm_o, np.repeat([1, 0, 1], [30, 224, 1]))
+            await ctx.tick().repeat(1000)
+        simulate(dut, testbench, "pwm_o_test")
 
     def test_conf(self):
         dut = PWMPeripheral(pins=PWMPins())
-        def testbench():
-            yield from self._write_reg(dut, self.REG_NUMR, 0x1F, 4)
-            yield from self._write_reg(dut, self.REG_DENOM, 0xFF, 4)
-            yield from self._write_reg(dut, self.REG_CONF, 0x0, 4)
-            self.assertEqual((yield dut.pins.pwm.o), 0) # assert pwm_o to remain '0', when not enabled
-            for i in range(1000): yield Tick()
-        sim = Simulator(dut)
-        sim.add_clock(2e-6)
-        sim.add_testbench(testbench)
-        with sim.write_vcd("pwm_conf_test.vcd", "pwm_conf_test.gtkw"):
-            sim.run()
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write_burst([(self.REG_NUMR, 0x1F), (self.REG_DENOM, 0xFF), (self.REG_CONF, 0x0)])
+            pwm_o = await sample(ctx, dut.pins.pwm.o, 1000)
+            self.assertFalse(pwm_o.any()) # assert pwm_o to remain '0', when not enabled
+        simulate(dut, testbench, "pwm_conf_test")
 
     def test_dir(self):
         dut = PWMPeripheral(pins=PWMPins())
-        def testbench():
-            yield from self._write_reg(dut, self.REG_NUMR, 0x1F, 4)
-            yield from self._write_reg(dut, self.REG_DENOM, 0xFF, 4)
-            yield from self._write_reg(dut, self.REG_CONF, 0x03, 4)
-            self.assertEqual((yield dut.pins.dir.o), 1) # assert direction to be '1'
-            for i in range(10): yield Tick()
-            yield from self._write_reg(dut, self.REG_CONF, 0x01, 4)
-            self.assertEqual((yield dut.pins.dir.o), 0) # assert direction to be '0'
-        sim = Simulator(dut)
-        sim.add_clock(2e-6)
-        sim.add_testbench(testbench)
-        with sim.write_vcd("pwm_dir_test.vcd", "pwm_dir_test.gtkw"):
-            sim.run()
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write_burst([(self.REG_NUMR, 0x1F), (self.REG_DENOM, 0xFF), (self.REG_CONF, 0x03)])
+            self.assertEqual(ctx.get(dut.pins.dir.o), 1) # assert direction to be '1'
+            await ctx.tick().repeat(10)
+            await csr.write(self.REG_CONF, 0x01)
+            self.assertEqual(ctx.get(dut.pins.dir.o), 0) # assert direction to be '0'
+        simulate(dut, testbench, "pwm_dir_test")
+
+    def test_registers(self):
+        dut = PWMPeripheral(pins=PWMPins())
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write_burst([(self.REG_NUMR, 0x1F), (self.REG_DENOM, 0xFF), (self.REG_CONF, 0x02)])
+            self.assertEqual(await csr.read_burst([self.REG_NUMR, self.REG_DENOM, self.REG_CONF]),
+                             [0x1F, 0xFF, 0x02])
+        simulate(dut, testbench, "pwm_registers_test")
+
+    def test_registers_wide_bus(self):
+        dut = PWMPeripheral(pins=PWMPins(), data_width=32)
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            # one bus cycle per register, at the byte offset divided by 4
+            await csr.write_burst([(self.REG_NUMR // 4, 0x1F, 1), (self.REG_DENOM // 4, 0xFF, 1),
+                                   (self.REG_CONF // 4, 0x03, 1)])
+            self.assertEqual(await csr.read_burst([(self.REG_NUMR // 4, 1), (self.REG_DENOM // 4, 1),
+                                                   (self.REG_CONF // 4, 1)]),
+                             [0x1F, 0xFF, 0x03])
+            self.assertEqual(ctx.get(dut.pins.pwm.o), 1)
+        simulate(dut, testbench, "pwm_registers_wide_bus_test")
+
+    def test_reference_hand_counted(self):
+        # the register values of test_pwm_o, written from cycles 0, 4 and 8 with the sizes in REGISTERS:
+        # conf is a single byte, written in cycle 8, and takes effect in cycle 10
+        pwm, dir = pwm_reference(2000, effective_writes([(0, "numr", 0x1F), (4, "denom", 0xFF), (8, "conf", 0x03)]))
+        np.testing.assert_array_equal(pwm[12:12 + 255], np.repeat([1, 0, 1], [30, 224, 1]))
+        self.assertTrue(dir[10:].all())
+
+    def test_reference_random(self):
+        cycles = 3000
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_bus_writes(rng, cycles - 8, count=60, max_denom=40)
+                stop = random_stop(rng, cycles, pulses=4)
+                simulate_schedule(cycles, bus_writes, stop, f"pwm_reference_{seed}_test",
+                                  expected=pwm_reference(cycles, effective_writes(bus_writes), stop))
+
+    def test_reference_wide_bus(self):
+        cycles = 3000
+        for seed in range(2):
+            with self.subTest(seed=seed):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_bus_writes(rng, cycles - 8, count=60, max_denom=40)
+                stop = random_stop(rng, cycles, pulses=4)
+                simulate_schedule(cycles, bus_writes, stop, f"pwm_reference_wide_bus_{seed}_test", data_width=32,
+                                  expected=pwm_reference(cycles, effective_writes(bus_writes, data_width=32), stop))
 
 if __name__ == "__main__":
     unittest.main()
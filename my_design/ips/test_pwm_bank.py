@@ -0,0 +1,185 @@
+from amaranth import *
+
+import numpy as np
+
+from pwm import PWMPins
+from pwm_bank import PWMBank
+from csr_driver import CSRDriver, WRITE_LATENCY, sample, simulate_schedule as simulate_bus_schedule
+from pwm_reference import pwm_reference
+from test_pwm import random_stop
+from sim_trace import simulate
+import unittest
+
+
+REG_NUMR     = 0x00
+REG_DENOM    = 0x20
+REG_CONF     = 0x40
+REG_STOP_INT = 0x60
+REG_STATUS   = 0x64
+REG_APPLY    = 0x68
+
+
+def simulate_schedule(dut, cycles, bus_writes, stop=None, name="pwm_bank_schedule_test", *, expected=None):
+    """Simulate `dut` for `cycles` cycles, performing `(cycle, addr, value, size)` writes on its bus
+    and driving the stop pin of each channel from a row of `stop`; returns the sampled `pwm` and
+    `dir` outputs, one row per channel, after checking them in the simulation against the
+    `expected` pair of rows if given."""
+    inputs = [] if stop is None else [(pins.stop.i, stop[i]) for i, pins in enumerate(dut.pins)]
+    outputs = simulate_bus_schedule(
+        dut, cycles, bus_writes, inputs=inputs, name=name,
+        outputs={(key, i): getattr(pins, key).o for i, pins in enumerate(dut.pins) for key in ("pwm", "dir")},
+        expected=None if expected is None else {
+            (key, i): values[i] for key, values in zip(("pwm", "dir"), expected) for i in range(len(dut.pins))})
+    return (np.array([outputs["pwm", i] for i in range(len(dut.pins))]),
+            np.array([outputs["dir", i] for i in range(len(dut.pins))]))
+
+
+def channel_writes(bus_writes, channels, *, data_width=8):
+    """The `pwm_reference` writes of each channel of a `PWMBank` without a shared timebase: staged
+    `numr` and `denom` take effect with the `apply` write that selects the channel. A write on a
+    `data_width`-bit bus sets every register in the bytes it covers."""
+    word_bytes = data_width // 8
+    staged = [{"numr": 0, "denom": 0} for _ in range(channels)]
+    writes = [[] for _ in range(channels)]
+    for cycle, addr, value, size in bus_writes:
+        effective = cycle + size - 1 + WRITE_LATENCY
+        start = addr * word_bytes
+        for byte in range(start, start + size * word_bytes):
+            lane = value >> (8 * (byte - start))
+            if byte < REG_DENOM:
+                if byte % 2 == 0 and byte // 2 < channels:
+                    staged[byte // 2]["numr"] = lane & 0xFFFF
+            elif byte < REG_CONF:
+                if byte % 2 == 0 and (byte - REG_DENOM) // 2 < channels:
+                    staged[(byte - REG_DENOM) // 2]["denom"] = lane & 0xFFFF
+            elif byte < REG_STOP_INT:
+                if byte - REG_CONF < channels:
+                    writes[byte - REG_CONF].append((effective, "conf", lane & 0xFF))
+            elif byte == REG_STOP_INT:
+                for i in range(channels):
+                    writes[i].append((effective, "stop_int", (lane >> i) & 1))
+            elif byte == REG_APPLY:
+                for i in range(channels):
+                    if (lane >> i) & 1:
+                        writes[i] += [(effective, "numr", staged[i]["numr"]), (effective, "denom", staged[i]["denom"])]
+    return writes
+
+
+def random_bus_writes(rng, cycles, *, count, channels, max_denom=64, data_width=8):
+    """Generate `count` non-overlapping random writes to the registers of a `PWMBank` within `cycles`
+    bus cycles, as `(cycle, addr, value, size)` sorted by cycle. On a `data_width`-bit bus wider
+    than a register, a write sets every register in its bus word."""
+    word_bytes = data_width // 8
+    slots = np.sort(rng.choice(cycles // 4, size=count, replace=False)) * 4
+    writes = []
+    for cycle in slots:
+        channel = int(rng.integers(channels))
+        register = rng.choice(["numr", "denom", "conf", "stop_int", "apply"], p=[0.3, 0.2, 0.15, 0.1, 0.25])
+        # byte address, size in bytes and value limit of the register
+        addr, size, limit = {
+            "numr":     (REG_NUMR + 2 * channel, 2, max_denom + 8),
+            "denom":    (REG_DENOM + 2 * channel, 2, max_denom),
+            "conf":     (REG_CONF + channel, 1, 4),
+            "stop_int": (REG_STOP_INT, word_bytes, 1 << channels),
+            "apply":    (REG_APPLY, word_bytes, 1 << channels),
+        }[register]
+        start = addr - addr % word_bytes
+        span = max(size, word_bytes)
+        value = 0
+        for offset in range(0, span, size):
+            value |= int(rng.integers(0, limit)) << (8 * offset)
+        writes.append((int(cycle), start // word_bytes, value, span // word_bytes))
+    return writes
+
+
+class TestPwmBank(unittest.TestCase):
+
+    def test_apply(self):
+        dut = PWMBank(pins=[PWMPins() for _ in range(4)])
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            await csr.write_burst([(REG_NUMR + 2 * i, 0x10 * (i + 1), 2) for i in range(4)] +
+                                  [(REG_DENOM + 2 * i, 0xFF, 2) for i in range(4)] +
+                                  [(REG_CONF + i, 0x01, 1) for i in range(4)])
+            pwm_o = await sample(ctx, dut.pins[0].pwm.o, 100)
+            self.assertFalse(pwm_o.any()) # staged duty cycles have no effect before apply
+            await csr.write(REG_APPLY, 0b1011, 1)
+            await ctx.tick() # the apply takes effect WRITE_LATENCY cycles after its bus cycle
+            pwm_o = [ctx.get(pins.pwm.o) for pins in dut.pins]
+            self.assertEqual(pwm_o, [1, 1, 0, 1])
+        simulate(dut, testbench, "pwm_bank_apply_test")
+
+    def test_registers(self):
+        dut = PWMBank(pins=[PWMPins() for _ in range(10)])
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            ctx.set(dut.pins[3].stop.i, 1)
+            ctx.set(dut.pins[9].stop.i, 1)
+            await csr.write_burst([(REG_NUMR + 2 * 9, 0x1F, 2), (REG_DENOM + 2 * 9, 0x1FF, 2), (REG_CONF + 9, 0x02, 1)])
+            self.assertEqual(await csr.read_burst([(REG_NUMR + 2 * 9, 2), (REG_DENOM + 2 * 9, 2), (REG_CONF + 9, 1),
+                                                   (REG_STOP_INT, 2), (REG_STATUS, 2)]),
+                             [0x1F, 0x1FF, 0x02, 0x208, 0x208])
+            ctx.set(dut.pins[3].stop.i, 0)
+            await ctx.tick().repeat(3)
+            await csr.write(REG_STOP_INT, 0x008, 2) # clear channel 3 only
+            await ctx.tick()
+            self.assertEqual(await csr.read(REG_STOP_INT, 2), 0x200)
+        simulate(dut, testbench, "pwm_bank_registers_test")
+
+    def test_registers_wide_bus(self):
+        dut = PWMBank(pins=[PWMPins() for _ in range(10)], data_width=32)
+        async def testbench(ctx):
+            csr = CSRDriver(ctx, dut.bus)
+            ctx.set(dut.pins[9].stop.i, 1)
+            # channels 8 and 9 share a numr and a denom word, channels 8 to 11 a conf word
+            await csr.write_burst([(REG_NUMR // 4 + 4, 0x001F_0010, 1), (REG_DENOM // 4 + 4, 0x01FF_00FF, 1),
+                                   (REG_CONF // 4 + 2, 0xFFFF_FE01, 1), (REG_APPLY // 4, 0x300, 1)])
+            self.assertEqual(await csr.read_burst([(REG_NUMR // 4 + 4, 1), (REG_DENOM // 4 + 4, 1),
+                                                   (REG_CONF // 4 + 2, 1), (REG_STOP_INT // 4, 1)]),
+                             [0x001F_0010, 0x01FF_00FF, 0x0000_0201, 0x200]) # reserved conf bits read 0
+            self.assertEqual([ctx.get(dut.pins[i].pwm.o) for i in (8, 9)], [1, 0])
+            self.assertEqual([ctx.get(dut.pins[i].dir.o) for i in (8, 9)], [0, 1])
+        simulate(dut, testbench, "pwm_bank_registers_wide_bus_test")
+
+    def test_shared_timebase(self):
+        dut = PWMBank(pins=[PWMPins() for _ in range(3)], shared_timebase=True)
+        numr = [0x0F, 0x3F, 0x7F]
+        # channels enabled at different times still start their periods together
+        pwm, _ = simulate_schedule(dut, 1000, [(0, REG_NUMR + 2 * i, numr[i], 2) for i in range(3)] +
+                                   [(6, REG_DENOM, 0xFF, 2), (8, REG_APPLY, 0b111, 1)] +
+                                   [(10 + 40 * i, REG_CONF + i, 0x01, 1) for i in range(3)],
+                                   name="pwm_bank_shared_timebase_test")
+        rising = [np.flatnonzero(np.diff(pwm[i, 300:]) == 1) for i in range(3)]
+        for i in range(3):
+            np.testing.assert_array_equal(rising[i], rising[0])
+            np.testing.assert_array_equal(np.diff(rising[i]), 0x100)
+            self.assertEqual(pwm[i, 300 + rising[0][0] + 1:300 + rising[0][1] + 1].sum(), numr[i] + 1)
+
+    def test_reference_random(self):
+        cycles = 3000
+        channels = 3
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                rng = np.random.default_rng(seed)
+                bus_writes = random_bus_writes(rng, cycles - 8, count=100, channels=channels, max_denom=40)
+                stop = np.array([random_stop(rng, cycles, pulses=3) for _ in range(channels)])
+                dut = PWMBank(pins=[PWMPins() for _ in range(channels)])
+                reference = [pwm_reference(cycles, writes, stop[i])
+                             for i, writes in enumerate(channel_writes(bus_writes, channels))]
+                simulate_schedule(dut, cycles, bus_writes, stop, f"pwm_bank_reference_{seed}_test",
+                                  expected=tuple(zip(*reference)))
+
+    def test_reference_wide_bus(self):
+        cycles = 3000
+        channels = 5
+        rng = np.random.default_rng(0)
+        bus_writes = random_bus_writes(rng, cycles - 8, count=100, channels=channels, max_denom=40, data_width=32)
+        stop = np.array([random_stop(rng, cycles, pulses=3) for _ in range(channels)])
+        dut = PWMBank(pins=[PWMPins() for _ in range(channels)], data_width=32)
+        reference = [pwm_reference(cycles, writes, stop[i])
+                     for i, writes in enumerate(channel_writes(bus_writes, channels, data_width=32))]
+        simulate_schedule(dut, cycles, bus_writes, stop, "pwm_bank_reference_wide_bus_test",
+                          expected=tuple(zip(*reference)))
+
+if __name__ == "__main__":
+    unittest.main()
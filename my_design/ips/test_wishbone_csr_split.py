@@ -0,0 +1,96 @@
+from amaranth import *
+
+from wishbone_csr_split import WishboneCSRSplit
+from sim_trace import simulate
+import unittest
+
+
+class Target(Elaboratable):
+    """A Wishbone target that acknowledges each access one cycle later, reads back `ident` in the
+    top byte and the word address below it, and keeps the data and select of its last store."""
+    def __init__(self, bus, ident):
+        self.bus = bus
+        self.ident = ident
+        self.stored = Signal(32)
+        self.stored_sel = Signal(len(bus.sel))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.sync += self.bus.ack.eq(self.bus.cyc & self.bus.stb & ~self.bus.ack)
+        m.d.comb += self.bus.dat_r.eq(Cat(self.bus.adr[:24], C(self.ident, 8)))
+        with m.If(self.bus.cyc & self.bus.stb & self.bus.we & ~self.bus.ack):
+            m.d.sync += [self.stored.eq(self.bus.dat_w), self.stored_sel.eq(self.bus.sel)]
+        return m
+
+
+class Harness(Elaboratable):
+    def __init__(self):
+        self.split = WishboneCSRSplit(addr_width=26, wide_start=0x0700_0000, wide_end=0x0900_0000)
+        self.narrow = Target(self.split.narrow, 0x08)
+        self.wide = Target(self.split.wide, 0x20)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.split = self.split
+        m.submodules.narrow = self.narrow
+        m.submodules.wide = self.wide
+        return m
+
+
+async def access(ctx, bus, addr, *, data=None, sel=0xF):
+    """Perform a Wishbone access of the byte address `addr` on `bus`; returns the data read and the
+    number of cycles until the acknowledge."""
+    ctx.set(bus.adr, addr >> 2)
+    ctx.set(bus.sel, sel)
+    ctx.set(bus.we, data is not None)
+    ctx.set(bus.dat_w, data or 0)
+    ctx.set(bus.cyc, 1)
+    ctx.set(bus.stb, 1)
+    cycles = 0
+    while not ctx.get(bus.ack):
+        await ctx.tick()
+        cycles += 1
+    result = ctx.get(bus.dat_r)
+    ctx.set(bus.cyc, 0)
+    ctx.set(bus.stb, 0)
+    await ctx.tick()
+    return result, cycles
+
+
+class TestWishboneCSRSplit(unittest.TestCase):
+
+    def test_routing(self):
+        dut = Harness()
+        bus = dut.split.bus
+        async def testbench(ctx):
+            # the ends of the wide range and either side of it
+            for addr, ident in [(0x06FF_FFFC, 0x08), (0x0700_0000, 0x20), (0x08FF_FFFC, 0x20),
+                                (0x0900_0000, 0x08), (0x0400_0000, 0x08)]:
+                data, cycles = await access(ctx, bus, addr)
+                self.assertEqual(data, ident << 24 | (addr >> 2) & 0xFF_FFFF, hex(addr))
+                self.assertEqual(cycles, 1)
+            await access(ctx, bus, 0x0000_0010, data=0x1234_5678, sel=0b0100)
+            self.assertEqual((ctx.get(dut.narrow.stored), ctx.get(dut.narrow.stored_sel)), (0x1234_5678, 0b0100))
+            await access(ctx, bus, 0x0700_0010, data=0xCAFE_F00D)
+            self.assertEqual((ctx.get(dut.wide.stored), ctx.get(dut.wide.stored_sel)), (0xCAFE_F00D, 1))
+        simulate(dut, testbench, "wishbone_csr_split_routing_test")
+
+    def test_partial_store(self):
+        dut = Harness()
+        bus = dut.split.bus
+        async def testbench(ctx):
+            # a load of the word, then a store of it with the selected bytes replaced
+            _, cycles = await access(ctx, bus, 0x0700_0010, data=0x1234_56FF, sel=0b0101)
+            self.assertEqual(cycles, 3)
+            self.assertEqual(ctx.get(dut.wide.stored), 0x2034_00FF)
+            self.assertEqual(ctx.get(dut.wide.stored_sel), 1)
+            # and the next access is a plain one again
+            _, cycles = await access(ctx, bus, 0x0700_0010, data=0xCAFE_F00D)
+            self.assertEqual((cycles, ctx.get(dut.wide.stored)), (1, 0xCAFE_F00D))
+            # loads of part of a word read the whole word
+            data, _ = await access(ctx, bus, 0x0700_0010, sel=0b0001)
+            self.assertEqual(data, 0x20 << 24 | (0x0700_0010 >> 2) & 0xFF_FFFF)
+        simulate(dut, testbench, "wishbone_csr_split_partial_store_test")
+
+if __name__ == "__main__":
+    unittest.main()
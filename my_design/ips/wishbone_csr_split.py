@@ -0,0 +1,84 @@
+from amaranth import *
+
+from amaranth.lib import wiring
+from amaranth.lib.wiring import In, Out
+from amaranth_soc import wishbone
+from amaranth_soc.memory import MemoryMap
+
+__all__ = ["WishboneCSRSplit"]
+
+
+class WishboneCSRSplit(wiring.Component):
+    """Splits the CSR region of the 32-bit Wishbone bus between two `WishboneCSRBridge`s: `wide`,
+    in front of a 32-bit CSR bus, for byte offsets from `wide_start` to `wide_end`, and `narrow`,
+    in front of an 8-bit CSR bus, for the rest of the region.
+
+    The `narrow` bridge spends one CSR cycle on each byte lane of an access, the `wide` bridge one
+    cycle on the whole word. As the `wide` bridge has no byte selects, loads of part of a word in
+    its range read the whole word, and a store to part of a word is done as a load of the word,
+    then a store of it with the selected bytes replaced. The unselected bytes are written back as
+    read, so a partial store to a word that holds write-one-to-clear fields clears the bits set in
+    its other bytes.
+
+    `bus` has an empty memory map, as its windows would overlap.
+    """
+    def __init__(self, *, addr_width, wide_start, wide_end):
+        if wide_start % 4 or wide_end % 4 or not 0 <= wide_start < wide_end <= 4 << addr_width:
+            raise ValueError(f"WishboneCSRSplit wide range {wide_start:#x} to {wide_end:#x} must be "
+                             f"word aligned and within the region")
+        self._wide_start = wide_start
+        self._wide_end = wide_end
+
+        super().__init__({
+            "bus": In(wishbone.Signature(addr_width=addr_width, data_width=32, granularity=8)),
+            "narrow": Out(wishbone.Signature(addr_width=addr_width, data_width=32, granularity=8)),
+            "wide": Out(wishbone.Signature(addr_width=addr_width, data_width=32, granularity=32)),
+        })
+        self.bus.memory_map = MemoryMap(addr_width=addr_width + 2, data_width=8)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        wide = Signal()
+        m.d.comb += wide.eq((self.bus.adr >= self._wide_start // 4) & (self.bus.adr < self._wide_end // 4))
+
+        # stores to part of a word in the wide range load the word, then store it merged with the
+        # selected bytes
+        partial = Signal()
+        storing = Signal()
+        merged = Signal(32)
+        m.d.comb += partial.eq(self.bus.we & ~self.bus.sel.all())
+        with m.If(self.wide.cyc & self.wide.ack & partial):
+            m.d.sync += storing.eq(~storing)
+            with m.If(~storing):
+                m.d.sync += merged.eq(Cat(Mux(self.bus.sel[i], self.bus.dat_w.word_select(i, 8),
+                                              self.wide.dat_r.word_select(i, 8)) for i in range(4)))
+
+        for sub in (self.narrow, self.wide):
+            m.d.comb += [
+                sub.adr.eq(self.bus.adr),
+                sub.stb.eq(self.bus.stb),
+            ]
+        m.d.comb += [
+            self.narrow.dat_w.eq(self.bus.dat_w),
+            self.narrow.we.eq(self.bus.we),
+            self.narrow.sel.eq(self.bus.sel),
+            self.narrow.cyc.eq(self.bus.cyc & ~wide),
+            self.wide.dat_w.eq(Mux(partial, merged, self.bus.dat_w)),
+            self.wide.we.eq(self.bus.we & (~partial | storing)),
+            self.wide.sel.eq(1),
+            self.wide.cyc.eq(self.bus.cyc & wide),
+        ]
+
+        with m.If(wide):
+            m.d.comb += [
+                self.bus.dat_r.eq(self.wide.dat_r),
+                self.bus.ack.eq(self.wide.ack & (~partial | storing)),
+            ]
+        with m.Else():
+            m.d.comb += [
+                self.bus.dat_r.eq(self.narrow.dat_r),
+                self.bus.ack.eq(self.narrow.ack),
+            ]
+
+        return m
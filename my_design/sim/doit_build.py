@@ -1,6 +1,9 @@
 import os
+import shlex
 import sys
+import subprocess
 import importlib.resources
+from pathlib import Path
 
 
 OUTPUT_DIR  = "./build/sim"
@@ -8,9 +11,52 @@ SOURCE_DIR  = importlib.resources.files("my_design") / "sim"
 RUNTIME_DIR = importlib.resources.files("yowasp_yosys") / "share/include/backends/cxxrtl/runtime"
 
 ZIG_CXX  = f"{sys.executable} -m ziglang c++"
-CXXFLAGS = f"-O3 -g -std=c++17 -Wno-array-bounds -Wno-shift-count-overflow -fbracket-depth=1024"
+CXXFLAGS = f"-O3 -g -std=c++17 -fPIC -Wno-array-bounds -Wno-shift-count-overflow -fbracket-depth=1024"
 INCLUDES = f"-I {OUTPUT_DIR} -I {SOURCE_DIR}/vendor -I {RUNTIME_DIR}"
 
+# The object files are independent of each other, so compile them in parallel.
+DOIT_CONFIG = {
+    "num_process": os.cpu_count() or 1,
+    "par_type": "thread",
+    # the shared library for in-process use (sim_lib.py) is only built on request
+    "default_tasks": ["build_sim"],
+}
+
+PCH = f"{OUTPUT_DIR}/sim_pch.h.pch"
+
+# Every object is built with the same flags so that they can share the precompiled header, and
+# position independent so that they can also be linked into the shared library. The generated
+# netlist does not use the JSON library, and is left out of the precompiled header, so that editing
+# the harness headers does not rebuild it.
+SIM_OBJECTS = {
+    "sim_soc": {
+        "source": f"{OUTPUT_DIR}/sim_soc.cc",
+        "deps": [f"{OUTPUT_DIR}/sim_soc.h"],
+        "pch": False,
+    },
+    "main": {
+        "source": f"{SOURCE_DIR}/main.cc",
+        "deps": [
+            f"{OUTPUT_DIR}/sim_soc.h",
+            f"{SOURCE_DIR}/harness.h",
+            f"{SOURCE_DIR}/models.h",
+            f"{SOURCE_DIR}/vendor/cxxrtl/cxxrtl_server.h",
+        ],
+    },
+    "sim_capi": {
+        "source": f"{SOURCE_DIR}/sim_capi.cc",
+        "deps": [
+            f"{OUTPUT_DIR}/sim_soc.h",
+            f"{SOURCE_DIR}/harness.h",
+            f"{SOURCE_DIR}/models.h",
+        ],
+    },
+    "models": {
+        "source": f"{SOURCE_DIR}/models.cc",
+        "deps": [f"{SOURCE_DIR}/models.h"],
+    },
+}
+
 
 def task_build_sim_cxxrtl():
     return {
@@ -20,24 +66,79 @@ def task_build_sim_cxxrtl():
     }
 
 
+def _build_pch():
+    # `zig c++` refuses to write anything but an object file, so take the clang frontend command it
+    # would run to compile the header (printed by `-###`), and run that with the action changed to
+    # emitting a precompiled header. Its exit status then tells a build from a compile error.
+    Path(PCH).unlink(missing_ok=True)
+    driver = subprocess.run(
+        f"{ZIG_CXX} {CXXFLAGS} {INCLUDES} -### -c -o {PCH}.o -x c++ {SOURCE_DIR}/sim_pch.h",
+        shell=True, stderr=subprocess.PIPE, text=True)
+    if driver.returncode != 0:
+        print(driver.stderr, file=sys.stderr)
+        return False
+    command = shlex.split([line for line in driver.stderr.splitlines() if line.startswith(' "')][-1])
+    command[command.index("-emit-obj")] = "-emit-pch"
+    command[command.index("-o") + 1] = PCH
+    return subprocess.run(command).returncode == 0
+
+
+def task_build_sim_pch():
+    return {
+        "actions": [_build_pch],
+        "targets": [PCH],
+        "file_dep": [
+            f"{SOURCE_DIR}/sim_pch.h",
+            f"{SOURCE_DIR}/vendor/nlohmann/json.hpp",
+            f"{RUNTIME_DIR}/cxxrtl/cxxrtl.h",
+        ],
+    }
+
+
+def task_build_sim_object():
+    for name, obj in SIM_OBJECTS.items():
+        pch = obj.get("pch", True)
+        yield {
+            "name": name,
+            "actions": [
+                f"{ZIG_CXX} {CXXFLAGS} {INCLUDES} {f'-include-pch {PCH} ' if pch else ''}"
+                f"-c -o {OUTPUT_DIR}/{name}.o {obj['source']}"
+            ],
+            "targets": [f"{OUTPUT_DIR}/{name}.o"],
+            "file_dep": [obj["source"], *obj["deps"], *([PCH] if pch else [])],
+        }
+
+
 def task_build_sim():
     exe = ".exe" if os.name == "nt" else ""
+    objects = [f"{OUTPUT_DIR}/{name}.o" for name in ("sim_soc", "main", "models")]
 
     return {
         "actions": [
-            f"{ZIG_CXX} {CXXFLAGS} {INCLUDES} -o {OUTPUT_DIR}/sim_soc{exe} "
-            f"{OUTPUT_DIR}/sim_soc.cc {SOURCE_DIR}/main.cc {SOURCE_DIR}/models.cc"
+            f"{ZIG_CXX} {CXXFLAGS} -o {OUTPUT_DIR}/sim_soc{exe} {' '.join(objects)}"
         ],
         "targets": [
             f"{OUTPUT_DIR}/sim_soc{exe}"
         ],
-        "file_dep": [
-            f"{OUTPUT_DIR}/sim_soc.cc",
-            f"{OUTPUT_DIR}/sim_soc.h",
-            f"{SOURCE_DIR}/main.cc",
-            f"{SOURCE_DIR}/models.cc",
-            f"{SOURCE_DIR}/models.h",
-            f"{SOURCE_DIR}/vendor/nlohmann/json.hpp",
-            f"{SOURCE_DIR}/vendor/cxxrtl/cxxrtl_server.h",
+        "file_dep": objects,
+    }
+
+
+def task_build_sim_lib():
+    if os.name == "nt":
+        library = "sim_soc.dll"
+    elif sys.platform == "darwin":
+        library = "libsim_soc.dylib"
+    else:
+        library = "libsim_soc.so"
+    objects = [f"{OUTPUT_DIR}/{name}.o" for name in ("sim_soc", "models", "sim_capi")]
+
+    return {
+        "actions": [
+            f"{ZIG_CXX} {CXXFLAGS} -shared -o {OUTPUT_DIR}/{library} {' '.join(objects)}"
+        ],
+        "targets": [
+            f"{OUTPUT_DIR}/{library}"
         ],
+        "file_dep": objects,
     }
@@ -0,0 +1,104 @@
+#ifndef HARNESS_H
+#define HARNESS_H
+
+#include <cxxrtl/cxxrtl.h>
+#include "sim_soc.h"
+#include "models.h"
+
+namespace cxxrtl_design {
+
+// The SoC together with the peripheral models attached to its pins. Used by both the `sim_soc`
+// executable (main.cc) and the shared library driven from Python (sim_capi.cc), which differ only
+// in how a clock edge is evaluated: the executable goes through the debug agent, the library
+// steps the design directly.
+struct sim_harness {
+    p_sim__top top;
+
+    spiflash_model flash;
+
+    uart_model uart_0;
+    uart_model uart_1;
+
+    gpio_model gpio_0;
+    gpio_model gpio_1;
+
+    spi_model spi_0;
+    spi_model spi_1;
+    spi_model spi_2;
+
+    i2c_model i2c_0;
+    i2c_model i2c_1;
+
+    unsigned timestamp = 0;
+
+    sim_harness() :
+        flash("flash", top.p_flash____clk____o, top.p_flash____csn____o,
+            top.p_flash____d____o, top.p_flash____d____oe, top.p_flash____d____i),
+        uart_0("uart_0", top.p_uart__0____tx____o, top.p_uart__0____rx____i),
+        uart_1("uart_1", top.p_uart__1____tx____o, top.p_uart__1____rx____i),
+        gpio_0("gpio_0", top.p_gpio__0____gpio____o, top.p_gpio__0____gpio____oe, top.p_gpio__0____gpio____i),
+        gpio_1("gpio_1", top.p_gpio__1____gpio____o, top.p_gpio__1____gpio____oe, top.p_gpio__1____gpio____i),
+        spi_0("spi_0", top.p_user__spi__0____sck____o, top.p_user__spi__0____csn____o, top.p_user__spi__0____copi____o, top.p_user__spi__0____cipo____i),
+        spi_1("spi_1", top.p_user__spi__1____sck____o, top.p_user__spi__1____csn____o, top.p_user__spi__1____copi____o, top.p_user__spi__1____cipo____i),
+        spi_2("spi_2", top.p_user__spi__2____sck____o, top.p_user__spi__2____csn____o, top.p_user__spi__2____copi____o, top.p_user__spi__2____cipo____i),
+        i2c_0("i2c_0", top.p_i2c__0____sda____oe, top.p_i2c__0____sda____i, top.p_i2c__0____scl____oe, top.p_i2c__0____scl____i),
+        i2c_1("i2c_1", top.p_i2c__1____sda____oe, top.p_i2c__1____sda____i, top.p_i2c__1____scl____oe, top.p_i2c__1____scl____i)
+    {}
+
+    // Step every model on every cycle instead of only the active ones; see `watch_list`
+    bool step_all = false;
+
+    // An event logged by one model can release actions for a model stepped after it in the same
+    // cycle, so pending actions are checked for each model in turn
+    template<typename Model>
+    void step_model(Model &model) {
+        bool inputs_changed = model.watch.changed();
+        if (inputs_changed || step_all || model.busy() || (any_pending_actions() && has_pending_actions(model.name)))
+            model.step(timestamp);
+    }
+
+    void step_models() {
+        step_model(flash);
+        step_model(uart_0);
+        step_model(uart_1);
+
+        step_model(gpio_0);
+        step_model(gpio_1);
+
+        step_model(spi_0);
+        step_model(spi_1);
+        step_model(spi_2);
+
+        step_model(i2c_0);
+        step_model(i2c_1);
+    }
+
+    // One clock cycle; `eval` settles the design after each clock edge
+    template<typename Eval>
+    void tick(Eval eval) {
+        step_models();
+
+        top.p_clk.set(false);
+        eval();
+        ++timestamp;
+
+        top.p_clk.set(true);
+        eval();
+        ++timestamp;
+    }
+
+    // Capture the initial state, then hold the SoC in reset for one cycle
+    template<typename Eval>
+    void reset(Eval eval) {
+        eval();
+
+        top.p_rst.set(true);
+        tick(eval);
+
+        top.p_rst.set(false);
+    }
+};
+
+}
+
+#endif
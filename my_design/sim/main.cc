@@ -1,85 +1,211 @@
-#undef NDEBUG
-
-#include <cxxrtl/cxxrtl.h>
-#include <cxxrtl/cxxrtl_server.h>
-#include "sim_soc.h"
-#include "models.h"
-
-#include <fstream>
-#include <filesystem>
-
-using namespace cxxrtl::time_literals;
-using namespace cxxrtl_design;
-
-int main(int argc, char **argv) {
-    p_sim__top top;
-
-    spiflash_model flash("flash", top.p_flash____clk____o, top.p_flash____csn____o,
-        top.p_flash____d____o, top.p_flash____d____oe, top.p_flash____d____i);
-
-    uart_model uart_0("uart_0", top.p_uart__0____tx____o, top.p_uart__0____rx____i);
-    uart_model uart_1("uart_1", top.p_uart__1____tx____o, top.p_uart__1____rx____i);
-
-    gpio_model gpio_0("gpio_0", top.p_gpio__0____gpio____o, top.p_gpio__0____gpio____oe, top.p_gpio__0____gpio____i);
-    gpio_model gpio_1("gpio_1", top.p_gpio__1____gpio____o, top.p_gpio__1____gpio____oe, top.p_gpio__1____gpio____i);
-
-    spi_model spi_0("spi_0", top.p_user__spi__0____sck____o, top.p_user__spi__0____csn____o, top.p_user__spi__0____copi____o, top.p_user__spi__0____cipo____i);
-    spi_model spi_1("spi_1", top.p_user__spi__1____sck____o, top.p_user__spi__1____csn____o, top.p_user__spi__1____copi____o, top.p_user__spi__1____cipo____i);
-    spi_model spi_2("spi_2", top.p_user__spi__2____sck____o, top.p_user__spi__2____csn____o, top.p_user__spi__2____copi____o, top.p_user__spi__2____cipo____i);
-
-    i2c_model i2c_0("i2c_0", top.p_i2c__0____sda____oe, top.p_i2c__0____sda____i, top.p_i2c__0____scl____oe, top.p_i2c__0____scl____i);
-    i2c_model i2c_1("i2c_1", top.p_i2c__1____sda____oe, top.p_i2c__1____sda____i, top.p_i2c__1____scl____oe, top.p_i2c__1____scl____i);
-
-    cxxrtl::agent agent(cxxrtl::spool("spool.bin"), top);
-    if (getenv("DEBUG")) // can also be done when a condition is violated, etc
-        std::cerr << "Waiting for debugger on " << agent.start_debugging() << std::endl;
-
-    open_event_log("events.json");
-    open_input_commands("../../my_design/tests/input.json");
-
-    unsigned timestamp = 0;
-    auto tick = [&]() {
-        // agent.print(stringf("timestamp %d\n", timestamp), CXXRTL_LOCATION);
-
-        flash.step(timestamp);
-        uart_0.step(timestamp);
-        uart_1.step(timestamp);
-
-        gpio_0.step(timestamp);
-        gpio_1.step(timestamp);
-
-        spi_0.step(timestamp);
-        spi_1.step(timestamp);
-        spi_2.step(timestamp);
-
-        i2c_0.step(timestamp);
-        i2c_1.step(timestamp);
-
-        top.p_clk.set(false);
-        agent.step();
-        agent.advance(1_us);
-        ++timestamp;
-
-        top.p_clk.set(true);
-        agent.step();
-        agent.advance(1_us);
-        ++timestamp;
-
-        // if (timestamp == 10)
-        //     agent.breakpoint(CXXRTL_LOCATION);
-    };
-
-    flash.load_data("../software/software.bin", 0x00100000U);
-    agent.step();
-    agent.advance(1_us);
-
-    top.p_rst.set(true);
-    tick();
-
-    top.p_rst.set(false);
-    for (int i = 0; i < 2000000; i++)
-        tick();
-
-    close_event_log();
-    return 0;
-}
+#undef NDEBUG
+
+#include <cxxrtl/cxxrtl.h>
+#include <cxxrtl/cxxrtl_server.h>
+#include "harness.h"
+
+#include <chrono>
+#include <fstream>
+#include <filesystem>
+#include <string>
+#include <vector>
+
+using namespace cxxrtl::time_literals;
+using namespace cxxrtl_design;
+
+// An event that ends the simulation, given as PERIPHERAL:EVENT[:PAYLOAD] on the command line.
+// PAYLOAD matches a JSON value, or the text of a string payload (so `gpio_0:change:10101100` works).
+struct event_match {
+    std::string peripheral;
+    std::string event;
+    std::optional<json> payload;
+    std::string payload_text;
+
+    static event_match parse(const std::string &spec) {
+        event_match match;
+        size_t first = spec.find(':');
+        if (first == std::string::npos)
+            throw std::invalid_argument("expected PERIPHERAL:EVENT[:PAYLOAD], got " + spec);
+        size_t second = spec.find(':', first + 1);
+        match.peripheral = spec.substr(0, first);
+        match.event = spec.substr(first + 1, second == std::string::npos ? std::string::npos : second - first - 1);
+        if (second != std::string::npos) {
+            match.payload_text = spec.substr(second + 1);
+            match.payload = json::parse(match.payload_text, nullptr, /*allow_exceptions=*/false);
+            if (match.payload->is_discarded())
+                match.payload = json(match.payload_text);
+        }
+        return match;
+    }
+
+    bool matches(const std::string &peripheral, const std::string &event, const json &payload) const {
+        if (this->peripheral != peripheral || this->event != event)
+            return false;
+        if (!this->payload)
+            return true;
+        return *this->payload == payload || (payload.is_string() && payload.get_ref<const std::string &>() == payload_text);
+    }
+};
+
+struct sim_options {
+    std::string firmware = "../software/software.bin";
+    std::string input = "../../my_design/tests/input.json";
+    // a filename ending in .evlog selects the binary event log format
+    std::string events = "events.json";
+    std::string spool = "spool.bin";
+    unsigned long long cycles = 2000000;
+    // stop conditions in addition to the cycle limit; zero disables them
+    unsigned long long idle_cycles = 0;
+    double timeout = 0;
+    std::vector<event_match> stop_events;
+    // step every peripheral model on every cycle, not only those whose inputs changed
+    bool step_all = false;
+};
+
+static void usage(const char *argv0) {
+    sim_options defaults;
+    fprintf(stderr, "Usage: %s [options]\n"
+        "  --firmware FILE  firmware image loaded into flash (default: %s)\n"
+        "  --input FILE     input commands, as JSON or a command table compiled by\n"
+        "                   my_design.tools.compile_input (default: %s)\n"
+        "  --events FILE    event log to write (default: %s)\n"
+        "  --spool FILE     debugger spool file (default: %s)\n"
+        "  --cycles N       stop after N clock cycles (default: %llu)\n"
+        "  --idle-cycles N  stop once all input commands are consumed and no event\n"
+        "                   has been logged for N clock cycles\n"
+        "  --stop-on-event PERIPHERAL:EVENT[:PAYLOAD]\n"
+        "                   stop once a matching event is logged (may be repeated)\n"
+        "  --timeout SECS   stop after SECS seconds of wall-clock time\n"
+        "  --step-all       step every peripheral model on every cycle, not only\n"
+        "                   those whose inputs changed (slower, for comparison)\n",
+        argv0, defaults.firmware.c_str(), defaults.input.c_str(), defaults.events.c_str(),
+        defaults.spool.c_str(), defaults.cycles);
+}
+
+// Returns false if `arg` is not a known option
+static bool parse_option(sim_options &options, const std::string &arg, const std::string &value) {
+    if (arg == "--firmware")
+        options.firmware = value;
+    else if (arg == "--input")
+        options.input = value;
+    else if (arg == "--events")
+        options.events = value;
+    else if (arg == "--spool")
+        options.spool = value;
+    else if (arg == "--cycles")
+        options.cycles = std::stoull(value);
+    else if (arg == "--idle-cycles")
+        options.idle_cycles = std::stoull(value);
+    else if (arg == "--stop-on-event")
+        options.stop_events.push_back(event_match::parse(value));
+    else if (arg == "--timeout")
+        options.timeout = std::stod(value);
+    else
+        return false;
+    return true;
+}
+
+static sim_options parse_options(int argc, char **argv) {
+    sim_options options;
+    for (int i = 1; i < argc; i++) {
+        std::string arg = argv[i];
+        if (arg == "-h" || arg == "--help") {
+            usage(argv[0]);
+            exit(0);
+        }
+        if (arg == "--step-all") {
+            options.step_all = true;
+            continue;
+        }
+        if (i + 1 >= argc) {
+            fprintf(stderr, "%s: unknown option or missing value: %s\n", argv[0], arg.c_str());
+            usage(argv[0]);
+            exit(2);
+        }
+        std::string value = argv[++i];
+        bool known;
+        try {
+            known = parse_option(options, arg, value);
+        } catch (const std::exception &e) {
+            fprintf(stderr, "%s: invalid value for %s: %s\n", argv[0], arg.c_str(), e.what());
+            exit(2);
+        }
+        if (!known) {
+            fprintf(stderr, "%s: unknown option: %s\n", argv[0], arg.c_str());
+            usage(argv[0]);
+            exit(2);
+        }
+    }
+    return options;
+}
+
+int main(int argc, char **argv) {
+    sim_options options = parse_options(argc, argv);
+
+    sim_harness sim;
+    sim.step_all = options.step_all;
+
+    cxxrtl::agent agent(cxxrtl::spool(options.spool), sim.top);
+    if (getenv("DEBUG")) // can also be done when a condition is violated, etc
+        std::cerr << "Waiting for debugger on " << agent.start_debugging() << std::endl;
+
+    open_event_log(options.events);
+    open_input_commands(options.input);
+
+    auto eval = [&]() {
+        agent.step();
+        agent.advance(1_us);
+    };
+    auto tick = [&]() {
+        sim.tick(eval);
+        // if (sim.timestamp == 10)
+        //     agent.breakpoint(CXXRTL_LOCATION);
+    };
+
+    sim.flash.load_data(options.firmware, 0x00100000U);
+    sim.reset(eval);
+
+    unsigned long long cycle = 0, last_event_cycle = 0;
+    bool stop_event_seen = false;
+    add_event_listener([&](unsigned, const std::string &peripheral, const std::string &event_type, const json &payload) {
+        // events are logged during tick(), before the cycle that logs them is counted
+        last_event_cycle = cycle + 1;
+        for (auto &match : options.stop_events)
+            if (match.matches(peripheral, event_type, payload))
+                stop_event_seen = true;
+    });
+
+    using clock = std::chrono::steady_clock;
+    auto start_time = clock::now();
+    auto elapsed = [&]() { return std::chrono::duration<double>(clock::now() - start_time).count(); };
+
+    std::string stop_reason;
+    while (true) {
+        if (cycle >= options.cycles) {
+            stop_reason = "cycle limit";
+            break;
+        }
+        tick();
+        ++cycle;
+        if (stop_event_seen) {
+            stop_reason = "stop event";
+            break;
+        }
+        if (options.idle_cycles && cycle - last_event_cycle >= options.idle_cycles && input_commands_done()) {
+            stop_reason = "idle";
+            break;
+        }
+        // checking the clock is comparatively expensive, so only do it every few thousand cycles
+        if (options.timeout > 0 && (cycle & 0xfff) == 0 && elapsed() >= options.timeout) {
+            stop_reason = "timeout";
+            break;
+        }
+    }
+
+    double seconds = elapsed();
+    fprintf(stderr, "\nsim: stopped (%s) after %llu cycles in %.2f s (%.0f cycles/s)\n",
+        stop_reason.c_str(), cycle, seconds, seconds > 0 ? cycle / seconds : 0.0);
+
+    close_event_log();
+    return 0;
+}
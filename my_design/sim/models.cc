@@ -6,6 +6,7 @@
 #include <stdio.h>
 #include <fstream>
 #include <stdarg.h>
+#include <iterator>
 #include <unordered_map>
 #include "models.h"
 
@@ -52,66 +53,310 @@ std::string stringf(const char *format, ...)
     return result;
 }
 
+// Header shared by the binary event log and the compiled input command table
+namespace {
+struct binary_file_header {
+    char magic[8];
+    uint32_t version;
+    uint32_t record_size;
+    uint64_t record_count;
+    uint64_t names_offset;
+    uint64_t heap_offset;
+};
+static_assert(sizeof(binary_file_header) == 40, "unexpected binary file header layout");
+}
+
 // Action generation
 namespace {
-json input_cmds;
+// Input commands, in the record layout of the compiled command table; see
+// my_design/tools/compile_input.py for the format. `input.json` is encoded into the same records
+// when it is loaded, so that waits are matched without comparing JSON objects.
+struct input_command {
+    enum command_type : uint8_t {
+        ACTION = 0,
+        WAIT   = 1,
+    };
+
+    uint8_t type;
+    uint8_t payload_kind;
+    uint16_t peripheral;
+    uint16_t event;
+    uint8_t reserved[2];
+    uint64_t payload;
+};
+static_assert(sizeof(input_command) == 16, "unexpected input command layout");
+
+const char input_commands_magic[8] = {'C', 'F', 'I', 'N', 'C', 'M', 'D', '\0'};
+const uint32_t input_commands_version = 1;
+
+std::vector<input_command> input_cmds;
+event_encoder input_encoder;
 size_t input_ptr = 0;
 std::unordered_map<std::string, std::vector<action>> queued_actions;
+size_t queued_action_count = 0;
 
 // Update the queued_actions map
 void fetch_actions_into_queue() {
     while (input_ptr < input_cmds.size()) {
-        auto &cmd = input_cmds.at(input_ptr);
-        if (cmd["type"] == "wait")
+        const auto &cmd = input_cmds[input_ptr];
+        if (cmd.type == input_command::WAIT)
             break;
-        if (cmd["type"] != "action")
-            throw std::out_of_range("invalid 'type' value for command");
-        queued_actions[cmd["peripheral"]].emplace_back(cmd["event"], cmd["payload"]);
+        queued_actions[input_encoder.names.at(cmd.peripheral)].emplace_back(
+            input_encoder.names.at(cmd.event), input_encoder.decode_payload(cmd.payload_kind, cmd.payload));
+        ++queued_action_count;
         ++input_ptr;
     }
 }
+
+// Whether a logged event completes the wait `cmd`
+bool wait_matches(const input_command &cmd, const std::string &peripheral, const std::string &event_type, const json &payload) {
+    if (input_encoder.names[cmd.peripheral] != peripheral || input_encoder.names[cmd.event] != event_type)
+        return false;
+    switch (cmd.payload_kind) {
+        case event_encoder::PAYLOAD_UINT:
+            return payload.is_number_unsigned() ? payload.get<uint64_t>() == cmd.payload :
+                payload.is_number_integer() && payload.get<int64_t>() >= 0 && uint64_t(payload.get<int64_t>()) == cmd.payload;
+        case event_encoder::PAYLOAD_INT:
+            return payload.is_number_integer() && payload.get<int64_t>() == int64_t(cmd.payload);
+        case event_encoder::PAYLOAD_STRING:
+            return payload.is_string() && payload.get_ref<const std::string &>() == input_encoder.heap_item(cmd.payload);
+        default:
+            return payload == input_encoder.decode_payload(cmd.payload_kind, cmd.payload);
+    }
+}
+
+void load_json_commands(std::ifstream &f) {
+    json data = json::parse(f);
+    for (const auto &cmd : data["commands"]) {
+        input_command command = {};
+        if (cmd["type"] == "action")
+            command.type = input_command::ACTION;
+        else if (cmd["type"] == "wait")
+            command.type = input_command::WAIT;
+        else
+            throw std::out_of_range("invalid 'type' value for command");
+        event_record record = input_encoder.encode(0, cmd["peripheral"], cmd["event"], cmd["payload"]);
+        command.payload_kind = record.payload_kind;
+        command.peripheral = record.peripheral;
+        command.event = record.event;
+        command.payload = record.payload;
+        input_cmds.push_back(command);
+    }
+}
+
+template<typename T>
+T read_at(const std::string &data, uint64_t offset) {
+    if (offset + sizeof(T) > data.size())
+        throw std::out_of_range("input commands: truncated command table");
+    T result;
+    std::copy_n(data.data() + offset, sizeof(T), reinterpret_cast<char *>(&result));
+    return result;
+}
+
+void load_compiled_commands(const std::string &data) {
+    auto header = read_at<binary_file_header>(data, 0);
+    if (header.version != input_commands_version || header.record_size != sizeof(input_command))
+        throw std::runtime_error(stringf("input commands: unsupported command table version %u (record size %u)",
+            header.version, header.record_size));
+    input_cmds.resize(header.record_count);
+    for (size_t n = 0; n < input_cmds.size(); n++)
+        input_cmds[n] = read_at<input_command>(data, sizeof(header) + n * sizeof(input_command));
+    uint64_t offset = header.names_offset;
+    uint32_t name_count = read_at<uint32_t>(data, offset);
+    offset += sizeof(name_count);
+    for (uint32_t n = 0; n < name_count; n++) {
+        uint32_t size = read_at<uint32_t>(data, offset);
+        offset += sizeof(size);
+        if (offset + size > data.size())
+            throw std::out_of_range("input commands: truncated name table");
+        input_encoder.names.push_back(data.substr(offset, size));
+        offset += size;
+    }
+    input_encoder.heap = data.substr(header.heap_offset);
+    for (const auto &cmd : input_cmds)
+        if (cmd.peripheral >= name_count || cmd.event >= name_count || cmd.type > input_command::WAIT)
+            throw std::out_of_range("input commands: invalid command in command table");
+}
+}
+
+void clear_input_commands() {
+    input_cmds.clear();
+    input_encoder = event_encoder();
+    input_ptr = 0;
+    queued_actions.clear();
+    queued_action_count = 0;
 }
 
 void open_input_commands(const std::string &filename) {
-    std::ifstream f(filename);
+    std::ifstream f(filename, std::ios::binary);
     if (!f) {
-        throw std::runtime_error("failed to open event log for writing!");
+        throw std::runtime_error("failed to open input commands for reading: " + filename);
     }
-    json data = json::parse(f);
-    input_cmds = data["commands"];
+    clear_input_commands();
+    char magic[sizeof(input_commands_magic)] = {};
+    f.read(magic, sizeof(magic));
+    if (f && std::equal(std::begin(magic), std::end(magic), std::begin(input_commands_magic))) {
+        f.seekg(0);
+        load_compiled_commands(std::string(std::istreambuf_iterator<char>(f), {}));
+    } else {
+        f.clear();
+        f.seekg(0);
+        load_json_commands(f);
+    }
+    fetch_actions_into_queue();
 }
 
 // Event logging
 
 static std::ofstream event_log;
+static bool event_log_binary = false;
+static std::vector<event_listener> event_listeners;
+
+// Binary event log. The file starts with a fixed header, followed by `event_record`s that are
+// appended as events happen. The name table and payload heap of the `event_encoder` are appended
+// when the log is closed, and the header is then rewritten to point at them.
+// See my_design/tools/event_log.py for the reader.
+namespace {
+const char event_log_magic[8] = {'C', 'F', 'E', 'V', 'L', 'O', 'G', '\0'};
+const uint32_t event_log_version = 1;
+
+char event_log_buffer[1 << 20];
+uint64_t event_log_records = 0;
+event_encoder event_log_encoder;
+
+void write_binary_event(unsigned timestamp, const std::string &peripheral, const std::string &event_type, const json &payload) {
+    event_record record = event_log_encoder.encode(timestamp, peripheral, event_type, payload);
+    event_log.write(reinterpret_cast<const char *>(&record), sizeof(record));
+    ++event_log_records;
+}
+
+void write_binary_header(uint64_t names_offset, uint64_t heap_offset) {
+    binary_file_header header = {};
+    std::copy(std::begin(event_log_magic), std::end(event_log_magic), header.magic);
+    header.version = event_log_version;
+    header.record_size = sizeof(event_record);
+    header.record_count = event_log_records;
+    header.names_offset = names_offset;
+    header.heap_offset = heap_offset;
+    event_log.write(reinterpret_cast<const char *>(&header), sizeof(header));
+}
+
+bool ends_with(const std::string &str, const std::string &suffix) {
+    return str.size() >= suffix.size() && str.compare(str.size() - suffix.size(), suffix.size(), suffix) == 0;
+}
+}
+
+uint16_t event_encoder::intern_name(const std::string &name) {
+    auto found = name_ids.find(name);
+    if (found != name_ids.end())
+        return found->second;
+    if (names.size() > UINT16_MAX)
+        throw std::out_of_range("event log: too many distinct peripheral and event names");
+    uint16_t id = uint16_t(names.size());
+    names.push_back(name);
+    name_ids.emplace(name, id);
+    return id;
+}
+
+uint64_t event_encoder::intern_payload(const std::string &data) {
+    auto found = heap_offsets.find(data);
+    if (found != heap_offsets.end())
+        return found->second;
+    uint64_t offset = heap.size();
+    uint32_t size = uint32_t(data.size());
+    heap.append(reinterpret_cast<const char *>(&size), sizeof(size));
+    heap.append(data);
+    heap_offsets.emplace(data, offset);
+    return offset;
+}
+
+event_record event_encoder::encode(unsigned timestamp, const std::string &peripheral, const std::string &event_type, const json &payload) {
+    event_record record = {};
+    record.timestamp = timestamp;
+    record.peripheral = intern_name(peripheral);
+    record.event = intern_name(event_type);
+    if (payload.is_number_unsigned()) {
+        record.payload_kind = PAYLOAD_UINT;
+        record.payload = payload.get<uint64_t>();
+    } else if (payload.is_number_integer()) {
+        record.payload_kind = PAYLOAD_INT;
+        record.payload = uint64_t(payload.get<int64_t>());
+    } else if (payload.is_string()) {
+        record.payload_kind = PAYLOAD_STRING;
+        record.payload = intern_payload(payload.get_ref<const std::string &>());
+    } else {
+        record.payload_kind = PAYLOAD_JSON;
+        record.payload = intern_payload(payload.dump());
+    }
+    return record;
+}
+
+std::string event_encoder::heap_item(uint64_t offset) const {
+    uint32_t size;
+    if (offset + sizeof(size) > heap.size())
+        throw std::out_of_range("event encoder: heap offset out of range");
+    std::copy_n(heap.data() + offset, sizeof(size), reinterpret_cast<char *>(&size));
+    if (offset + sizeof(size) + size > heap.size())
+        throw std::out_of_range("event encoder: heap item out of range");
+    return heap.substr(offset + sizeof(size), size);
+}
+
+json event_encoder::decode_payload(uint8_t payload_kind, uint64_t payload) const {
+    switch (payload_kind) {
+        case PAYLOAD_UINT:   return json(payload);
+        case PAYLOAD_INT:    return json(int64_t(payload));
+        case PAYLOAD_STRING: return json(heap_item(payload));
+        case PAYLOAD_JSON:   return json::parse(heap_item(payload));
+        default: throw std::out_of_range("event encoder: invalid payload kind");
+    }
+}
 
 void open_event_log(const std::string &filename) {
-    event_log.open(filename);
+    event_log_binary = ends_with(filename, ".evlog");
+    if (event_log_binary) {
+        event_log.rdbuf()->pubsetbuf(event_log_buffer, sizeof(event_log_buffer));
+        event_log.open(filename, std::ios::binary);
+    } else {
+        event_log.open(filename);
+    }
     if (!event_log) {
         throw std::runtime_error("failed to open event log for writing!");
     }
-    event_log << "{" << std::endl;
-    event_log << "\"events\": [" << std::endl;
+    if (event_log_binary) {
+        // placeholder, rewritten by close_event_log
+        write_binary_header(0, 0);
+    } else {
+        event_log << "{" << std::endl;
+        event_log << "\"events\": [" << std::endl;
+    }
     fetch_actions_into_queue();
 }
 
 void log_event(unsigned timestamp, const std::string &peripheral, const std::string &event_type, json payload) {
     static bool had_event = false;
-    // Note: we don't use the JSON library to serialise the output event overall, so we get a partial log
-    // even if the simulation crashes.
-    // But we use `json` objects as a container for complex payloads that can be compared with the action input
-    if (had_event)
-        event_log << "," << std::endl;
-    auto payload_str = payload.dump();
-    event_log << stringf("{ \"timestamp\": %u, \"peripheral\": \"%s\", \"event\": \"%s\", \"payload\": %s }",
-        timestamp, peripheral.c_str(), event_type.c_str(), payload_str.c_str());
-    had_event = true;
+    if (!event_log.is_open()) {
+        // driven through the C API (sim_capi.cc), which collects events with a listener instead
+    } else if (event_log_binary) {
+        write_binary_event(timestamp, peripheral, event_type, payload);
+    } else {
+        // Note: we don't use the JSON library to serialise the output event overall, so we get a partial log
+        // even if the simulation crashes.
+        // But we use `json` objects as a container for complex payloads that can be compared with the action input
+        if (had_event)
+            event_log << "," << std::endl;
+        auto payload_str = payload.dump();
+        event_log << stringf("{ \"timestamp\": %u, \"peripheral\": \"%s\", \"event\": \"%s\", \"payload\": %s }",
+            timestamp, peripheral.c_str(), event_type.c_str(), payload_str.c_str());
+        had_event = true;
+    }
+    for (auto &listener : event_listeners)
+        listener(timestamp, peripheral, event_type, payload);
     // Check if we have actions waiting on this
     if (input_ptr < input_cmds.size()) {
-        const auto &cmd = input_cmds.at(input_ptr);
+        const auto &cmd = input_cmds[input_ptr];
         // fetch_actions_into_queue should never leave input_ptr sitting on an action
-        assert(cmd["type"] == "wait");
-        if (cmd["peripheral"] == peripheral && cmd["event"] == event_type && cmd["payload"] == payload) {
+        assert(cmd.type == input_command::WAIT);
+        if (wait_matches(cmd, peripheral, event_type, payload)) {
             ++input_ptr;
             fetch_actions_into_queue();
         }
@@ -120,14 +365,55 @@ void log_event(unsigned timestamp, const std::string &peripheral, const std::str
 
 std::vector<action> get_pending_actions(const std::string &peripheral) {
     std::vector<action> result;
+    if (queued_action_count == 0)
+        return result;
     if (queued_actions.count(peripheral))
         std::swap(queued_actions.at(peripheral), result);
+    queued_action_count -= result.size();
     return result;
 }
 
+bool any_pending_actions() {
+    return queued_action_count != 0;
+}
+
+bool has_pending_actions(const std::string &peripheral) {
+    auto found = queued_actions.find(peripheral);
+    return found != queued_actions.end() && !found->second.empty();
+}
+
+bool input_commands_done() {
+    return input_ptr >= input_cmds.size() && queued_action_count == 0;
+}
+
+void add_event_listener(event_listener listener) {
+    event_listeners.push_back(std::move(listener));
+}
+
+void queue_action(const std::string &peripheral, const std::string &event, const json &payload) {
+    queued_actions[peripheral].emplace_back(event, payload);
+    ++queued_action_count;
+}
+
 void close_event_log() {
-    event_log << std::endl << "]" << std::endl;
-    event_log << "}" << std::endl;
+    if (event_log_binary) {
+        uint64_t names_offset = uint64_t(event_log.tellp());
+        uint32_t name_count = uint32_t(event_log_encoder.names.size());
+        event_log.write(reinterpret_cast<const char *>(&name_count), sizeof(name_count));
+        for (const auto &name : event_log_encoder.names) {
+            uint32_t size = uint32_t(name.size());
+            event_log.write(reinterpret_cast<const char *>(&size), sizeof(size));
+            event_log.write(name.data(), size);
+        }
+        uint64_t heap_offset = uint64_t(event_log.tellp());
+        event_log.write(event_log_encoder.heap.data(), event_log_encoder.heap.size());
+        event_log.seekp(0);
+        write_binary_header(names_offset, heap_offset);
+        event_log.close();
+    } else {
+        event_log << std::endl << "]" << std::endl;
+        event_log << "}" << std::endl;
+    }
     if (input_ptr != input_cmds.size()) {
         fprintf(stderr, "WARNING: not all input actions were executed (%d/%d remain)!\n",
              int(input_cmds.size()) - int(input_ptr), int(input_cmds.size()));
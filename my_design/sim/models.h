@@ -6,6 +6,8 @@
 #include <vector>
 #include <algorithm>
 #include <optional>
+#include <functional>
+#include <unordered_map>
 
 #include "vendor/nlohmann/json.hpp"
 
@@ -26,21 +28,112 @@ struct action {
 
 void open_event_log(const std::string &filename);
 void open_input_commands(const std::string &filename);
+// Drop the input commands and the actions queued from them, as if none had been opened
+void clear_input_commands();
 void log_event(unsigned timestamp, const std::string &peripheral, const std::string &event_type, json payload);
 std::vector<action> get_pending_actions(const std::string &peripheral);
 void close_event_log();
 
+// True once every input command has been matched or delivered to its peripheral model
+bool input_commands_done();
+
+// Called for every logged event, after it has been written to the event log
+using event_listener = std::function<void(unsigned timestamp, const std::string &peripheral,
+    const std::string &event_type, const json &payload)>;
+void add_event_listener(event_listener listener);
+
+// Queue an action for a peripheral model, as if it had come from the input commands
+void queue_action(const std::string &peripheral, const std::string &event, const json &payload);
+
+// Whether `get_pending_actions` would return anything, for any peripheral or for one of them
+bool any_pending_actions();
+bool has_pending_actions(const std::string &peripheral);
+
+// The signals a model reacts to. `changed()` is true if any of them changed since the previous
+// call, and on the first call. A model whose watched signals are unchanged, that is not busy with
+// timed work and has no pending actions would not change state when stepped, so the harness skips
+// it.
+struct watch_list {
+    template<size_t Bits>
+    watch_list &add(const value<Bits> &signal) {
+        for (size_t n = 0; n < value<Bits>::chunks; n++)
+            chunks.push_back(&signal.data[n]);
+        last.resize(chunks.size());
+        return *this;
+    }
+
+    bool changed() {
+        bool result = first;
+        first = false;
+        for (size_t n = 0; n < chunks.size(); n++) {
+            if (*chunks[n] != last[n]) {
+                last[n] = *chunks[n];
+                result = true;
+            }
+        }
+        return result;
+    }
+
+private:
+    std::vector<const chunk_t *> chunks;
+    std::vector<chunk_t> last;
+    bool first = true;
+};
+
+// A logged event in the fixed-size record layout of the binary event log; see
+// my_design/tools/event_log.py for the format.
+struct event_record {
+    uint64_t timestamp;
+    uint16_t peripheral;
+    uint16_t event;
+    uint8_t payload_kind;
+    uint8_t reserved[3];
+    uint64_t payload;
+};
+static_assert(sizeof(event_record) == 24, "unexpected event record layout");
+
+// Encodes events into `event_record`s, interning peripheral and event names into 16-bit IDs and
+// deduplicating string and JSON payloads into a heap of length-prefixed blobs.
+struct event_encoder {
+    enum payload_kind : uint8_t {
+        PAYLOAD_UINT   = 0,
+        PAYLOAD_INT    = 1,
+        PAYLOAD_STRING = 2, // heap offset
+        PAYLOAD_JSON   = 3, // heap offset of the serialised JSON value
+    };
+
+    std::vector<std::string> names;
+    std::string heap;
+
+    event_record encode(unsigned timestamp, const std::string &peripheral, const std::string &event_type, const json &payload);
+
+    // Inverse of `encode` for the payload
+    json decode_payload(uint8_t payload_kind, uint64_t payload) const;
+    std::string heap_item(uint64_t offset) const;
+
+private:
+    std::unordered_map<std::string, uint16_t> name_ids;
+    std::unordered_map<std::string, uint64_t> heap_offsets;
+
+    uint16_t intern_name(const std::string &name);
+    uint64_t intern_payload(const std::string &data);
+};
+
 struct spiflash_model {
     std::string name;
     spiflash_model(const std::string &name, const value<1> &clk, const value<1> &csn, const value<4> &d_o, const value<4> &d_oe, value<4> &d_i) : 
         name(name), clk(clk), csn(csn), d_o(d_o), d_oe(d_oe), d_i(d_i) {
         data.resize(16*1024*1024);
         std::fill(data.begin(), data.end(), 0xFF); // flash starting value
+        watch.add(clk).add(csn);
     };
 
     void load_data(const std::string &filename, unsigned offset);
     void step(unsigned timestamp);
 
+    watch_list watch;
+    bool busy() const { return false; }
+
 private:
     std::vector<uint8_t> data;
     const value<1> &clk;
@@ -63,9 +156,15 @@ private:
 
 struct uart_model {
     std::string name;
-    uart_model(const std::string &name, const value<1> &tx, value<1> &rx, unsigned baud_div = 25000000/115200) : name(name), tx(tx), rx(rx), baud_div(baud_div) {};
+    uart_model(const std::string &name, const value<1> &tx, value<1> &rx, unsigned baud_div = 25000000/115200) : name(name), tx(tx), rx(rx), baud_div(baud_div) {
+        watch.add(tx);
+    };
 
     void step(unsigned timestamp);
+
+    watch_list watch;
+    // receiving or transmitting a character, or about to reset the transmit counter
+    bool busy() const { return s.rx_counter != 0 || s.tx_active || s.tx_counter != 0; }
 private:
     const value<1> &tx;
     value<1> &rx;
@@ -73,7 +172,7 @@ private:
 
     // model state
     struct {
-        bool tx_last;
+        bool tx_last = false;
         int rx_counter = 0;
         uint8_t rx_sr = 0;
         bool tx_active = false;
@@ -85,17 +184,22 @@ private:
 struct gpio_model {
     static constexpr unsigned width = 8;
     std::string name;
-    gpio_model(const std::string &name, const value<width> &o, const value<width> &oe, value<width> &i) : name(name), o(o), oe(oe), i(i) {};
+    gpio_model(const std::string &name, const value<width> &o, const value<width> &oe, value<width> &i) : name(name), o(o), oe(oe), i(i) {
+        watch.add(o).add(oe);
+    };
 
     void step(unsigned timestamp);
 
+    watch_list watch;
+    bool busy() const { return false; }
+
 private:
-    uint32_t input_data;
+    uint32_t input_data = 0;
     const value<width> &o;
     const value<width> &oe;
     value<width> &i;
     struct {
-        uint32_t o_last, oe_last;
+        uint32_t o_last = 0, oe_last = 0;
     } s;
 };
 
@@ -104,10 +208,14 @@ struct spi_model {
     std::string name;
     spi_model(const std::string &name, const value<1> &clk, const value<1> &csn, const value<1> &copi, value<1> &cipo) : 
         name(name), clk(clk), csn(csn), copi(copi), cipo(cipo) {
+        watch.add(clk).add(csn);
     };
 
     void step(unsigned timestamp);
 
+    watch_list watch;
+    bool busy() const { return false; }
+
 private:
     std::vector<uint8_t> data;
     const value<1> &clk;
@@ -126,9 +234,14 @@ private:
 
 struct i2c_model {
     std::string name;
-    i2c_model(const std::string &name, const value<1> &sda_oe, value<1> &sda_i, const value<1> &scl_oe, value<1> &scl_i) : name(name), sda_oe(sda_oe), sda_i(sda_i), scl_oe(scl_oe), scl_i(scl_i) {};
+    i2c_model(const std::string &name, const value<1> &sda_oe, value<1> &sda_i, const value<1> &scl_oe, value<1> &scl_i) : name(name), sda_oe(sda_oe), sda_i(sda_i), scl_oe(scl_oe), scl_i(scl_i) {
+        watch.add(sda_oe).add(scl_oe);
+    };
 
     void step(unsigned timestamp);
+
+    watch_list watch;
+    bool busy() const { return false; }
 private:
     const value<1> &sda_oe;
     value<1> &sda_i;
@@ -138,13 +251,13 @@ private:
     // model state
     struct {
         int byte_count = 0;
-        int bit_count;
-        bool do_ack;
-        bool is_read;
-        uint8_t read_data;
-        uint8_t sr;
+        int bit_count = 0;
+        bool do_ack = false;
+        bool is_read = false;
+        uint8_t read_data = 0;
+        uint8_t sr = 0;
         bool drive_sda = true;
-        bool last_sda, last_scl;
+        bool last_sda = false, last_scl = false;
     } s;
 };
 
@@ -0,0 +1,141 @@
+#undef NDEBUG
+
+#include <cxxrtl/cxxrtl.h>
+#include "harness.h"
+
+#include <memory>
+#include <string>
+#include <vector>
+
+using namespace cxxrtl_design;
+
+// C API of the shared library build of the simulation (`libsim_soc`), used by
+// my_design/sim/sim_lib.py to drive the SoC in-process. Events are collected as binary event log
+// records instead of being written to a file.
+//
+// The peripheral models keep the input commands and event listeners in globals, so only one
+// simulation can exist in a process at a time.
+
+namespace {
+struct sim_state {
+    sim_harness harness;
+    uint64_t cycle = 0;
+    bool event_seen = false;
+    std::vector<event_record> events;
+    event_encoder encoder;
+};
+
+sim_state *active_sim = nullptr;
+bool listener_added = false;
+std::string last_error;
+
+// Run `body`, turning a C++ exception into a failure result and `sim_last_error()`
+template<typename Body, typename Result>
+Result guarded(Body body, Result failure) {
+    try {
+        return body();
+    } catch (const std::exception &e) {
+        last_error = e.what();
+        return failure;
+    }
+}
+}
+
+extern "C" {
+
+// Create the simulation, load `firmware` into flash and reset the SoC. `input` may name an input
+// commands file, as for the `sim_soc` executable, or be NULL. Returns NULL on failure.
+sim_state *sim_create(const char *firmware, const char *input) {
+    return guarded([&]() -> sim_state * {
+        if (active_sim)
+            throw std::runtime_error("a simulation already exists in this process");
+        if (!listener_added) {
+            add_event_listener([](unsigned timestamp, const std::string &peripheral,
+                    const std::string &event_type, const json &payload) {
+                if (!active_sim)
+                    return;
+                active_sim->events.push_back(active_sim->encoder.encode(timestamp, peripheral, event_type, payload));
+                active_sim->event_seen = true;
+            });
+            listener_added = true;
+        }
+        auto sim = std::make_unique<sim_state>();
+        if (input)
+            open_input_commands(input);
+        else
+            clear_input_commands();
+        sim->harness.flash.load_data(firmware, 0x00100000U);
+        active_sim = sim.get();
+        sim->harness.reset([&]() { sim->harness.top.step(); });
+        return sim.release();
+    }, (sim_state *)nullptr);
+}
+
+void sim_destroy(sim_state *sim) {
+    if (active_sim == sim)
+        active_sim = nullptr;
+    delete sim;
+}
+
+// Run up to `cycles` clock cycles, or until the first cycle that logs an event if `until_event`
+// is set. Returns the number of cycles run, or -1 on failure.
+int64_t sim_step(sim_state *sim, uint64_t cycles, int until_event) {
+    return guarded([&]() -> int64_t {
+        sim->event_seen = false;
+        uint64_t count = 0;
+        while (count < cycles) {
+            sim->harness.tick([&]() { sim->harness.top.step(); });
+            ++count;
+            if (until_event && sim->event_seen)
+                break;
+        }
+        sim->cycle += count;
+        return int64_t(count);
+    }, int64_t(-1));
+}
+
+// Queue an action for a peripheral model; `payload` is a JSON value. Returns 0, or -1 on failure.
+int sim_queue_action(sim_state *sim, const char *peripheral, const char *event, const char *payload) {
+    return guarded([&]() {
+        queue_action(peripheral, event, json::parse(payload));
+        return 0;
+    }, -1);
+}
+
+uint64_t sim_cycle(sim_state *sim) {
+    return sim->cycle;
+}
+
+uint64_t sim_timestamp(sim_state *sim) {
+    return sim->harness.timestamp;
+}
+
+// Events logged since the last `sim_clear_events()`, in the binary event log record layout
+const event_record *sim_events(sim_state *sim, size_t *count) {
+    *count = sim->events.size();
+    return sim->events.data();
+}
+
+void sim_clear_events(sim_state *sim) {
+    sim->events.clear();
+}
+
+size_t sim_name_count(sim_state *sim) {
+    return sim->encoder.names.size();
+}
+
+const char *sim_name(sim_state *sim, size_t id) {
+    return sim->encoder.names.at(id).c_str();
+}
+
+// The heap that string and JSON payloads of `sim_events()` point into
+const char *sim_heap(sim_state *sim, size_t *size) {
+    *size = sim->encoder.heap.size();
+    return sim->encoder.heap.data();
+}
+
+const char *sim_last_error() {
+    return last_error.c_str();
+}
+
+}
@@ -0,0 +1,160 @@
+"""In-process driver for the shared library build of the simulation (`chipflow sim --lib`).
+
+Unlike the `sim_soc` executable, which replays `input.json` and writes `events.json`, the library
+is stepped from Python, so testbenches can react to events as they happen::
+
+    with SimLib("build/software/software.bin") as sim:
+        sim.step(100_000, until_event=True)
+        for event in sim.pop_events():
+            if event["peripheral"] == "gpio_1" and event["event"] == "change":
+                sim.queue_action("gpio_1", "set", "00111100")
+
+Events are returned as NumPy arrays of `event_log.RECORD_DTYPE` records by `pop_records()`, or
+decoded into the JSON event log schema by `pop_events()`. Only one simulation can exist in a
+process at a time.
+"""
+import ctypes
+import json
+import os
+import sys
+
+import numpy as np
+
+from ..tools.event_log import RECORD_DTYPE, decode_payload
+
+
+__all__ = ["SimLib", "default_library_path"]
+
+
+def default_library_path(build_dir="build/sim"):
+    if os.name == "nt":
+        filename = "sim_soc.dll"
+    elif sys.platform == "darwin":
+        filename = "libsim_soc.dylib"
+    else:
+        filename = "libsim_soc.so"
+    return os.path.join(build_dir, filename)
+
+
+def _load_library(path):
+    lib = ctypes.CDLL(os.path.abspath(path))
+    size_p = ctypes.POINTER(ctypes.c_size_t)
+    for name, restype, argtypes in [
+        ("sim_create",       ctypes.c_void_p, [ctypes.c_char_p, ctypes.c_char_p]),
+        ("sim_destroy",      None,            [ctypes.c_void_p]),
+        ("sim_step",         ctypes.c_int64,  [ctypes.c_void_p, ctypes.c_uint64, ctypes.c_int]),
+        ("sim_queue_action", ctypes.c_int,    [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p,
+                                               ctypes.c_char_p]),
+        ("sim_cycle",        ctypes.c_uint64, [ctypes.c_void_p]),
+        ("sim_timestamp",    ctypes.c_uint64, [ctypes.c_void_p]),
+        ("sim_events",       ctypes.c_void_p, [ctypes.c_void_p, size_p]),
+        ("sim_clear_events", None,            [ctypes.c_void_p]),
+        ("sim_name_count",   ctypes.c_size_t, [ctypes.c_void_p]),
+        ("sim_name",         ctypes.c_char_p, [ctypes.c_void_p, ctypes.c_size_t]),
+        ("sim_heap",         ctypes.c_void_p, [ctypes.c_void_p, size_p]),
+        ("sim_last_error",   ctypes.c_char_p, []),
+    ]:
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return lib
+
+
+class SimLib:
+    """The SoC and its peripheral models, loaded from the simulation shared library.
+
+    `firmware` is loaded into flash before reset. `input_commands`, if given, is an input commands
+    file that is replayed as with the `sim_soc` executable, in addition to actions queued from
+    Python.
+    """
+    def __init__(self, firmware, *, input_commands=None, library=None):
+        self._lib = _load_library(library or default_library_path())
+        self._sim = self._lib.sim_create(
+            os.fsencode(firmware), None if input_commands is None else os.fsencode(input_commands))
+        if not self._sim:
+            raise RuntimeError(f"failed to create simulation: {self._last_error()}")
+        self._names = []
+
+    def _last_error(self):
+        return self._lib.sim_last_error().decode()
+
+    def close(self):
+        if self._sim:
+            self._lib.sim_destroy(self._sim)
+            self._sim = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if getattr(self, "_sim", None):
+            self.close()
+
+    @property
+    def cycle(self):
+        """Clock cycles run since reset."""
+        return self._lib.sim_cycle(self._sim)
+
+    @property
+    def timestamp(self):
+        """Timestamp of the next event, in the units of the event log (two per clock cycle)."""
+        return self._lib.sim_timestamp(self._sim)
+
+    def step(self, cycles=1, *, until_event=False):
+        """Run `cycles` clock cycles, or stop after the first cycle that logs an event if
+        `until_event` is set. Returns the number of cycles run."""
+        count = self._lib.sim_step(self._sim, cycles, int(until_event))
+        if count < 0:
+            raise RuntimeError(f"simulation failed: {self._last_error()}")
+        return count
+
+    def queue_action(self, peripheral, event, payload):
+        """Queue an action for a peripheral model, as an `action` command in `input.json` would."""
+        result = self._lib.sim_queue_action(self._sim, peripheral.encode(), event.encode(),
+                                            json.dumps(payload).encode())
+        if result < 0:
+            raise RuntimeError(f"failed to queue action: {self._last_error()}")
+
+    @property
+    def names(self):
+        """Peripheral and event names indexed by the `peripheral` and `event` record fields."""
+        count = self._lib.sim_name_count(self._sim)
+        while len(self._names) < count:
+            self._names.append(self._lib.sim_name(self._sim, len(self._names)).decode())
+        return self._names
+
+    def pop_records(self):
+        """Remove and return the events logged so far as an array of `RECORD_DTYPE` records."""
+        count = ctypes.c_size_t()
+        address = self._lib.sim_events(self._sim, ctypes.byref(count))
+        if count.value == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records = np.frombuffer(ctypes.string_at(address, count.value * RECORD_DTYPE.itemsize),
+                                dtype=RECORD_DTYPE)
+        self._lib.sim_clear_events(self._sim)
+        return records
+
+    def _heap_item(self, offset):
+        size = ctypes.c_size_t()
+        address = self._lib.sim_heap(self._sim, ctypes.byref(size))
+        (length,) = np.frombuffer(ctypes.string_at(address + offset, 4), dtype="<u4")
+        return ctypes.string_at(address + offset + 4, int(length)).decode()
+
+    def decode(self, records):
+        """Decode records into dicts in the JSON event log schema."""
+        names = self.names
+        return [{
+            "timestamp": timestamp,
+            "peripheral": names[peripheral],
+            "event": names[event],
+            "payload": decode_payload(kind, payload, self._heap_item),
+        } for timestamp, peripheral, event, kind, payload in zip(
+            records["timestamp"].tolist(), records["peripheral"].tolist(), records["event"].tolist(),
+            records["payload_kind"].tolist(), records["payload"].tolist())]
+
+    def pop_events(self):
+        """Remove and return the events logged so far as dicts in the JSON event log schema."""
+        return self.decode(self.pop_records())
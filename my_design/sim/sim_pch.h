@@ -0,0 +1,13 @@
+// Headers shared by the simulation translation units, precompiled once by `task_build_sim_pch`
+// so that the CXXRTL runtime and the JSON library are not re-parsed for every object file.
+#pragma once
+
+#include <cxxrtl/cxxrtl.h>
+#include <algorithm>
+#include <fstream>
+#include <functional>
+#include <optional>
+#include <string>
+#include <vector>
+
+#include "vendor/nlohmann/json.hpp"
@@ -0,0 +1,66 @@
+/* SPDX-License-Identifier: BSD-2-Clause */
+// CSR access latency microbenchmark, built into csr_bench.bin by the build_csr_bench task and run
+// by my_design.tools.bench_csr. Prints the mcycle count of ACCESSES loads or stores of a register
+// in SRAM, of a project IP (on the 32-bit CSR bus with csr_data_width = 32) and of the SoC ID (always
+// on the 8-bit CSR bus), one "name: count" line each in hex, then an EOT character.
+#include <stdint.h>
+#include "generated/soc.h"
+
+#define ACCESSES 256
+
+static volatile uint32_t sram_word;
+
+static inline uint32_t read_mcycle(void) {
+    uint32_t value;
+    asm volatile ("csrr %0, mcycle" : "=r"(value));
+    return value;
+}
+
+// unrolled, so that instruction fetches from flash do not dominate
+#define REPEAT8(x) x; x; x; x; x; x; x; x
+
+static uint32_t time_loads(volatile uint32_t *reg) {
+    uint32_t start = read_mcycle();
+    for (unsigned i = 0; i < ACCESSES / 8; i++) {
+        REPEAT8((void)*reg);
+    }
+    return read_mcycle() - start;
+}
+
+static uint32_t time_stores(volatile uint32_t *reg, uint32_t value) {
+    uint32_t start = read_mcycle();
+    for (unsigned i = 0; i < ACCESSES / 8; i++) {
+        REPEAT8(*reg = value);
+    }
+    return read_mcycle() - start;
+}
+
+static void report(const char *name, uint32_t count) {
+    puts(name);
+    puts(": ");
+    puthex(count);
+    puts("\r\n");
+}
+
+void main() {
+    uart_init(UART_0, 25000000/115200);
+
+    // mcycle does not count out of reset
+    asm volatile ("csrw 0x320, zero"); // mcountinhibit
+
+#ifdef MOTOR_PWM_BANK
+    volatile uint32_t *ip_reg = (volatile uint32_t *)MOTOR_PWM_BANK->denom;
+#else
+    volatile uint32_t *ip_reg = &MOTOR_PWM0->denom;
+#endif
+
+    report("sram load", time_loads(&sram_word));
+    report("sram store", time_stores(&sram_word, 0xFF));
+    report("ip load", time_loads(ip_reg));
+    report("ip store", time_stores(ip_reg, 0xFF));
+    report("soc_id load", time_loads(&SOC_ID->type));
+    putc('\x04');
+
+    while (1)
+        ;
+}
@@ -1,3 +1,4 @@
+import filecmp
 import os
 import sys
 from pathlib import Path
@@ -15,8 +16,19 @@ RISCVCC = f"{sys.executable} -m ziglang cc -target riscv32-freestanding-musl"
 CINCLUDES = f"-I. -I{BUILD_DIR} -I{DESIGN_DIR}/software"
 LINKER_SCR = f"{BUILD_DIR}/generated/sections.lds"
 SOFTWARE_START = f"{BUILD_DIR}/generated/start.S"
-CFLAGS = f"-g -mcpu=baseline_rv32-a-c-d -mabi=ilp32 -Wl,-Bstatic,-T,"
-CFLAGS += f"{LINKER_SCR},--strip-debug -static -ffreestanding -nostdlib {CINCLUDES}"
+CFLAGS = f"-g -mcpu=baseline_rv32-a-c-d -mabi=ilp32 -ffreestanding {CINCLUDES}"
+LDFLAGS = f"-g -mcpu=baseline_rv32-a-c-d -mabi=ilp32 -Wl,-Bstatic,-T,"
+LDFLAGS += f"{LINKER_SCR},--strip-debug -static -ffreestanding -nostdlib"
+OBJ_DIR = f"{BUILD_DIR}/obj"
+CSR_BENCH_SOURCE = f"{DESIGN_DIR}/software/bench/csr_bench.c"
+
+# Translation units are compiled independently, so build them in parallel. A plain `doit` builds
+# the firmware only; the CSR benchmark is built when asked for by name.
+DOIT_CONFIG = {
+    "default_tasks": ["build_software"],
+    "num_process": os.cpu_count() or 1,
+    "par_type": "thread",
+}
 
 
 def task_gather_depencencies():
@@ -38,8 +50,11 @@ def task_gather_depencencies():
 
     def copy_files():
         _create_build_dir()
-        for i in range(len(src_files)):
-            shutil.copyfile(src_files[i - 1], target_files[i - 1])
+        for src_file, target_file in zip(src_files, target_files):
+            # leave unchanged files alone so that their objects are not rebuilt
+            if os.path.exists(target_file) and filecmp.cmp(src_file, target_file, shallow=False):
+                continue
+            shutil.copyfile(src_file, target_file)
 
     return {
         "actions": [(copy_files)],
@@ -49,17 +64,32 @@ def task_gather_depencencies():
     }
 
 
+@create_after(executed="gather_depencencies", target_regex=".*\\.o")
+def task_build_software_object():
+    for source in _software_sources():
+        obj, dep = _object_paths(source)
+        yield {
+            "name": os.path.relpath(source, BUILD_DIR),
+            "actions": [
+                (_create_parent_dir, [obj]),
+                f"{RISCVCC} {CFLAGS} -MMD -MF {dep} -c -o {obj} {source}",
+            ],
+            # headers are known from the dependency file written by the previous compile; on the
+            # first build the object does not exist yet, so it is built regardless
+            "file_dep": [source] + _read_dep_file(dep),
+            "targets": [obj],
+            "verbosity": 2
+        }
+
+
 @create_after(executed="gather_depencencies", target_regex=".*/software\\.elf")
 def task_build_software_elf():
-    sources = [SOFTWARE_START]
-    sources += _gather_source_paths(f"{BUILD_DIR}/drivers", ["*.c", "*.S"])
-    sources += _gather_source_paths(f"{BUILD_DIR}", ["*.c"])
-
-    sources_str = " ".join(sources)
+    objects = [_object_paths(source)[0] for source in _software_sources()]
+    objects_str = " ".join(objects)
 
     return {
-        "actions": [f"{RISCVCC} {CFLAGS} -o {BUILD_DIR}/software.elf {sources_str}"],
-        "file_dep": sources + [LINKER_SCR],
+        "actions": [f"{RISCVCC} {LDFLAGS} -o {BUILD_DIR}/software.elf {objects_str}"],
+        "file_dep": objects + [LINKER_SCR],
         "targets": [f"{BUILD_DIR}/software.elf"],
         "verbosity": 2
     }
@@ -75,10 +105,61 @@ def task_build_software():
     }
 
 
+@create_after(executed="gather_depencencies", target_regex=".*/csr_bench\\.bin")
+def task_build_csr_bench():
+    """CSR access latency microbenchmark, run by `my_design.tools.bench_csr`: the start-up code and
+    drivers of the firmware, with `bench/csr_bench.c` instead of the project sources."""
+    obj = f"{OBJ_DIR}/bench/csr_bench.c.o"
+    objects = [_object_paths(source)[0] for source in _software_sources()
+               if os.path.dirname(source) != BUILD_DIR]
+    objects_str = " ".join(objects)
+
+    return {
+        "actions": [
+            (_create_parent_dir, [obj]),
+            f"{RISCVCC} {CFLAGS} -c -o {obj} {CSR_BENCH_SOURCE}",
+            f"{RISCVCC} {LDFLAGS} -o {BUILD_DIR}/csr_bench.elf {obj} {objects_str}",
+            f"{sys.executable} -m ziglang objcopy -O binary {BUILD_DIR}/csr_bench.elf {BUILD_DIR}/csr_bench.bin",
+        ],
+        "file_dep": [CSR_BENCH_SOURCE, LINKER_SCR] + objects,
+        "targets": [obj, f"{BUILD_DIR}/csr_bench.elf", f"{BUILD_DIR}/csr_bench.bin"],
+        "verbosity": 2
+    }
+
+
 def _create_build_dir():
     Path(f"{BUILD_DIR}/drivers").mkdir(parents=True, exist_ok=True)
 
 
+def _create_parent_dir(path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+
+def _software_sources():
+    sources = [SOFTWARE_START]
+    sources += _gather_source_paths(f"{BUILD_DIR}/drivers", ["*.c", "*.S"])
+    sources += _gather_source_paths(f"{BUILD_DIR}", ["*.c"])
+    return sources
+
+
+def _object_paths(source):
+    rel_path = os.path.relpath(source, BUILD_DIR)
+    obj = f"{OBJ_DIR}/{rel_path}.o"
+    return obj, f"{OBJ_DIR}/{rel_path}.d"
+
+
+def _read_dep_file(dep_file):
+    """Return the prerequisites listed in a make-style dependency file written by `-MMD`."""
+    try:
+        with open(dep_file, "r") as f:
+            text = f.read().replace("\\\n", " ")
+    except FileNotFoundError:
+        return []
+    _, _, prerequisites = text.partition(": ")
+    # the first prerequisite is the source itself
+    return [path for path in prerequisites.split()[1:] if os.path.exists(path)]
+
+
 def _get_source_rel_paths(source_dir, globs):
     abs_source_dir = str(Path(source_dir).absolute())
     rel_paths = []
@@ -7,7 +7,38 @@
 typedef struct {
     uint32_t outval;
     uint32_t conf;
+    // with a sample FIFO only
+    uint32_t fifo;
+    uint32_t rate;
+    uint32_t fifo_status;
+    uint32_t fifo_int;
+    uint32_t fifo_depth;
 } pdm_regs_t;
 
-#endif
+#define PDM_CONF_EN                     0x1
+#define PDM_CONF_STREAM                 0x2
+
+#define PDM_FIFO_STATUS_HALF_EMPTY      0x1
+#define PDM_FIFO_STATUS_LEVEL(status)   ((status) >> 1)
+
+#define PDM_FIFO_INT_UNDERRUN           0x1
+#define PDM_FIFO_INT_OVERFLOW           0x2
 
+// Play samples from the FIFO, one every rate + 1 clock cycles.
+static inline void pdm_start_stream(volatile pdm_regs_t *pdm, uint16_t rate) {
+    pdm->rate = rate;
+    pdm->conf = PDM_CONF_EN | PDM_CONF_STREAM;
+}
+
+// Push as many of count samples as there is room for in the FIFO, without waiting; returns the
+// number pushed. Calling it whenever PDM_FIFO_STATUS_HALF_EMPTY is set refills the FIFO in bursts.
+static inline unsigned pdm_write_samples(volatile pdm_regs_t *pdm, const uint16_t *samples, unsigned count) {
+    unsigned space = pdm->fifo_depth - PDM_FIFO_STATUS_LEVEL(pdm->fifo_status);
+    if (count > space)
+        count = space;
+    for (unsigned i = 0; i < count; i++)
+        pdm->fifo = samples[i];
+    return count;
+}
+
+#endif
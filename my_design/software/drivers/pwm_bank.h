@@ -0,0 +1,51 @@
+/* SPDX-License-Identifier: BSD-2-Clause */
+#ifndef PWM_BANK_H
+#define PWM_BANK_H
+
+#include <stdint.h>
+
+#define PWM_BANK_MAX_CHANNELS 16
+
+// With a 32-bit CSR bus, a store of less than a word to the bank is done as a load and a store of the
+// whole word, which writes back the other bytes as read (and so clears the stop_int bits set in
+// them): write numr, denom and conf through the helpers below, which only make 32-bit accesses.
+typedef struct {
+    uint16_t numr[PWM_BANK_MAX_CHANNELS];  // staged until applied
+    uint16_t denom[PWM_BANK_MAX_CHANNELS]; // staged until applied, only denom[0] with a shared timebase
+    uint8_t conf[PWM_BANK_MAX_CHANNELS];
+    uint8_t reserved[16];
+    uint32_t stop_int;
+    uint32_t status;
+    uint32_t apply;
+} pwm_bank_regs_t;
+
+// Write count 16-bit registers from regs, two per bus word; an odd last register is merged with
+// the value read back from its neighbour.
+static inline void pwm_bank_write_pairs(volatile uint16_t *regs, const uint16_t *values, unsigned count) {
+    volatile uint32_t *pairs = (volatile uint32_t *)regs;
+    unsigned i;
+    for (i = 0; i + 1 < count; i += 2)
+        pairs[i / 2] = values[i] | ((uint32_t)values[i + 1] << 16);
+    if (i < count)
+        pairs[i / 2] = values[i] | (pairs[i / 2] & 0xffff0000);
+}
+
+// Stage the duty cycles of channels 0 to count - 1 and apply them together. Two channels are
+// written per bus word, so that retargeting every channel takes count / 2 + 1 writes.
+static inline void pwm_bank_set_numr(volatile pwm_bank_regs_t *bank, const uint16_t *numr, unsigned count) {
+    pwm_bank_write_pairs(bank->numr, numr, count);
+    bank->apply = (1u << count) - 1;
+}
+
+// Stage the periods of channels 0 to count - 1, to be applied with their duty cycles.
+static inline void pwm_bank_set_denom(volatile pwm_bank_regs_t *bank, const uint16_t *denom, unsigned count) {
+    pwm_bank_write_pairs(bank->denom, denom, count);
+}
+
+static inline void pwm_bank_set_conf(volatile pwm_bank_regs_t *bank, unsigned channel, uint8_t conf) {
+    volatile uint32_t *words = (volatile uint32_t *)bank->conf;
+    unsigned shift = 8 * (channel % 4);
+    words[channel / 4] = (words[channel / 4] & ~(0xffu << shift)) | ((uint32_t)conf << shift);
+}
+
+#endif
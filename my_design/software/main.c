@@ -30,6 +30,15 @@ void main() {
 
     uart_puts(UART_1, "ABCD");
 
+#ifdef MOTOR_PWM_BANK
+    const uint16_t numr[10] = {0x1F, 0x3F, 0, 0, 0, 0, 0, 0, 0, 0x7F};
+    const uint16_t denom[10] = {0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF};
+    pwm_bank_set_denom(MOTOR_PWM_BANK, denom, 10);
+    pwm_bank_set_conf(MOTOR_PWM_BANK, 0, 0x3);
+    pwm_bank_set_conf(MOTOR_PWM_BANK, 1, 0x3);
+    pwm_bank_set_conf(MOTOR_PWM_BANK, 9, 0x3);
+    pwm_bank_set_numr(MOTOR_PWM_BANK, numr, 10);
+#else
     MOTOR_PWM0->numr = 0x1F;
     MOTOR_PWM0->denom = 0xFF;
     MOTOR_PWM0->conf = 0x3;
@@ -41,6 +50,7 @@ void main() {
     MOTOR_PWM9->numr = 0x7F;
     MOTOR_PWM9->denom = 0xFF;
     MOTOR_PWM9->conf = 0x3;
+#endif
 
     /*
     PDM0->outval = 0xFF;
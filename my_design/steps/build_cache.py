@@ -0,0 +1,100 @@
+"""Content-hash cache for build steps whose inputs are Python sources rather than files on disk.
+
+Elaborating the design is only needed when its sources or the libraries it is built from change.
+A `BuildCache` stores a hash of those inputs, plus hashes of the files the step produced, in a
+manifest in the build directory. When the inputs hash the same and the outputs are still intact,
+the step can be skipped. Outputs are written with `write_if_changed` so that an elaboration that
+produces identical files does not touch their mtimes and the downstream doit tasks stay up to date.
+"""
+import hashlib
+import importlib.metadata
+import json
+import os
+import sys
+from pathlib import Path
+
+
+__all__ = ["BuildCache", "write_if_changed"]
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def write_if_changed(path, content):
+    """Write `content` to `path` unless the file already holds exactly that. Returns whether the
+    file was written."""
+    path = Path(path)
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(data)
+    return True
+
+
+def _distribution_fingerprint(name):
+    try:
+        dist = importlib.metadata.distribution(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    fingerprint = dist.version
+    # Git and editable installs often keep the same version across commits; the commit recorded
+    # by the installer (or the local path, for editable installs) tells them apart.
+    direct_url = dist.read_text("direct_url.json")
+    if direct_url:
+        fingerprint += " " + direct_url
+    return fingerprint
+
+
+class BuildCache:
+    """Manifest of the inputs and outputs of the last build, stored as JSON in `manifest_path`."""
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        try:
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+
+    @staticmethod
+    def compute_key(source_files=(), distributions=(), extra=()):
+        """Hash `source_files`, the installed versions of `distributions` and any `extra` strings
+        into a single key."""
+        digest = hashlib.sha256()
+        digest.update(f"python {sys.version_info[0]}.{sys.version_info[1]}\n".encode())
+        for path in map(Path, source_files):
+            digest.update(f"file {path.name} {_hash_file(path)}\n".encode())
+        for name in distributions:
+            digest.update(f"dist {name} {_distribution_fingerprint(name)}\n".encode())
+        for item in extra:
+            digest.update(f"extra {item}\n".encode())
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """Return the manifest entry if the last build used `key` and its outputs are unmodified."""
+        if self.manifest.get("key") != key:
+            return None
+        for path, expected in self.manifest.get("outputs", {}).items():
+            if _hash_file(self.manifest_path.parent / path) != expected:
+                return None
+        return self.manifest
+
+    def store(self, key, outputs, **info):
+        """Record a build of `key` that produced `outputs` (paths relative to the manifest)."""
+        self.manifest = dict(info, key=key, outputs={
+            str(path): _hash_file(self.manifest_path.parent / path) for path in outputs
+        })
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -4,13 +4,42 @@ from amaranth import *
 from amaranth.lib import wiring
 from amaranth.lib.wiring import connect, flipped
 from amaranth.back import rtlil
+from doit.cmd_base import ModuleTaskLoader
+from doit.doit_cmd import DoitMain
 
 from ..design import MySoC
 from ..sim import doit_build
+from .build_cache import BuildCache, write_if_changed
 
 import os
+import subprocess
+import sys
+import time
 from pathlib import Path
 
+
+# Installed packages whose code ends up in the elaborated design.
+DESIGN_DISTRIBUTIONS = [
+    "amaranth",
+    "amaranth-soc",
+    "amaranth-orchard",
+    "amaranth-cv32e40p",
+    "chipflow-lib",
+]
+
+
+def loaded_design_sources():
+    """The files of the modules of this package loaded so far. Once the SoC is built, these are the
+    sources that elaboration reads; benches, tests, tools and reference models are not loaded."""
+    package_dir = Path(__file__).parent.parent.resolve()
+    sources = set()
+    for module in list(sys.modules.values()):
+        filename = getattr(module, "__file__", None)
+        if filename is not None and Path(filename).resolve().is_relative_to(package_dir):
+            sources.add(Path(filename).resolve())
+    return sorted(sources)
+
+
 class SimPlatform:
 
     def __init__(self):
@@ -23,27 +52,33 @@ class SimPlatform:
         self.extra_files[filename] = content
 
     def build(self, e):
+        """Elaborate `e` and write the RTLIL and Yosys script for the CXXRTL build.
+
+        Files whose content is unchanged are left untouched, so that doit does not rerun Yosys and
+        the compiler. Returns the names of the written files (relative to the build directory) and
+        whether any of them changed.
+        """
         Path(self.build_dir).mkdir(parents=True, exist_ok=True)
 
         output = rtlil.convert(e, name="sim_top", ports=None, platform=self)
 
-        top_rtlil = Path(self.build_dir) / "sim_soc.il"
-        with open(top_rtlil, "w") as rtlil_file:
-            rtlil_file.write(output)
-        top_ys = Path(self.build_dir) / "sim_soc.ys"
-        with open(top_ys, "w") as yosys_file:
-            for extra_filename, extra_content in self.extra_files.items():
-                extra_path = Path(self.build_dir) / extra_filename
-                with open(extra_path, "w") as extra_file:
-                    extra_file.write(extra_content)
-                if extra_filename.endswith(".il"):
-                    print(f"read_rtlil {extra_path}", file=yosys_file)
-                else:
-                    # FIXME: use -defer (workaround for YosysHQ/yosys#4059)
-                    print(f"read_verilog {extra_path}", file=yosys_file)
-            print("read_rtlil sim_soc.il", file=yosys_file)
-            print("hierarchy -top sim_top", file=yosys_file)
-            print("write_cxxrtl -header sim_soc.cc", file=yosys_file)
+        changed = write_if_changed(Path(self.build_dir) / "sim_soc.il", output)
+        yosys_script = []
+        for extra_filename, extra_content in self.extra_files.items():
+            extra_path = Path(self.build_dir) / extra_filename
+            changed |= write_if_changed(extra_path, extra_content)
+            if extra_filename.endswith(".il"):
+                yosys_script.append(f"read_rtlil {extra_path}")
+            else:
+                # FIXME: use -defer (workaround for YosysHQ/yosys#4059)
+                yosys_script.append(f"read_verilog {extra_path}")
+        yosys_script.append("read_rtlil sim_soc.il")
+        yosys_script.append("hierarchy -top sim_top")
+        yosys_script.append("write_cxxrtl -header sim_soc.cc")
+        changed |= write_if_changed(Path(self.build_dir) / "sim_soc.ys",
+                                    "".join(f"{line}\n" for line in yosys_script))
+
+        return ["sim_soc.il", "sim_soc.ys", *self.extra_files], changed
 
 
 class MySimStep(SimStep):
@@ -54,8 +89,86 @@ class MySimStep(SimStep):
 
         super().__init__(config, platform)
 
-    def build(self):
-        my_design = MySoC()
+    def build_cli_parser(self, parser):
+        parser.add_argument("--rebuild", action="store_true",
+            help="elaborate the design even if its sources are unchanged")
+        parser.add_argument("--lib", action="store_true",
+            help="also build the simulation as a shared library for my_design.sim.sim_lib")
+        parser.add_argument("--run", action="store_true",
+            help="run the simulation after building it")
+        parser.add_argument("--cycles", type=int, default=None, metavar="N",
+            help="stop after N clock cycles")
+        parser.add_argument("--idle-cycles", type=int, default=None, metavar="N",
+            help="stop once all input commands are consumed and no event has been logged for N cycles")
+        parser.add_argument("--stop-on-event", action="append", default=[],
+            metavar="PERIPHERAL:EVENT[:PAYLOAD]",
+            help="stop once a matching event is logged (may be repeated)")
+        parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+            help="stop after this much wall-clock time")
+
+    def run_cli(self, args):
+        self.build(rebuild=args.rebuild, lib=args.lib)
+        if args.run:
+            self.run(cycles=args.cycles, idle_cycles=args.idle_cycles,
+                     stop_on_event=args.stop_on_event, timeout=args.timeout)
 
-        self.platform.build(my_design)
+    def build(self, *, rebuild=False, lib=False):
+        """Build the simulation, skipping elaboration if the design sources, the libraries it is
+        built from and the project configuration are unchanged since the last build.
+
+        With `lib`, the shared library used by `my_design.sim.sim_lib` is built as well.
+        """
+        cache = BuildCache(Path(self.platform.build_dir) / "sim_cache.json")
+        # building the SoC imports every module of the design, elaborating it is what takes time
+        design = MySoC()
+        key = BuildCache.compute_key(
+            source_files=[*loaded_design_sources(), Path(os.environ['CHIPFLOW_ROOT']) / "chipflow.toml"],
+            distributions=DESIGN_DISTRIBUTIONS)
+        entry = None if rebuild else cache.lookup(key)
+
+        if entry is not None:
+            elaborate_time = entry["elaborate_time"]
+            print(f"sim: cache hit ({key[:12]}), skipping elaboration (saves ~{elaborate_time:.1f} s); "
+                  f"doit rebuilds only the simulator sources that changed")
+            self._build_binaries(lib)
+            return
+
+        start = time.perf_counter()
+        outputs, changed = self.platform.build(design)
+        elaborate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self._build_binaries(lib)
+        build_time = time.perf_counter() - start
+
+        if changed or not cache.manifest:
+            compile_time = build_time
+            print(f"sim: cache miss ({key[:12]}), elaborated in {elaborate_time:.1f} s, "
+                  f"built in {build_time:.1f} s")
+        else:
+            compile_time = cache.manifest.get("compile_time", build_time)
+            print(f"sim: cache miss ({key[:12]}), elaborated in {elaborate_time:.1f} s; design "
+                  f"unchanged, so doit rebuilds only the simulator sources that changed")
+        cache.store(key, outputs, elaborate_time=elaborate_time, compile_time=compile_time)
+
+    def _build_binaries(self, lib):
         self.doit_build()
+        if lib:
+            DoitMain(ModuleTaskLoader(self.doit_build_module)).run(["build_sim_lib"])
+
+    def run(self, *, cycles=None, idle_cycles=None, stop_on_event=(), timeout=None):
+        """Run the simulation in the build directory until one of the stop conditions is met.
+
+        The simulation reports which condition stopped it on stderr.
+        """
+        exe = ".exe" if os.name == "nt" else ""
+        command = [os.path.join(self.platform.build_dir, f"sim_soc{exe}")]
+        if cycles is not None:
+            command += ["--cycles", str(cycles)]
+        if idle_cycles is not None:
+            command += ["--idle-cycles", str(idle_cycles)]
+        for event in stop_on_event:
+            command += ["--stop-on-event", event]
+        if timeout is not None:
+            command += ["--timeout", str(timeout)]
+        subprocess.run(command, cwd=self.platform.build_dir, check=True)
@@ -0,0 +1,70 @@
+"""Measure CSR access latency from firmware, with the 8-bit and 32-bit CSR data paths of `MySoC`.
+
+    doit -f my_design/software/doit_build.py build_csr_bench
+    python -m my_design.tools.bench_csr --sim 8=build/sim/sim_soc --sim 32=build-csr32/sim/sim_soc
+
+Runs the `csr_bench.bin` firmware on each simulation, built with `MySoC.csr_data_width` set to its
+label, and reports the CPU cycles per access that the firmware measured with `mcycle`: loads and
+stores of a word in SRAM, of a project IP register and of the SoC ID, which stays on the 8-bit CSR
+bus. The generated `soc.h` is the same in both modes, so one firmware image serves both builds.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+
+_RESULT = re.compile(r"^([a-z_ ]+): ([0-9a-fA-F]{8})\r?$", re.MULTILINE)
+
+# accesses per measurement, ACCESSES in csr_bench.c
+ACCESSES = 256
+
+
+def run(sim, firmware, cycles, work_dir):
+    """Run `firmware` on `sim` until it prints EOT; returns the cycle count of each measurement."""
+    input_commands = os.path.join(work_dir, "input.json")
+    with open(input_commands, "w") as f:
+        json.dump({"commands": []}, f)
+    process = subprocess.run([os.path.abspath(sim), "--firmware", os.path.abspath(firmware),
+                              "--input", input_commands, "--events", os.path.join(work_dir, "events.json"),
+                              "--cycles", str(cycles), "--stop-on-event", "uart_0:tx:4"],
+                             cwd=work_dir, check=True, capture_output=True, text=True, errors="replace")
+    results = {name: int(count, 16) for name, count in _RESULT.findall(process.stderr)}
+    if not results:
+        raise RuntimeError(f"{sim} printed no measurements; is {firmware} the CSR benchmark?")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sim", action="append", default=[], metavar="LABEL=PATH",
+        help="simulation to run, labelled with its CSR data width (may be repeated; "
+             "default: 8=build/sim/sim_soc)")
+    parser.add_argument("--firmware", default="build/software/csr_bench.bin")
+    parser.add_argument("--cycles", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    sims = [sim.partition("=")[::2] for sim in args.sim or ["8=build/sim/sim_soc"]]
+    results = {}
+    for label, sim in sims:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[label] = run(sim, args.firmware, args.cycles, work_dir)
+
+    names = list(next(iter(results.values())))
+    print(f"{'cycles per access':20}" + "".join(f"{label + '-bit':>10}" for label, _ in sims))
+    for name in names:
+        print(f"{name:20}" + "".join(f"{results[label].get(name, 0) / ACCESSES:10.1f}" for label, _ in sims))
+    # the loop and instruction fetches cost the same whatever the register
+    for name in names:
+        if name.startswith("sram"):
+            continue
+        baseline = f"sram {name.split()[-1]}"
+        print(f"{name + ' over sram':20}" +
+              "".join(f"{(results[label].get(name, 0) - results[label].get(baseline, 0)) / ACCESSES:10.1f}"
+                      for label, _ in sims))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark the streaming event log comparator against the original `json.load` based one.
+
+    python -m my_design.tools.bench_json_compare [--events 10000000] [--dir build/bench]
+
+Both comparators are run in a fresh interpreter so that their peak RSS can be measured separately.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from . import json_compare
+
+
+def generate_log(filename, count, seed=0):
+    rng = random.Random(seed)
+    peripherals = ["uart_0", "uart_1", "gpio_0", "gpio_1", "spi_0", "i2c_0"]
+    timestamp = 0
+    with open(filename, "w") as f:
+        f.write("{\n\"events\": [\n")
+        for i in range(count):
+            timestamp += rng.randrange(2, 10000)
+            peripheral = rng.choice(peripherals)
+            if peripheral.startswith("gpio"):
+                payload = "\"" + "".join(rng.choice("01Z") for _ in range(8)) + "\""
+            else:
+                payload = str(rng.randrange(256))
+            if i:
+                f.write(",\n")
+            f.write(f"{{ \"timestamp\": {timestamp}, \"peripheral\": \"{peripheral}\", "
+                    f"\"event\": \"tx\", \"payload\": {payload} }}")
+        f.write("\n]\n}\n")
+
+
+def compare_legacy(reference, test):
+    with open(reference, "r") as f:
+        gold = json.load(f)
+    with open(test, "r") as f:
+        gate = json.load(f)
+    assert len(gold["events"]) == len(gate["events"])
+    for ev_gold, ev_gate in zip(gold["events"], gate["events"]):
+        assert ev_gold["peripheral"] == ev_gate["peripheral"] and ev_gold["event"] == ev_gate["event"] \
+            and ev_gold["payload"] == ev_gate["payload"]
+
+
+def compare_streaming(reference, test):
+    _, divergence = json_compare.compare_files(reference, test)
+    assert divergence is None
+
+
+def run_child(mode, reference, test):
+    start = time.perf_counter()
+    {"legacy": compare_legacy, "streaming": compare_streaming}[mode](reference, test)
+    elapsed = time.perf_counter() - start
+    max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"elapsed": elapsed, "max_rss_kib": max_rss_kib}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--dir", default="build/bench")
+    parser.add_argument("--child", choices=("legacy", "streaming"), help=argparse.SUPPRESS)
+    parser.add_argument("files", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, *args.files)
+        return
+
+    Path(args.dir).mkdir(parents=True, exist_ok=True)
+    reference = os.path.join(args.dir, f"events_{args.events}_ref.json")
+    test = os.path.join(args.dir, f"events_{args.events}_test.json")
+    if not os.path.exists(reference):
+        print(f"generating {args.events} events...")
+        generate_log(reference, args.events)
+    if not os.path.exists(test):
+        generate_log(test, args.events)
+    print(f"log size: {os.path.getsize(reference) / 2**20:.1f} MiB")
+
+    for mode in ("legacy", "streaming"):
+        child = subprocess.run(
+            [sys.executable, "-m", "my_design.tools.bench_json_compare", "--child", mode, reference, test],
+            capture_output=True, text=True)
+        if child.returncode != 0:
+            # most likely killed for running out of memory
+            print(f"{mode:>10}: failed with exit code {child.returncode}")
+            continue
+        result = json.loads(child.stdout)
+        print(f"{mode:>10}: {result['elapsed']:8.2f} s, peak RSS {result['max_rss_kib'] / 1024:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Measure simulation speed with activity-based model scheduling against stepping every model.
+
+    python -m my_design.tools.bench_sim [--cycles 2000000] [--repeat 3]
+
+Runs `sim_soc` with and without `--step-all` and reports the cycles per second printed when the
+simulation stops. The event logs of both runs are compared, since skipping idle models must not
+change what the simulation does.
+"""
+import argparse
+import os
+import re
+import subprocess
+import tempfile
+
+from . import json_compare
+
+
+_STOPPED = re.compile(r"sim: stopped \((.*?)\) after (\d+) cycles in ([\d.]+) s \(([\d.]+) cycles/s\)")
+
+
+def run(sim, firmware, input_commands, cycles, events, extra_args=()):
+    process = subprocess.run([os.path.abspath(sim), "--firmware", os.path.abspath(firmware),
+                              "--input", os.path.abspath(input_commands), "--events", events,
+                              "--cycles", str(cycles), *extra_args],
+                             cwd=os.path.dirname(events), check=True, capture_output=True, text=True)
+    match = _STOPPED.search(process.stderr)
+    if match is None:
+        raise RuntimeError("simulation did not report its speed")
+    return float(match.group(4))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sim", default="build/sim/sim_soc" + (".exe" if os.name == "nt" else ""))
+    parser.add_argument("--firmware", default="build/software/software.bin")
+    parser.add_argument("--input", default="my_design/tests/input.json")
+    parser.add_argument("--cycles", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = {}
+        for mode, extra_args in (("step all", ["--step-all"]), ("scheduled", [])):
+            events = os.path.join(work_dir, f"events_{len(results)}.json")
+            results[mode] = max(run(args.sim, args.firmware, args.input, args.cycles, events, extra_args)
+                                for _ in range(args.repeat))
+            print(f"{mode:>10}: {results[mode]:12.0f} cycles/s")
+
+        _, divergence = json_compare.compare_files(os.path.join(work_dir, "events_0.json"),
+                                                   os.path.join(work_dir, "events_1.json"),
+                                                   time_tolerance=0)
+    if divergence is not None:
+        print("event logs differ between the two modes:")
+        json_compare.report_divergence(divergence)
+        raise SystemExit(1)
+    print(f"speedup: {results['scheduled'] / results['step all']:.2f}x, event logs identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark driving the simulation in-process through `SimLib` against running `sim_soc`.
+
+    python -m my_design.tools.bench_sim_lib [--cycles 100000] [--repeat 5]
+
+Build both first with `chipflow sim --lib`. The subprocess flow is timed end to end: starting
+`sim_soc`, simulating, and reading back `events.json`. The in-process flow is timed for the same
+run, and the fixed cost of a single `SimLib.step()` call is measured by stepping one cycle at a
+time.
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from ..sim.sim_lib import SimLib, default_library_path
+from . import json_compare
+
+
+def run_subprocess(sim, firmware, input_commands, cycles, work_dir):
+    events = os.path.join(work_dir, "events.json")
+    subprocess.run([os.path.abspath(sim), "--firmware", os.path.abspath(firmware),
+                    "--input", os.path.abspath(input_commands), "--events", events,
+                    "--cycles", str(cycles)],
+                   cwd=work_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(events, "r") as f:
+        return list(json_compare.iter_events(f))
+
+
+def run_in_process(library, firmware, input_commands, cycles):
+    with SimLib(firmware, input_commands=input_commands, library=library) as sim:
+        sim.step(cycles)
+        return sim.pop_events()
+
+
+def measure_call_overhead(library, firmware, calls):
+    with SimLib(firmware, library=library) as sim:
+        start = time.perf_counter()
+        for _ in range(calls):
+            sim.step(1)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sim.step(calls)
+        batched = time.perf_counter() - start
+    return single, batched
+
+
+def best_of(repeat, function, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sim", default="build/sim/sim_soc" + (".exe" if os.name == "nt" else ""))
+    parser.add_argument("--lib", default=default_library_path())
+    parser.add_argument("--firmware", default="build/software/software.bin")
+    parser.add_argument("--input", default="my_design/tests/input.json")
+    parser.add_argument("--cycles", type=int, default=100_000)
+    parser.add_argument("--calls", type=int, default=10_000,
+        help="number of single-cycle steps used to measure the per-call overhead")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess_time, subprocess_events = best_of(
+            args.repeat, run_subprocess, args.sim, args.firmware, args.input, args.cycles, work_dir)
+    in_process_time, in_process_events = best_of(
+        args.repeat, run_in_process, args.lib, args.firmware, args.input, args.cycles)
+
+    _, divergence = json_compare.compare_events(subprocess_events, in_process_events)
+    if divergence is not None:
+        print("warning: in-process and subprocess event logs differ:")
+        json_compare.report_divergence(divergence)
+
+    print(f"{args.cycles} cycles, {len(in_process_events)} events (best of {args.repeat}):")
+    print(f"  subprocess: {subprocess_time * 1e3:10.1f} ms")
+    print(f"  in-process: {in_process_time * 1e3:10.1f} ms")
+
+    single, batched = measure_call_overhead(args.lib, args.firmware, args.calls)
+    print(f"{args.calls} cycles stepped one at a time: {single * 1e3:.1f} ms, "
+          f"in one call: {batched * 1e3:.1f} ms "
+          f"({(single - batched) / args.calls * 1e6:.2f} us overhead per call)")
+
+
+if __name__ == "__main__":
+    main()
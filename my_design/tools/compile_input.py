@@ -0,0 +1,207 @@
+"""Validate input commands and compile them into the binary command table executed by the simulation.
+
+`input.json` is checked ahead of time against the peripherals that `MySoC` instantiates and the
+actions and events their simulation models support, so that a typo is reported here rather than
+as a wait that never completes. The compiled table uses the name table and payload heap layout of
+the binary event log (see `event_log`). Layout (all integers little-endian):
+
+* header (40 bytes): magic `CFINCMD\\0`, version (u32), record size (u32), command count (u64),
+  name table offset (u64), payload heap offset (u64);
+* commands (16 bytes each, see `COMMAND_DTYPE`);
+* name table and payload heap, as in the binary event log.
+
+The simulation accepts either format for `--input`; it tells them apart by the magic.
+
+    python -m my_design.tools.compile_input my_design/tests/input.json build/sim/input.cmds
+    python -m my_design.tools.compile_input my_design/tests/input.json     # validate only
+"""
+import argparse
+import json
+import re
+import sys
+
+import numpy as np
+
+from .event_log import HEADER, RecordEncoder, decode_payload, read_heap_item, read_names
+
+
+__all__ = ["COMMAND_DTYPE", "design_peripherals", "validate_commands", "write_command_table",
+           "read_command_table"]
+
+
+MAGIC   = b"CFINCMD\0"
+VERSION = 1
+
+COMMAND_DTYPE = np.dtype([
+    ("type",         "u1"),
+    ("payload_kind", "u1"),
+    ("peripheral",   "<u2"),
+    ("event",        "<u2"),
+    ("reserved",     "V2"),
+    ("payload",      "<u8"),
+])
+assert COMMAND_DTYPE.itemsize == 16
+
+COMMAND_ACTION = 0
+COMMAND_WAIT   = 1
+
+COMMAND_TYPES = {"action": COMMAND_ACTION, "wait": COMMAND_WAIT}
+
+
+def _uint(bits):
+    def check(payload):
+        if not isinstance(payload, int) or isinstance(payload, bool) or not 0 <= payload < (1 << bits):
+            return f"expected an integer in [0, {(1 << bits) - 1}]"
+    return check
+
+
+def _bit_string(width, alphabet):
+    pattern = re.compile(f"[{alphabet}]{{{width}}}")
+    def check(payload):
+        if not isinstance(payload, str) or not pattern.fullmatch(payload):
+            return f"expected a string of {width} characters from '{alphabet}'"
+    return check
+
+
+def _empty(payload):
+    if payload != "":
+        return "expected an empty string"
+
+
+def _any(payload):
+    return None
+
+
+def _model_commands(kind, gpio_width=8):
+    """Actions and waitable events of each simulation model (see my_design/sim/models.cc), with a
+    payload check for each."""
+    if kind == "uart":
+        return {"action": {"tx": _uint(8)},
+                "wait":   {"tx": _uint(8)}}
+    if kind == "gpio":
+        return {"action": {"set": _bit_string(gpio_width, "01")},
+                "wait":   {"change": _bit_string(gpio_width, "01Z")}}
+    if kind == "spi":
+        return {"action": {"set_data": _uint(32), "set_width": _uint(6)},
+                "wait":   {"select": _empty, "deselect": _empty, "data": _uint(32)}}
+    if kind == "i2c":
+        return {"action": {"ack": _any, "nack": _any, "set_data": _uint(8)},
+                "wait":   {"start": _empty, "stop": _empty, "address": _uint(8), "write": _uint(8)}}
+    if kind == "flash":
+        return {"action": {}, "wait": {}}
+    raise ValueError(f"unknown model kind {kind}")
+
+
+def design_peripherals(soc=None):
+    """Map the name of every peripheral model in the simulation of `soc` (by default a fresh
+    `MySoC`) to the commands it accepts."""
+    if soc is None:
+        # imported here so that the format can be read without the design's dependencies
+        from ..design import MySoC
+        soc = MySoC()
+    peripherals = {"flash": _model_commands("flash")}
+    for i in range(soc.uart_count):
+        peripherals[f"uart_{i}"] = _model_commands("uart")
+    for i in range(soc.gpio_banks):
+        peripherals[f"gpio_{i}"] = _model_commands("gpio", soc.gpio_width)
+    for i in range(soc.user_spi_count):
+        peripherals[f"spi_{i}"] = _model_commands("spi")
+    for i in range(soc.i2c_count):
+        peripherals[f"i2c_{i}"] = _model_commands("i2c")
+    return peripherals
+
+
+def validate_commands(commands, peripherals):
+    """Return a list of error messages, one per invalid command."""
+    errors = []
+    for index, command in enumerate(commands):
+        def error(message):
+            errors.append(f"command {index} ({json.dumps(command)}): {message}")
+
+        if not isinstance(command, dict):
+            error("expected an object")
+            continue
+        missing = {"type", "peripheral", "event", "payload"} - command.keys()
+        if missing:
+            error(f"missing {', '.join(sorted(missing))}")
+            continue
+        if command["type"] not in COMMAND_TYPES:
+            error(f"unknown type {command['type']!r}, expected 'action' or 'wait'")
+            continue
+        if command["peripheral"] not in peripherals:
+            error(f"no peripheral named {command['peripheral']!r} in the design "
+                  f"(have {', '.join(peripherals)})")
+            continue
+        events = peripherals[command["peripheral"]][command["type"]]
+        if command["event"] not in events:
+            error(f"{command['peripheral']} has no {command['type']} {command['event']!r} "
+                  f"(have {', '.join(events) or 'none'})")
+            continue
+        message = events[command["event"]](command["payload"])
+        if message:
+            error(f"invalid payload: {message}")
+    return errors
+
+
+def write_command_table(filename, commands):
+    """Write validated commands as a binary command table."""
+    encoder = RecordEncoder()
+    records = np.zeros(len(commands), dtype=COMMAND_DTYPE)
+    for index, command in enumerate(commands):
+        kind, value = encoder.payload(command["payload"])
+        records[index] = (COMMAND_TYPES[command["type"]], kind, encoder.name_id(command["peripheral"]),
+                          encoder.name_id(command["event"]), b"", value)
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, COMMAND_DTYPE.itemsize, 0, 0, 0))
+        f.write(records.tobytes())
+        names_offset, heap_offset = encoder.write_tables(f)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, COMMAND_DTYPE.itemsize, len(records), names_offset, heap_offset))
+    return len(records)
+
+
+def read_command_table(filename):
+    """Read a binary command table back into a list of commands in the `input.json` schema."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    magic, version, record_size, count, names_offset, heap_offset = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{filename}: not a binary command table")
+    if version != VERSION or record_size != COMMAND_DTYPE.itemsize:
+        raise ValueError(f"{filename}: unsupported command table version {version} "
+                         f"(record size {record_size})")
+    records = np.frombuffer(data, dtype=COMMAND_DTYPE, count=count, offset=HEADER.size)
+    names = read_names(data, names_offset)
+    heap = data[heap_offset:]
+    types = {value: name for name, value in COMMAND_TYPES.items()}
+    return [{
+        "type": types[record["type"]],
+        "peripheral": names[record["peripheral"]],
+        "event": names[record["event"]],
+        "payload": decode_payload(int(record["payload_kind"]), int(record["payload"]),
+                                  lambda offset: read_heap_item(heap, offset)),
+    } for record in records]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="input commands in JSON")
+    parser.add_argument("output", nargs="?", help="binary command table to write")
+    args = parser.parse_args()
+
+    with open(args.input, "r") as f:
+        commands = json.load(f)["commands"]
+    errors = validate_commands(commands, design_peripherals())
+    if errors:
+        for error in errors:
+            print(f"{args.input}: {error}", file=sys.stderr)
+        sys.exit(1)
+    if args.output:
+        count = write_command_table(args.output, commands)
+        print(f"Compiled {count} commands")
+    else:
+        print(f"{len(commands)} commands are valid")
+
+
+if __name__ == "__main__":
+    main()
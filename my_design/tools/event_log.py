@@ -0,0 +1,286 @@
+"""Reader and writer for the binary event log format written by the simulation models.
+
+A log whose filename ends in `.evlog` is written in this format instead of JSON. Layout (all
+integers little-endian):
+
+* header (40 bytes): magic `CFEVLOG\\0`, version (u32), record size (u32), record count (u64),
+  name table offset (u64), payload heap offset (u64);
+* records (24 bytes each, see `RECORD_DTYPE`), appended while the simulation runs;
+* name table: count (u32), then for each name its length (u32) and UTF-8 bytes. Record
+  `peripheral` and `event` fields index into it;
+* payload heap: length-prefixed (u32) UTF-8 blobs. String payloads and serialised JSON payloads
+  are stored here once and referenced by offset.
+
+The name table and heap are written when the log is closed; a log left behind by a crashed
+simulation has a zero record count and cannot be read.
+
+    python -m my_design.tools.event_log to-json build/sim/events.evlog events.json
+    python -m my_design.tools.event_log from-json events.json events.evlog
+"""
+import argparse
+import json
+import struct
+
+import numpy as np
+
+from . import json_compare
+
+
+__all__ = ["RECORD_DTYPE", "EventLog", "RecordEncoder", "decode_payload", "is_event_log",
+           "write_event_log", "to_json", "from_json"]
+
+
+MAGIC   = b"CFEVLOG\0"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIQQQ")
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp",    "<u8"),
+    ("peripheral",   "<u2"),
+    ("event",        "<u2"),
+    ("payload_kind", "u1"),
+    ("reserved",     "V3"),
+    ("payload",      "<u8"),
+])
+assert RECORD_DTYPE.itemsize == 24
+
+PAYLOAD_UINT   = 0
+PAYLOAD_INT    = 1
+PAYLOAD_STRING = 2
+PAYLOAD_JSON   = 3
+
+_U32 = struct.Struct("<I")
+
+
+def decode_payload(kind, value, heap_item):
+    """Decode a record payload; `heap_item(offset)` returns the heap string at `offset`."""
+    if kind == PAYLOAD_UINT:
+        return value
+    if kind == PAYLOAD_INT:
+        return value - (1 << 64) if value >= (1 << 63) else value
+    if kind == PAYLOAD_STRING:
+        return heap_item(value)
+    if kind == PAYLOAD_JSON:
+        return json.loads(heap_item(value))
+    raise ValueError(f"unknown payload kind {kind}")
+
+
+def is_event_log(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class EventLog:
+    """A memory-mapped binary event log.
+
+    `records` is a NumPy structured array of `RECORD_DTYPE` backed by the file, so selecting and
+    reducing over millions of events does not read them into Python objects::
+
+        log = EventLog("build/sim/events.evlog")
+        uart_0 = log.records[log.records["peripheral"] == log.name_id("uart_0")]
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{filename}: truncated event log header")
+        magic, version, record_size, record_count, names_offset, heap_offset = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{filename}: not a binary event log")
+        if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{filename}: unsupported event log version {version} "
+                             f"(record size {record_size})")
+        if names_offset == 0:
+            raise ValueError(f"{filename}: event log was not closed")
+
+        self._data = np.memmap(filename, dtype=np.uint8, mode="r")
+        self.records = self._data[HEADER.size:names_offset].view(RECORD_DTYPE)
+        assert len(self.records) == record_count
+
+        self.names = read_names(self._data, names_offset)
+        self._name_ids = {name: index for index, name in enumerate(self.names)}
+
+        self._heap = self._data[heap_offset:]
+        self._heap_cache = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def name_id(self, name):
+        """ID of a peripheral or event name, or -1 if it never occurs in the log."""
+        return self._name_ids.get(name, -1)
+
+    def _heap_item(self, offset):
+        try:
+            return self._heap_cache[offset]
+        except KeyError:
+            item = read_heap_item(self._heap, offset)
+            self._heap_cache[offset] = item
+            return item
+
+    def payload(self, kind, value):
+        return decode_payload(kind, value, self._heap_item)
+
+    def events(self, start=0, stop=None, *, batch=65536):
+        """Iterate over events as dicts in the JSON event log schema."""
+        stop = len(self.records) if stop is None else stop
+        names = self.names
+        for batch_start in range(start, stop, batch):
+            chunk = self.records[batch_start:min(stop, batch_start + batch)]
+            for timestamp, peripheral, event, kind, payload in zip(
+                    chunk["timestamp"].tolist(), chunk["peripheral"].tolist(), chunk["event"].tolist(),
+                    chunk["payload_kind"].tolist(), chunk["payload"].tolist()):
+                yield {
+                    "timestamp": timestamp,
+                    "peripheral": names[peripheral],
+                    "event": names[event],
+                    "payload": self.payload(kind, payload),
+                }
+
+    __iter__ = events
+
+
+class RecordEncoder:
+    """Interns names and payloads into the name table and heap shared by the binary formats."""
+    def __init__(self):
+        self.names = []
+        self.heap = bytearray()
+        self._name_ids = {}
+        self._heap_offsets = {}
+
+    def name_id(self, name):
+        if name not in self._name_ids:
+            if len(self.names) > 0xffff:
+                raise ValueError("too many distinct peripheral and event names")
+            self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self._name_ids[name]
+
+    def _heap_offset(self, data):
+        if data not in self._heap_offsets:
+            self._heap_offsets[data] = len(self.heap)
+            encoded = data.encode()
+            self.heap.extend(_U32.pack(len(encoded)))
+            self.heap.extend(encoded)
+        return self._heap_offsets[data]
+
+    def payload(self, payload):
+        """Encode a payload as a `(payload_kind, payload)` pair."""
+        if isinstance(payload, int) and not isinstance(payload, bool):
+            if payload >= 0:
+                return PAYLOAD_UINT, payload
+            return PAYLOAD_INT, payload + (1 << 64)
+        if isinstance(payload, str):
+            return PAYLOAD_STRING, self._heap_offset(payload)
+        return PAYLOAD_JSON, self._heap_offset(json.dumps(payload, separators=(",", ":")))
+
+    def write_tables(self, f):
+        """Write the name table and the heap; returns their offsets in `f`."""
+        names_offset = f.tell()
+        f.write(_U32.pack(len(self.names)))
+        for name in self.names:
+            encoded = name.encode()
+            f.write(_U32.pack(len(encoded)))
+            f.write(encoded)
+        heap_offset = f.tell()
+        f.write(self.heap)
+        return names_offset, heap_offset
+
+
+def read_names(data, offset):
+    """Read the name table at `offset` in a byte buffer."""
+    names = []
+    (count,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    for _ in range(count):
+        (size,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        names.append(bytes(data[offset:offset + size]).decode())
+        offset += size
+    return names
+
+
+def read_heap_item(heap, offset):
+    (size,) = _U32.unpack_from(heap, offset)
+    start = offset + _U32.size
+    return bytes(heap[start:start + size]).decode()
+
+
+def write_event_log(filename, events, *, batch=65536):
+    """Write an iterable of JSON schema event dicts as a binary event log."""
+    encoder = RecordEncoder()
+
+    def encode(event):
+        kind, value = encoder.payload(event["payload"])
+        return (event["timestamp"], encoder.name_id(event["peripheral"]), encoder.name_id(event["event"]),
+                kind, b"", value)
+
+    count = 0
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, 0, 0, 0))
+        records = []
+        for event in events:
+            records.append(encode(event))
+            if len(records) == batch:
+                f.write(np.array(records, dtype=RECORD_DTYPE).tobytes())
+                count += len(records)
+                records.clear()
+        f.write(np.array(records, dtype=RECORD_DTYPE).tobytes())
+        count += len(records)
+
+        names_offset, heap_offset = encoder.write_tables(f)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, count, names_offset, heap_offset))
+    return count
+
+
+def to_json(log_filename, json_filename):
+    """Convert a binary event log into the JSON event log format written by the simulation."""
+    log = EventLog(log_filename)
+    with open(json_filename, "w") as f:
+        f.write("{\n\"events\": [\n")
+        for index, event in enumerate(log.events()):
+            if index:
+                f.write(",\n")
+            f.write(f"{{ \"timestamp\": {event['timestamp']}, \"peripheral\": \"{event['peripheral']}\", "
+                    f"\"event\": \"{event['event']}\", "
+                    f"\"payload\": {json.dumps(event['payload'], separators=(',', ':'))} }}")
+        f.write("\n]\n}\n")
+    return len(log)
+
+
+def from_json(json_filename, log_filename):
+    """Convert a JSON event log into a binary event log."""
+    with open(json_filename, "r") as f:
+        return write_event_log(log_filename, json_compare.iter_events(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between JSON and binary event logs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("to-json", "from-json"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("input")
+        subparser.add_argument("output")
+    info_parser = subparsers.add_parser("info")
+    info_parser.add_argument("input")
+    args = parser.parse_args()
+
+    if args.command == "to-json":
+        count = to_json(args.input, args.output)
+        print(f"Converted {count} events")
+    elif args.command == "from-json":
+        count = from_json(args.input, args.output)
+        print(f"Converted {count} events")
+    elif args.command == "info":
+        log = EventLog(args.input)
+        print(f"{len(log)} events")
+        for peripheral in np.unique(log.records["peripheral"]):
+            selected = log.records[log.records["peripheral"] == peripheral]
+            print(f"  {log.names[peripheral]:<16} {len(selected):>12} events")
+
+
+if __name__ == "__main__":
+    main()
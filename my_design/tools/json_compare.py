@@ -1,17 +1,197 @@
+import argparse
+import collections
+import contextlib
+import itertools
 import json
+import re
 import sys
 
+
+EVENT_FIELDS = ("peripheral", "event", "payload")
+
+_EVENTS_START = re.compile(r'"events"\s*:\s*\[')
+_WHITESPACE = " \t\r\n"
+
+
+def iter_events(f, chunk_size=1 << 20):
+    """Incrementally decode the objects in the `events` array of an event log.
+
+    Only one chunk of the file is held in memory at any time. A log that ends before the closing
+    `]` (e.g. because the simulation crashed) yields every complete event and then stops.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    batch = True
+
+    def fill():
+        nonlocal buf, pos, eof, batch
+        batch = True
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        match = _EVENTS_START.search(buf)
+        if match:
+            pos = match.end()
+            break
+        if eof:
+            raise ValueError("no \"events\" array found in event log")
+        # keep a tail in case the marker is split between chunks
+        pos = max(0, len(buf) - 64)
+        fill()
+
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            fill()
+            continue
+        if buf[pos] == "]":
+            return
+        if buf[pos] == ",":
+            pos += 1
+            continue
+        # Fast path: decode every complete event in the buffer with a single call. If the last `}`
+        # does not close a top-level event, the slice is not valid JSON and we fall back below
+        # until more data is read.
+        cut = buf.rfind("}", pos) + 1
+        if batch and cut > pos:
+            try:
+                events = json.loads("[" + buf[pos:cut] + "]")
+            except json.JSONDecodeError:
+                batch = False
+            else:
+                pos = cut
+                yield from events
+                continue
+        try:
+            event, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                return
+            fill()
+            continue
+        if end == len(buf) and not eof:
+            # a scalar at the end of the buffer may have been cut short
+            fill()
+            continue
+        pos = end
+        yield event
+        if pos > chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def filter_events(events, include=(), exclude=()):
+    for event in events:
+        peripheral = event["peripheral"]
+        if include and peripheral not in include:
+            continue
+        if peripheral in exclude:
+            continue
+        yield event
+
+
+def events_match(ev_gold, ev_gate, time_tolerance=None):
+    for field in EVENT_FIELDS:
+        if ev_gold[field] != ev_gate[field]:
+            return False
+    if time_tolerance is not None:
+        return abs(ev_gold["timestamp"] - ev_gate["timestamp"]) <= time_tolerance
+    return True
+
+
+Divergence = collections.namedtuple("Divergence", ["index", "reference", "test", "before", "after"])
+
+
+def compare_events(gold, gate, *, time_tolerance=None, context=3):
+    """Compare two event streams pairwise, stopping at the first divergence.
+
+    Timestamps are ignored unless `time_tolerance` is given, in which case they must agree to within
+    that many ticks. Returns `(count, None)` if the streams are identical, or `(count, divergence)`
+    where `divergence.before` holds up to `context` preceding matched events and `divergence.after`
+    up to `context` following events from each stream. A missing event is reported as `None`.
+    """
+    before = collections.deque(maxlen=context)
+    gold, gate = iter(gold), iter(gate)
+    for index in itertools.count():
+        ev_gold = next(gold, None)
+        ev_gate = next(gate, None)
+        if ev_gold is None and ev_gate is None:
+            return index, None
+        if ev_gold is None or ev_gate is None or not events_match(ev_gold, ev_gate, time_tolerance):
+            after = (list(itertools.islice(gold, context)), list(itertools.islice(gate, context)))
+            return index, Divergence(index, ev_gold, ev_gate, list(before), after)
+        before.append(ev_gold)
+
+
+def format_event(event):
+    if event is None:
+        return "<end of log>"
+    return json.dumps(event)
+
+
+def report_divergence(divergence, file=sys.stderr):
+    first = divergence.index - len(divergence.before)
+    print(f"mismatch at event {divergence.index}:", file=file)
+    for offset, event in enumerate(divergence.before):
+        print(f"  {first + offset:>10}   {format_event(event)}", file=file)
+    print(f"  {divergence.index:>10} - {format_event(divergence.reference)}", file=file)
+    print(f"  {divergence.index:>10} + {format_event(divergence.test)}", file=file)
+    after_gold, after_gate = divergence.after
+    for offset in range(max(len(after_gold), len(after_gate))):
+        index = divergence.index + 1 + offset
+        if offset < len(after_gold):
+            print(f"  {index:>10} - {format_event(after_gold[offset])}", file=file)
+        if offset < len(after_gate):
+            print(f"  {index:>10} + {format_event(after_gate[offset])}", file=file)
+
+
+def open_events(stack, filename):
+    """Iterate over the events of a JSON or binary (`.evlog`) event log."""
+    # imported here so that comparing JSON logs does not require NumPy
+    from .event_log import EventLog, is_event_log
+    if is_event_log(filename):
+        return EventLog(filename).events()
+    return iter_events(stack.enter_context(open(filename, "r")))
+
+
+def compare_files(reference, test, *, include=(), exclude=(), time_tolerance=None, context=3):
+    with contextlib.ExitStack() as stack:
+        gold = filter_events(open_events(stack, reference), include, exclude)
+        gate = filter_events(open_events(stack, test), include, exclude)
+        return compare_events(gold, gate, time_tolerance=time_tolerance, context=context)
+
+
 def main():
-    with open(sys.argv[1], "r") as f:
-        gold = json.load(f)
-    with open(sys.argv[2], "r") as f:
-        gate = json.load(f)
-    assert len(gold["events"]) == len(gate["events"]), f"mismatch: {len(gold['events'])} events in reference, {len(gate['events'])} in test output"
-    for ev_gold, ev_gate in zip(gold["events"], gate["events"]):
-        for field in ("peripheral", "event", "payload"):
-            assert ev_gold["peripheral"] == ev_gate["peripheral"] and ev_gold["event"] == ev_gate["event"] and ev_gold["payload"] == ev_gate["payload"], \
-                f"reference event {ev_gold} mismatches test event {ev_gate} beyond timestamp"
-    print("Event logs are identical")
+    parser = argparse.ArgumentParser(
+        description="Compare a simulation event log against a reference log")
+    parser.add_argument("reference")
+    parser.add_argument("test")
+    parser.add_argument("--time-tolerance", type=int, default=None, metavar="TICKS",
+        help="also compare timestamps, allowing them to differ by up to TICKS")
+    parser.add_argument("--peripheral", action="append", default=[], metavar="NAME",
+        help="only compare events from this peripheral (may be repeated)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="NAME",
+        help="ignore events from this peripheral (may be repeated)")
+    parser.add_argument("--context", type=int, default=3, metavar="N",
+        help="number of events to show around a mismatch")
+    args = parser.parse_args()
+
+    count, divergence = compare_files(args.reference, args.test,
+        include=set(args.peripheral), exclude=set(args.exclude),
+        time_tolerance=args.time_tolerance, context=args.context)
+    if divergence is not None:
+        report_divergence(divergence)
+        sys.exit(1)
+    print(f"Event logs are identical ({count} events)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+"""Run many simulation scenarios in parallel and check them against their golden event logs.
+
+A scenario is a directory containing `input.json` and `events_reference.json`, and optionally a
+`software.bin` firmware image that overrides `--firmware`. Every scenario is run with every
+firmware image given on the command line (unless it provides its own) in a separate working
+directory under `--work-dir`, on a pool of worker processes.
+
+    python -m my_design.tools.sim_regress my_design/tests path/to/more/scenarios/*
+"""
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from . import json_compare
+
+
+_STOP_REASON = re.compile(r"sim: stopped \((.*?)\)")
+
+
+def discover_scenarios(paths):
+    scenarios = []
+    for path in map(Path, paths):
+        if (path / "input.json").exists():
+            scenarios.append(path)
+        elif path.is_dir():
+            scenarios += sorted(child for child in path.iterdir() if (child / "input.json").exists())
+        else:
+            raise FileNotFoundError(f"{path}: not a scenario directory")
+    return scenarios
+
+
+def plan_jobs(scenarios, firmware_images, work_dir):
+    jobs = []
+    for scenario in scenarios:
+        if (scenario / "software.bin").exists():
+            images = [scenario / "software.bin"]
+        else:
+            images = [Path(image) for image in firmware_images]
+        for image in images:
+            name = scenario.name if len(images) == 1 else f"{scenario.name}-{image.stem}"
+            jobs.append({
+                "name": name,
+                "input": str((scenario / "input.json").absolute()),
+                "reference": str((scenario / "events_reference.json").absolute()),
+                "firmware": str(image.absolute()),
+                "work_dir": str(Path(work_dir, name).absolute()),
+            })
+    names = [job["name"] for job in jobs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"scenario names are not unique: {', '.join(sorted(duplicates))}")
+    return jobs
+
+
+def read_stop_reason(log_filename):
+    """Extract the reason the simulation stopped from its log (e.g. "idle" or "cycle limit")."""
+    with open(log_filename, "r", errors="replace") as log:
+        for line in log:
+            match = _STOP_REASON.match(line)
+            if match:
+                return match.group(1)
+    return None
+
+
+def run_job(job, sim, sim_args=(), timeout=None):
+    """Run one scenario in its working directory; executed in a worker process."""
+    Path(job["work_dir"]).mkdir(parents=True, exist_ok=True)
+    events = os.path.join(job["work_dir"], "events.json")
+    command = [os.path.abspath(sim),
+               "--firmware", job["firmware"],
+               "--input", job["input"],
+               "--events", events,
+               *sim_args]
+    result = dict(job, status="fail", detail="")
+
+    start = time.perf_counter()
+    try:
+        with open(os.path.join(job["work_dir"], "sim.log"), "w") as log:
+            process = subprocess.run(command, cwd=job["work_dir"], stdout=log, stderr=subprocess.STDOUT,
+                                     timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result["detail"] = f"simulation timed out after {timeout} s"
+        return result
+    finally:
+        result["sim_time"] = time.perf_counter() - start
+    result["stop_reason"] = read_stop_reason(os.path.join(job["work_dir"], "sim.log"))
+    if process.returncode != 0:
+        result["detail"] = f"simulation exited with code {process.returncode}, see sim.log"
+        return result
+
+    count, divergence = json_compare.compare_files(job["reference"], events)
+    result["events"] = count
+    if divergence is None:
+        result["status"] = "pass"
+    else:
+        report = io.StringIO()
+        json_compare.report_divergence(divergence, file=report)
+        result["detail"] = report.getvalue()
+        with open(os.path.join(job["work_dir"], "mismatch.txt"), "w") as f:
+            f.write(result["detail"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="+", metavar="SCENARIO",
+        help="scenario directory, or a directory containing scenario directories")
+    parser.add_argument("--sim", default="build/sim/sim_soc" + (".exe" if os.name == "nt" else ""),
+        help="simulation binary (default: %(default)s)")
+    parser.add_argument("--firmware", action="append", default=[], metavar="FILE",
+        help="firmware image to run every scenario with (may be repeated; "
+             "default: build/software/software.bin)")
+    parser.add_argument("--work-dir", default="build/regress",
+        help="directory for per-job working directories (default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+        help="number of parallel jobs (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+        help="kill a simulation that runs for longer than this")
+    parser.add_argument("--sim-arg", action="append", default=[], metavar="ARG",
+        help="extra argument passed to every simulation (may be repeated)")
+    args = parser.parse_args()
+
+    jobs = plan_jobs(discover_scenarios(args.scenarios), args.firmware or ["build/software/software.bin"],
+                     args.work_dir)
+
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_job, job, args.sim, args.sim_arg, args.timeout) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            stop_reason = result.get("stop_reason") or "no stop report"
+            print(f"{result['status'].upper():4}  {result['name']}  ({result['sim_time']:.1f} s, {stop_reason})",
+                  flush=True)
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda result: result["name"])
+    failed = [result for result in results if result["status"] != "pass"]
+    for result in failed:
+        print(f"\n{result['name']}: {result['detail']}", file=sys.stderr)
+
+    summary = {
+        "passed": len(results) - len(failed),
+        "failed": len(failed),
+        "elapsed": elapsed,
+        "results": results,
+    }
+    Path(args.work_dir).mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(args.work_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\n{summary['passed']} passed, {summary['failed']} failed in {elapsed:.1f} s "
+          f"({len(results)} jobs on {args.jobs} workers)")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
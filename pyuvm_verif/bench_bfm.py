@@ -0,0 +1,102 @@
+"""Compare the wall-clock time of the SPI tests with the current SpiBfm and an earlier revision.
+
+    cd pyuvm_verif && python bench_bfm.py [--baseline REV] [--tests RegTest WriteTest:PipelinedWriteTest] [--repeat 3]
+
+Each variant runs in its own directory under bench_build/ with the current Makefile, and the
+testbench Python files (utils_spi.py, testbench_spi.py and, where they exist, spi_trace.py,
+spi_stimulus.py and spi_coverage.py) from the working tree or from git at REV (by default, the
+revision before the commit that replaced the polling `cmd_mon_bfm` with the event-driven BFM). A test given as BASELINE:CURRENT runs BASELINE on the baseline and
+CURRENT on the working tree, such as a test with the pipelined driver against its serialized
+original. The time of each test is the real time cocotb records in results.xml, which leaves out
+the Verilator build; the simulated time is reported too, as both variants run the same stimulus
+(cocotb is given the same RANDOM_SEED) and, unless the driver differs, for the same number of
+clock cycles.
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ("utils_spi.py", "testbench_spi.py", "spi_trace.py", "spi_stimulus.py", "spi_coverage.py")
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=HERE, check=True, capture_output=True, text=True).stdout
+
+
+def default_baseline():
+    # the latest commit to change the number of occurrences of cmd_mon_bfm is the one that removed it
+    removal = git("log", "-n", "1", "-S", "cmd_mon_bfm", "--format=%H", "HEAD", "--", "utils_spi.py").strip()
+    if not removal:
+        raise SystemExit("no commit removed cmd_mon_bfm from utils_spi.py; give --baseline")
+    return f"{removal}^"
+
+
+def prepare(name, sources):
+    directory = os.path.join(HERE, "bench_build", name)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    shutil.copy(os.path.join(HERE, "Makefile"), directory)
+    for filename, source in sources.items():
+        with open(os.path.join(directory, filename), "w") as f:
+            f.write(source)
+    return directory
+
+
+def run_test(directory, test, seed):
+    """Run one test; returns its real and simulated time from results.xml."""
+    verilog_sources = (glob.glob(os.path.join(HERE, "verilog", "*.v")) +
+                       glob.glob(os.path.join(HERE, "..", "build", "export", "ips", "*.v")))
+    subprocess.run(["make", "ARG=SPI", f"TESTCASE={test}", f"VERILOG_SOURCES={' '.join(verilog_sources)}"],
+                   cwd=directory, check=True, capture_output=True, env={**os.environ, "RANDOM_SEED": str(seed)})
+    testcase = ET.parse(os.path.join(directory, "results.xml")).find(".//testcase")
+    if testcase.find("failure") is not None:
+        raise RuntimeError(f"{test} failed in {directory}")
+    return float(testcase.get("time")), float(testcase.get("sim_time_ns"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=None, metavar="REV")
+    parser.add_argument("--tests", nargs="+", default=["RegTest", "ClkdividerTest"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    baseline = args.baseline or default_baseline()
+    baseline_files = git("ls-tree", "--full-tree", "--name-only", baseline, "pyuvm_verif/").split()
+    baseline_sources = {}
+    current_sources = {}
+    for filename in SOURCES:
+        if f"pyuvm_verif/{filename}" in baseline_files:
+            baseline_sources[filename] = git("show", f"{baseline}:pyuvm_verif/{filename}")
+        if os.path.exists(os.path.join(HERE, filename)):
+            with open(os.path.join(HERE, filename)) as f:
+                current_sources[filename] = f.read()
+    variants = {
+        "baseline": prepare("baseline", baseline_sources),
+        "current": prepare("current", current_sources),
+    }
+
+    print(f"baseline: testbench at {git('rev-parse', '--short', baseline).strip()}")
+    for tests in args.tests:
+        baseline_test, _, current_test = tests.partition(":")
+        names = {"baseline": baseline_test, "current": current_test or baseline_test}
+        test = names["current"]
+        results = {}
+        for name, directory in variants.items():
+            runs = [run_test(directory, names[name], args.seed) for _ in range(args.repeat)]
+            results[name] = (min(real for real, _ in runs), runs[0][1])
+            print(f"{test:16} {name:>8}: {results[name][0]:8.2f} s real, {results[name][1]:12.0f} ns simulated")
+        if names["baseline"] != names["current"]:
+            print(f"{test:16} simulated time: {results['baseline'][1] / results['current'][1]:.2f}x shorter")
+        elif results["baseline"][1] != results["current"][1]:
+            print(f"{test:16} warning: simulated times differ")
+        print(f"{test:16} speedup: {results['baseline'][0] / results['current'][0]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Run the pyuvm SPI tests in parallel against one Verilator build, and merge their JUnit reports.
+
+    cd pyuvm_verif && python run_tests.py [-j 8] [--seeds 4] [--base-seed N] [--timeout 1800] [--tests RegTest ...]
+
+The Makefile runs every `@pyuvm.test()` of testbench_spi.py one after the other in a single
+simulation; `make -j` only parallelises the build. Here `spi_wrap` is built once into sim_build/,
+then each test runs with each of `--seeds` random seeds (`base_seed`, `base_seed + 1`, ...) as a
+separate simulation in regress/<test>/seed_<seed>/, which holds its log, waveform and cocotb
+results. A simulation still running after `--timeout` seconds is killed, so that one hang does not
+stall the regression. The runs are merged into one JUnit report (default regress/results.xml): one
+testcase per test and seed, with the seed as a property and the log as system-out. A run that ends
+without results, killed or not, is reported as an error. The functional coverage of the runs is merged too (default
+regress/coverage.npz), and its report printed; see spi_coverage.py.
+"""
+import argparse
+import concurrent.futures
+import glob
+import importlib
+import os
+import random
+import signal
+import subprocess
+import sys
+import xml.etree.ElementTree as ET
+
+import cocotb.regression
+
+import spi_coverage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE = "testbench_spi"
+
+
+def discover_tests():
+    """Map each `@pyuvm.test()` class of testbench_spi.py to the name that selects it in TESTCASE.
+
+    pyuvm leaves the class in place and registers its cocotb test as `test_<id>` beside it, so the
+    class name itself is not a cocotb test.
+    """
+    module = importlib.import_module(MODULE)
+    return {test.__name__: name for name, test in vars(module).items()
+            if isinstance(test, cocotb.regression.Test)}
+
+
+def make_args(sim_build):
+    verilog_sources = (glob.glob(os.path.join(HERE, "verilog", "*.v")) +
+                       glob.glob(os.path.join(HERE, "..", "build", "export", "ips", "*.v")))
+    return ["make", "-f", os.path.join(HERE, "Makefile"), "ARG=SPI", f"SIM_BUILD={sim_build}",
+            f"VERILOG_SOURCES={' '.join(verilog_sources)}"]
+
+
+def build(sim_build, jobs):
+    """Build the simulation once; the test runs find it up to date."""
+    subprocess.run([*make_args(sim_build), f"-j{jobs}", f"{sim_build}/Vtop"], cwd=HERE, check=True)
+
+
+def run(sim_build, testcase, seed, work_dir, timeout):
+    """Run the cocotb test `testcase` with `seed` in `work_dir`, for at most `timeout` seconds; returns the path of its log."""
+    os.makedirs(work_dir, exist_ok=True)
+    results = os.path.join(work_dir, "results.xml")
+    if os.path.exists(results):
+        os.remove(results)
+    log = os.path.join(work_dir, "run.log")
+    env = {**os.environ, "RANDOM_SEED": str(seed),
+           "PYTHONPATH": os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")]))}
+    with open(log, "w") as f:
+        # in a session of its own, so that the simulator is killed with make
+        process = subprocess.Popen([*make_args(sim_build), f"MODULE={MODULE}", f"TESTCASE={testcase}",
+                                    f"COCOTB_RESULTS_FILE={results}"],
+                                   cwd=work_dir, env=env, stdout=f, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            f.write(f"\nrun_tests.py: killed after the timeout of {timeout} s\n")
+    return log
+
+
+def merge(runs, report):
+    """Merge the cocotb results of `(test, seed, work_dir, log)` runs into one JUnit `report`."""
+    suite = ET.Element("testsuite", name=MODULE)
+    counts = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+    total_time = 0.0
+    for test, seed, work_dir, log in runs:
+        results = os.path.join(work_dir, "results.xml")
+        testcase = None
+        if os.path.exists(results):
+            testcase = ET.parse(results).find(f".//testcase[@name='{test}']")
+        if testcase is None:
+            testcase = ET.Element("testcase", classname=MODULE)
+            ET.SubElement(testcase, "error", message="the simulation ended without results, or timed out")
+        testcase.set("name", f"{test}[seed={seed}]")
+        properties = ET.Element("properties")
+        testcase.insert(0, properties)
+        ET.SubElement(properties, "property", name="random_seed", value=str(seed))
+        ET.SubElement(properties, "property", name="work_dir", value=os.path.relpath(work_dir, HERE))
+        with open(log, errors="replace") as f:
+            ET.SubElement(testcase, "system-out").text = f.read()
+        counts["tests"] += 1
+        total_time += float(testcase.get("time", 0))
+        for outcome, count in (("failure", "failures"), ("error", "errors"), ("skipped", "skipped")):
+            if testcase.find(outcome) is not None:
+                counts[count] += 1
+        suite.append(testcase)
+    for name, count in counts.items():
+        suite.set(name, str(count))
+    suite.set("time", f"{total_time:.3f}")
+    testsuites = ET.Element("testsuites")
+    testsuites.append(suite)
+    ET.indent(testsuites)
+    ET.ElementTree(testsuites).write(report, encoding="utf-8", xml_declaration=True)
+    return counts
+
+
+def merge_coverage(work_dirs, output):
+    """Merge the coverage of the runs in `work_dirs` that saved any into `output`."""
+    files = [os.path.join(work_dir, "spi_coverage.npz") for work_dir in work_dirs]
+    coverage = spi_coverage.merge(spi_coverage.SpiCoverage.load(filename)
+                                  for filename in files if os.path.exists(filename))
+    coverage.save(output)
+    return coverage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tests", nargs="+", default=None, help="default: every test in testbench_spi.py")
+    parser.add_argument("--seeds", type=int, default=1, help="random seeds to run each test with")
+    parser.add_argument("--base-seed", type=int, default=None, help="first seed (default: random)")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds each simulation may run")
+    parser.add_argument("--report", default=os.path.join(HERE, "regress", "results.xml"))
+    parser.add_argument("--coverage", default=os.path.join(HERE, "regress", "coverage.npz"))
+    args = parser.parse_args()
+
+    testcases = discover_tests()
+    tests = args.tests or list(testcases)
+    unknown = [test for test in tests if test not in testcases]
+    if unknown:
+        parser.error(f"no such test in {MODULE}.py: {', '.join(unknown)}")
+    base_seed = args.base_seed if args.base_seed is not None else random.randrange(1 << 31)
+    sim_build = os.path.join(HERE, "sim_build")
+    build(sim_build, args.jobs)
+
+    jobs = [(test, seed, os.path.join(HERE, "regress", test, f"seed_{seed}"))
+            for test in tests for seed in range(base_seed, base_seed + args.seeds)]
+    print(f"running {len(jobs)} simulations ({len(tests)} tests, seeds from {base_seed}) on {args.jobs} jobs")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        logs = list(executor.map(lambda job: run(sim_build, testcases[job[0]], *job[1:], args.timeout),
+                                 jobs))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    counts = merge([(*job, log) for job, log in zip(jobs, logs)], args.report)
+    coverage = merge_coverage([work_dir for _, _, work_dir in jobs], args.coverage)
+    print("\n".join(spi_coverage.report(coverage)))
+    print(f"{counts['tests']} runs, {counts['failures']} failed, {counts['errors']} errors; "
+          f"report in {args.report}, coverage in {args.coverage}")
+    if counts["failures"] or counts["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
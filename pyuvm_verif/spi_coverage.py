@@ -0,0 +1,133 @@
+"""Functional coverage of the SPI configuration space, stored as NumPy arrays, merged across runs.
+
+    python spi_coverage.py report spi_coverage.npz
+    python spi_coverage.py merge regress/coverage.npz regress/*/seed_*/spi_coverage.npz
+
+Every transfer (write to 0xb) is sampled with the configuration the BFM decoded: `sck_start`,
+`sck_edge`, `width_num` and `clk_div`, the last in power-of-two bins (0, 1, 2-3, 4-7, ... 128-255).
+`width_num` has a bin for each of `WIDTHS`, the widths that the stimulus draws and the BFM
+supports; a transfer of any other width is counted, but hits no cell.
+The model is the full cross of the four, one counter per cell in a flat array indexed by mixed
+radix, so that a sample costs a few integer operations and an increment; the coverpoints are its
+marginals. The transfer at which each cell was first hit is kept too, for the closure curve.
+
+A coverage file is an `.npz` of `hits` (counts per cell), `first_hit` (transfer number of the
+first hit per cell, or -1) and `transfers` (transfers sampled). Merging adds the hits, and lays
+the runs end to end, in the order given, for the first hits: the closure curve of a merge is
+that of one run as long as all of them.
+"""
+import argparse
+
+import numpy as np
+
+
+__all__ = ["COVERPOINTS", "WIDTHS", "SpiCoverage", "merge", "report"]
+
+
+# the supported values of width_num: 8-bit and 9-bit frames
+WIDTHS = (7, 8)
+_WIDTH_BINS = {width: index for index, width in enumerate(WIDTHS)}
+
+# coverpoint names and bin labels, in the order of the cross axes
+COVERPOINTS = {
+    "sck_start": ["0", "1"],
+    "sck_edge": ["0", "1"],
+    "width_num": [str(width) for width in WIDTHS],
+    "clk_div": ["0", "1"] + [f"{1 << bit}-{(2 << bit) - 1}" for bit in range(1, 8)],
+}
+SHAPE = tuple(len(bins) for bins in COVERPOINTS.values())
+CELLS = int(np.prod(SHAPE))
+
+
+class SpiCoverage:
+    """Coverage of one run; `sample` is called for every transfer."""
+    def __init__(self):
+        self.hits = np.zeros(CELLS, dtype=np.uint64)
+        self.first_hit = np.full(CELLS, -1, dtype=np.int64)
+        self.transfers = 0
+
+    def sample(self, sck_start, sck_edge, width_num, clk_div):
+        width_bin = _WIDTH_BINS.get(width_num)
+        if width_bin is not None:
+            cell = ((sck_start * SHAPE[1] + sck_edge) * SHAPE[2] + width_bin) * SHAPE[3] + min(clk_div.bit_length(), 8)
+            if self.hits[cell] == 0:
+                self.first_hit[cell] = self.transfers
+            self.hits[cell] += 1
+        self.transfers += 1
+
+    def save(self, filename):
+        np.savez(filename, hits=self.hits, first_hit=self.first_hit, transfers=self.transfers)
+
+    @classmethod
+    def load(cls, filename):
+        coverage = cls()
+        with np.load(filename) as data:
+            if data["hits"].shape != (CELLS,):
+                raise ValueError(f"{filename}: coverage of {data['hits'].shape[0]} cells, not {CELLS}")
+            coverage.hits = data["hits"]
+            coverage.first_hit = data["first_hit"]
+            coverage.transfers = int(data["transfers"])
+        return coverage
+
+
+def merge(coverages):
+    """Merge `SpiCoverage`s, as if their runs had been one after the other."""
+    merged = SpiCoverage()
+    first_hits = [merged.first_hit]
+    for coverage in coverages:
+        merged.hits += coverage.hits
+        first_hits.append(np.where(coverage.first_hit >= 0, coverage.first_hit + merged.transfers, -1))
+        merged.transfers += coverage.transfers
+    stacked = np.stack(first_hits)
+    merged.first_hit = np.where(stacked >= 0, stacked, np.iinfo(np.int64).max).min(axis=0)
+    merged.first_hit[merged.first_hit == np.iinfo(np.int64).max] = -1
+    return merged
+
+
+def report(coverage, *, points=10, holes=20):
+    """Lines of text: coverage of each coverpoint and of the cross, the closure curve and holes."""
+    cross = coverage.hits.reshape(SHAPE) > 0
+    lines = [f"{coverage.transfers} transfers sampled"]
+    for axis, (name, bins) in enumerate(COVERPOINTS.items()):
+        others = tuple(other for other in range(len(SHAPE)) if other != axis)
+        covered = cross.any(axis=others)
+        lines.append(f"{name:12} {covered.sum():5}/{len(bins):<5} {100 * covered.mean():6.1f}%"
+                     f"  missing: {', '.join(label for label, hit in zip(bins, covered) if not hit) or '-'}")
+    lines.append(f"{'cross':12} {cross.sum():5}/{CELLS:<5} {100 * cross.mean():6.1f}%")
+
+    first_hits = np.sort(coverage.first_hit[coverage.first_hit >= 0])
+    if coverage.transfers:
+        lines.append("closure (transfers: cross coverage):")
+        for transfers in np.unique(np.geomspace(1, coverage.transfers, points).astype(np.int64)):
+            covered = np.searchsorted(first_hits, transfers)
+            lines.append(f"  {transfers:12}: {100 * covered / CELLS:6.1f}%")
+        if len(first_hits):
+            lines.append(f"  last new cell at transfer {first_hits[-1]}")
+
+    hole_cells = np.flatnonzero(~cross.ravel())
+    if len(hole_cells):
+        lines.append(f"holes (first {min(holes, len(hole_cells))} of {len(hole_cells)}):")
+        for cell in hole_cells[:holes]:
+            index = np.unravel_index(cell, SHAPE)
+            lines.append("  " + " ".join(f"{name}={bins[i]}" for (name, bins), i in zip(COVERPOINTS.items(), index)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="report the coverage of one or more files, merged")
+    report_parser.add_argument("coverage", nargs="+")
+    merge_parser = subparsers.add_parser("merge", help="merge coverage files into one")
+    merge_parser.add_argument("output")
+    merge_parser.add_argument("coverage", nargs="+")
+    args = parser.parse_args()
+
+    coverage = merge(SpiCoverage.load(filename) for filename in args.coverage)
+    if args.command == "merge":
+        coverage.save(args.output)
+    print("\n".join(report(coverage)))
+
+
+if __name__ == "__main__":
+    main()
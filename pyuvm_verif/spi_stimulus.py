@@ -0,0 +1,98 @@
+"""Seeded, constrained-random SPI stimulus, generated with NumPy a batch at a time.
+
+A stream is a series of frames, each a write of a payload to 0xb, preceded (with probability
+`reconfigure`, and always at the start of a batch) by writes of a new configuration to 0x0 and a
+new clock divider to 0x4, and followed (with probability `readback`) by a read of the received
+byte from 0xc. Reads are only made of 8-bit frames (width 7) with the divider at 0 and the sck edge
+bit set: the BFM drives `cipo` for that timing alone, and for 8 bits, so that a 9-bit frame (width
+8) would read back shifted data. Widths, dividers and the sck edge and start bits are drawn from
+weights: a dict of values, or of `(low, high)` inclusive ranges, to relative weights. The sck edge
+bit is always set by default: with it clear, the SPI peripheral shifts its data out on every leading
+edge of sck, the first included, so that the first bit of the payload never reaches `copi`.
+
+The generator is seeded explicitly, so that a seed and batch size always give the same stream;
+`SpiStimulus.from_env` takes SPI_STIM_SEED, or else cocotb's RANDOM_SEED.
+"""
+import os
+
+import numpy as np
+
+
+__all__ = ["SpiStimulus", "draw_weighted", "config_byte"]
+
+
+WR = 1
+RD = 2
+
+# configuration and divider writes, payload write, read back
+_ADDRS = np.array([0x0, 0x4, 0xb, 0xc])
+_OPS = np.array([WR, WR, WR, RD])
+
+
+def draw_weighted(rng, weights, count):
+    """Draw `count` values from `weights`, a dict of values or `(low, high)` ranges to weights."""
+    buckets = list(weights)
+    p = np.array([weights[bucket] for bucket in buckets], dtype=float)
+    if p.min() < 0 or p.sum() <= 0:
+        raise ValueError(f"weights must be non-negative and not all zero, not {weights!r}")
+    low = np.array([bucket[0] if isinstance(bucket, tuple) else bucket for bucket in buckets])
+    high = np.array([bucket[1] if isinstance(bucket, tuple) else bucket for bucket in buckets])
+    index = rng.choice(len(buckets), size=count, p=p / p.sum())
+    return rng.integers(low[index], high[index], endpoint=True)
+
+
+def config_byte(width, sck_edge, sck_start):
+    """The value written to 0x0: the width in bits 7:3, chip select, then the edge and start bits."""
+    return (width << 3) | 0x4 | (sck_edge << 1) | sck_start
+
+
+class SpiStimulus:
+    """Batches of SPI register operations, as `(addr, data, op)` arrays."""
+    def __init__(self, seed, *, width=None, clk_div=None, sck_edge=None, sck_start=None,
+                 reconfigure=0.05, readback=0.5):
+        self.seed = seed
+        self.width = width or {7: 1, 8: 1}
+        self.clk_div = clk_div or {0: 16, (1, 7): 3, (8, 127): 1}
+        self.sck_edge = sck_edge or {1: 1}
+        self.sck_start = sck_start or {0: 1, 1: 1}
+        self.reconfigure = reconfigure
+        self.readback = readback
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        seed = os.environ.get("SPI_STIM_SEED")
+        if seed is None:
+            import cocotb
+            seed = cocotb.RANDOM_SEED
+        return cls(int(seed), **kwargs)
+
+    def frames(self, count):
+        """`count` frames, as arrays of the operations of all of them in order."""
+        rng = self._rng
+        reconfigure = rng.random(count) < self.reconfigure
+        reconfigure[0] = True
+        width = draw_weighted(rng, self.width, count)
+        sck_edge = draw_weighted(rng, self.sck_edge, count)
+        config = config_byte(width, sck_edge, draw_weighted(rng, self.sck_start, count))
+        clk_div = draw_weighted(rng, self.clk_div, count)
+        payload = rng.integers(0, 256, size=count)
+        readback = rng.random(count) < self.readback
+
+        # a frame runs with the configuration and divider of the last reconfiguration
+        last = np.maximum.accumulate(np.where(reconfigure, np.arange(count), 0))
+        readback &= (clk_div[last] == 0) & (sck_edge[last] == 1) & (width[last] == 7)
+
+        mask = np.column_stack([reconfigure, reconfigure, np.ones(count, dtype=bool), readback]).ravel()
+        data = np.column_stack([config, clk_div, payload, payload]).ravel()[mask]
+        addr = np.tile(_ADDRS, count)[mask]
+        op = np.tile(_OPS, count)[mask]
+        return addr, data, op
+
+    def batches(self, transactions, frames_per_batch=4096):
+        """Batches of frames up to `transactions` operations in total, the last frame possibly cut short."""
+        remaining = transactions
+        while remaining > 0:
+            addr, data, op = self.frames(frames_per_batch)
+            yield addr[:remaining], data[:remaining], op[:remaining]
+            remaining -= len(addr)
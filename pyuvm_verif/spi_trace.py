@@ -0,0 +1,195 @@
+"""Low-overhead trace of the SPI BFM and testbench: binary records in an in-memory ring.
+
+    python spi_trace.py decode spi_trace.bin [--component driver ...] [--level INFO] [--last 100]
+
+Each component traces through its own `TraceComponent`, with the calls of a logger: a %-format
+message and integer arguments, as in `trace.info("WRITE OP START %d addr: %#x", tid, addr)`. A
+call below the component's level returns at once; otherwise the simulation time, component,
+message, level and arguments are packed into a preallocated ring of the last `capacity` records.
+The message is interned once, and nothing is formatted unless the record is at or above the echo
+level, when it is also logged, or until the ring is dumped and decoded.
+
+Dump layout (all integers little-endian): header (32 bytes): magic `PUVMTRC\\0`, version (u32),
+record size (u32), record count (u64), records traced in total (u64); the records, oldest first
+(`RECORD`); then the string table: count (u32), then for each string its length (u32) and UTF-8
+bytes. Record component and message fields index into it.
+
+The testbench configures the trace from the environment:
+
+* SPI_TRACE_LEVELS: per-component levels, e.g. `driver=INFO,*=WARNING` (default: DEBUG);
+* SPI_TRACE_ECHO: level from which records are logged too (default: WARNING);
+* SPI_TRACE_SIZE: records kept (default: 65536);
+* SPI_TRACE_DUMP: file the ring is dumped to on failure (default: spi_trace.bin) and, if set, at
+  the end of every test.
+"""
+import argparse
+import logging
+import os
+import struct
+import sys
+
+
+__all__ = ["RECORD", "TraceSink", "TraceComponent", "read_dump", "decode"]
+
+
+MAGIC   = b"PUVMTRC\0"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIQQ")
+# time, component, message, level, argument count, then up to MAX_ARGS arguments
+RECORD = struct.Struct("<QHHHBx4q")
+MAX_ARGS = 4
+
+_U32 = struct.Struct("<I")
+_PADDING = (0,) * MAX_ARGS
+
+
+class TraceComponent:
+    """The trace of one component, with a level of its own."""
+    __slots__ = ("sink", "name", "id", "level", "echo_level", "logger")
+
+    def __init__(self, sink, name, level, echo_level, logger):
+        self.sink = sink
+        self.name = name
+        self.id = sink.intern(name)
+        self.level = level
+        self.echo_level = echo_level
+        self.logger = logger
+
+    def log(self, level, message, *args):
+        if level < self.level:
+            return
+        self.sink.record(self.id, level, message, args)
+        if level >= self.echo_level:
+            self.logger.log(level, f"{self.name}: {message}", *args)
+
+    def debug(self, message, *args):
+        self.log(logging.DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(logging.INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(logging.WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(logging.ERROR, message, *args)
+
+
+class TraceSink:
+    """A ring of the last `capacity` trace records; `clock()` gives the time of a record."""
+    def __init__(self, clock, *, capacity=65536, levels=None, echo_level=logging.WARNING):
+        self.clock = clock
+        self.capacity = capacity
+        self.levels = dict(levels or {})
+        self.echo_level = echo_level
+        self.count = 0
+        self._buffer = bytearray(capacity * RECORD.size)
+        self._strings = []
+        self._ids = {}
+
+    @classmethod
+    def from_env(cls, clock):
+        levels = {}
+        for item in filter(None, os.environ.get("SPI_TRACE_LEVELS", "").split(",")):
+            name, _, level = item.partition("=")
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+        return cls(clock, capacity=int(os.environ.get("SPI_TRACE_SIZE", 65536)), levels=levels,
+                   echo_level=logging.getLevelName(os.environ.get("SPI_TRACE_ECHO", "WARNING").upper()))
+
+    def component(self, name, logger):
+        level = self.levels.get(name, self.levels.get("*", logging.DEBUG))
+        return TraceComponent(self, name, level, self.echo_level, logger)
+
+    def intern(self, string):
+        try:
+            return self._ids[string]
+        except KeyError:
+            self._ids[string] = len(self._strings)
+            self._strings.append(string)
+            return self._ids[string]
+
+    def record(self, component, level, message, args):
+        message_id = self._ids.get(message)
+        if message_id is None:
+            message_id = self.intern(message)
+        RECORD.pack_into(self._buffer, (self.count % self.capacity) * RECORD.size,
+                         self.clock(), component, message_id, level, len(args), *args,
+                         *_PADDING[len(args):])
+        self.count += 1
+
+    def dump(self, filename):
+        """Write the records in the ring, oldest first, to `filename`."""
+        kept = min(self.count, self.capacity)
+        split = (self.count % self.capacity) * RECORD.size if self.count > self.capacity else 0
+        with open(filename, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, kept, self.count))
+            f.write(self._buffer[split:kept * RECORD.size])
+            f.write(self._buffer[:split])
+            f.write(_U32.pack(len(self._strings)))
+            for string in self._strings:
+                encoded = string.encode()
+                f.write(_U32.pack(len(encoded)))
+                f.write(encoded)
+
+
+def read_dump(filename):
+    """Read a dump; returns the records traced in total and the records as
+    `(time, component, message, level, args)` tuples with the strings resolved."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{filename}: truncated trace header")
+    magic, version, record_size, kept, total = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{filename}: not a trace dump")
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{filename}: unsupported trace version {version} (record size {record_size})")
+
+    offset = HEADER.size + kept * RECORD.size
+    strings = []
+    (count,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    for _ in range(count):
+        (length,) = _U32.unpack_from(data, offset)
+        offset += _U32.size
+        strings.append(data[offset:offset + length].decode())
+        offset += length
+
+    records = []
+    for time, component, message, level, nargs, *args in RECORD.iter_unpack(
+            data[HEADER.size:HEADER.size + kept * RECORD.size]):
+        records.append((time, strings[component], strings[message], level, tuple(args[:nargs])))
+    return total, records
+
+
+def decode(records):
+    """Render `read_dump` records as lines of text."""
+    for time, component, message, level, args in records:
+        yield f"{time:>14} {logging.getLevelName(level):8} {component:12} {message % args}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    decode_parser = subparsers.add_parser("decode", help="render a trace dump as text")
+    decode_parser.add_argument("dump")
+    decode_parser.add_argument("--component", nargs="+", default=None)
+    decode_parser.add_argument("--level", default="DEBUG")
+    decode_parser.add_argument("--last", type=int, default=None, help="only the last N records")
+    args = parser.parse_args()
+
+    total, records = read_dump(args.dump)
+    level = logging.getLevelName(args.level.upper())
+    records = [record for record in records
+               if record[3] >= level and (args.component is None or record[1] in args.component)]
+    if args.last is not None:
+        records = records[-args.last:]
+    if total > len(records):
+        print(f"# {len(records)} of {total} records traced", file=sys.stderr)
+    for line in decode(records):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 from cocotb.triggers import Join, Combine
+from cocotb.queue import Queue
+from collections import deque
 from pyuvm import *
 import random
 import cocotb
 import pyuvm
+import os
 import sys
 from pathlib import Path
 sys.path.append(str(Path("..").resolve()))
 from utils_spi import SpiBfm,Ops
+from spi_stimulus import SpiStimulus
 
 class SpiSeqItem(uvm_sequence_item):
     def __init__(self, name, address, data, op):
@@ -170,12 +174,43 @@ class WidthSeq(uvm_sequence):
             spiwr2 = SpiSeq("spiwr2", 0xb, data2, 1)
             await spiwr2.start(seqr)
 
+class SpiStreamSeq(uvm_sequence):
+    """Streams `transactions` operations from a `SpiStimulus` into the sequencer, a batch at a time."""
+    def __init__(self, name, stimulus, transactions):
+        super().__init__(name)
+        self.stimulus = stimulus
+        self.transactions = transactions
+
+    async def body(self):
+        for addrs, datas, ops in self.stimulus.batches(self.transactions):
+            for addr, data, op in zip(addrs.tolist(), datas.tolist(), ops.tolist()):
+                cmd_tr = SpiSeqItem("cmd_tr", addr, data, op)
+                await self.start_item(cmd_tr)
+                await self.finish_item(cmd_tr)
+
+class TestStreamSeq(uvm_sequence):
+    async def body(self):
+        seqr = ConfigDB().get(None, "", "SEQR")
+        stimulus = SpiStimulus.from_env()
+        transactions = int(os.environ.get("SPI_STIM_TRANSACTIONS", 10000))
+        uvm_root().logger.info(f"TEST: {transactions} CONSTRAINED-RANDOM TRANSACTIONS, STIMULUS SEED {stimulus.seed}")
+        stream = SpiStreamSeq("stream", stimulus, transactions)
+        await stream.start(seqr)
+
 class Driver(uvm_driver):
+    """Sends each item to the BFM under a new transaction ID, and lets the sequence go on while up
+    to MAX_IN_FLIGHT of them wait for their result. With 1, an item is done only once the result
+    of the one before it is in; the test stays running until every result is."""
     def build_phase(self):
         self.ap = uvm_analysis_port("ap", self)
+        self.max_in_flight = ConfigDB().get(None, "", "MAX_IN_FLIGHT")
 
     def start_of_simulation_phase(self):
         self.bfm = SpiBfm()
+        self.bfm.max_in_flight = self.max_in_flight
+        self.trace = self.bfm.trace.component("tb_driver", self.logger)
+        self.in_flight = Queue(maxsize=self.max_in_flight)
+        self.outstanding = set()
 
     async def launch_tb(self):
         await self.bfm.reset()
@@ -183,14 +218,28 @@ class Driver(uvm_driver):
 
     async def run_phase(self):
         await self.launch_tb()
+        cocotb.start_soon(self.collect_results())
+        tid = 0
         while True:
             cmd = await self.seq_item_port.get_next_item()
-            await self.bfm.send_op(cmd.addr, cmd.data, cmd.op)
-            uvm_root().logger.info(f"RUN PHASE addr: {hex(cmd.addr)} data: {hex(cmd.data)} op: {cmd.op}")
-            result = await self.bfm.get_result()
-            self.ap.write(result)
-            uvm_root().logger.info(f"GET RESULT: {hex(result)}")
+            await self.in_flight.put(tid)
+            if not self.outstanding:
+                self.raise_objection()
+            self.outstanding.add(tid)
+            await self.bfm.send_op(cmd.addr, cmd.data, cmd.op, tid)
+            self.trace.debug("RUN PHASE %d addr: %#x data: %#x op: %d", tid, cmd.addr, cmd.data, cmd.op)
             self.seq_item_port.item_done()
+            tid += 1
+
+    async def collect_results(self):
+        while True:
+            tid, result = await self.bfm.get_result()
+            self.ap.write((tid, result))
+            self.trace.debug("GET RESULT %d: %#x", tid, result)
+            self.in_flight.get_nowait()
+            self.outstanding.discard(tid)
+            if not self.outstanding:
+                self.drop_objection()
 
 class Monitor(uvm_component):
     def __init__(self, name, parent, method_name):
@@ -205,10 +254,17 @@ class Monitor(uvm_component):
     async def run_phase(self):
         while True:
             datum = await self.get_method()
-            self.logger.debug(f"MONITORED {datum}")
+            self.logger.debug("MONITORED %s", datum)
             self.ap.write(datum)
 
 class Scoreboard(uvm_component):
+    """Checks each result against the command with the same transaction ID, in the order of the IDs.
+
+    By default every command and result is kept until `check_phase`. With SCB_ONLINE, `run_phase`
+    checks each transaction as soon as it and those before it are complete, so that only the ones
+    in flight are kept; with SCB_MAX_ERRORS above 0, the test fails at that many failures instead
+    of running to the end. Either way a failure is logged with the last SCB_HISTORY transactions,
+    and the BFM trace is dumped when the test fails."""
 
     def build_phase(self):
         self.cmd_fifo = uvm_tlm_analysis_fifo("cmd_fifo", self)
@@ -220,39 +276,85 @@ class Scoreboard(uvm_component):
         self.cmd_export = self.cmd_fifo.analysis_export
         self.result_export = self.result_fifo.analysis_export
 
+        self.bfm = SpiBfm()
+        self.trace = self.bfm.trace.component("scoreboard", self.logger)
+        self.online = ConfigDB().get(None, "", "SCB_ONLINE")
+        self.max_errors = ConfigDB().get(None, "", "SCB_MAX_ERRORS")
+        self.history = deque(maxlen=ConfigDB().get(None, "", "SCB_HISTORY"))
+        self.cmds = {}
+        self.results = {}
+        self.next_tid = 0
+        self.predicted_data = None
+        self.errors = 0
+
     def connect_phase(self):
         self.cmd_get_port.connect(self.cmd_fifo.get_export)
         self.result_get_port.connect(self.result_fifo.get_export)
 
+    async def run_phase(self):
+        if not self.online:
+            return
+        cocotb.start_soon(self.receive(self.result_get_port, self.results))
+        await self.receive(self.cmd_get_port, self.cmds)
+
+    async def receive(self, get_port, received):
+        while True:
+            tid, datum = await get_port.get()
+            received[tid] = datum
+            self.check_complete()
+
+    def check_complete(self):
+        """Check the transactions from `next_tid` on, up to the first one still in flight."""
+        while self.next_tid in self.cmds and self.next_tid in self.results:
+            tid = self.next_tid
+            self.check(tid, self.cmds.pop(tid), self.results.pop(tid))
+            self.next_tid += 1
+        if self.online and self.max_errors and self.errors >= self.max_errors:
+            self.bfm.dump_trace()
+            raise AssertionError(f"stopped at {self.errors} scoreboard failures")
+
+    def check(self, tid, cmd, data_read):
+        (addr, data, op_numb) = cmd
+        self.history.append((tid, addr, data, op_numb, data_read))
+        if op_numb == 1 and addr in(0,4):
+            self.predicted_data = data_read
+            self.trace.debug("WDATA %#x", self.predicted_data)
+        if op_numb == 1 and (addr == 11 or addr == 12):
+            self.predicted_data = data
+            self.trace.debug("WDATA ADDR B %#x", self.predicted_data)
+        if (op_numb == 2 and addr in(0,4,12)) or (op_numb == 1 and addr == 11):
+            if self.predicted_data == data_read:
+                self.trace.info("PASSED %d: %#x = %#x", tid, self.predicted_data, data_read)
+            else:
+                self.logger.error(f"FAILED {tid}: "
+                                  f"ACTUAL:   {hex(data_read)} "
+                                  f"EXPECTED: {hex(self.predicted_data)}")
+                self.logger.error(f"LAST {len(self.history)} TRANSACTIONS:")
+                for entry in self.history:
+                    self.logger.error("  %d: ADDR: %#x DATA: %#x OP: %d RESULT: %#x", *entry)
+                self.errors += 1
+
     def check_phase(self):
         self.logger.info(f"CHECK SCB PHASE")
         passed = True
-        while True:
-            cmd_success, cmd = self.cmd_get_port.try_get()
-            if not cmd_success:
-                break
-            else:
-                result_success, data_read = self.result_get_port.try_get()
-                if not result_success:
-                    self.logger.critical(f"result {data_read} had no command")
-                else:
-                    (addr, data, op_numb) = cmd
-                    if op_numb == 1 and addr in(0,4):
-                        predicted_data = data_read
-                        self.logger.info(f"WDATA  {hex(predicted_data)} ")
-                    if op_numb == 1 and (addr == 11 or addr == 12):
-                        predicted_data = data
-                        self.logger.info(f"WDATA ADDR B {hex(predicted_data)} ")
-                    if (op_numb == 2 and addr in(0,4,12)) or (op_numb == 1 and addr == 11):
-                        if predicted_data == data_read:
-                            self.logger.info(f"PASSED: {hex(predicted_data)} ="
-                                             f" {hex(data_read)}")
-                        else:
-                            self.logger.error(f"FAILED: "
-                                              f"ACTUAL:   {hex(data_read)} "
-                                              f"EXPECTED: {hex(predicted_data)}")
-                            passed = False
-        assert passed
+        for get_port, received in ((self.cmd_get_port, self.cmds), (self.result_get_port, self.results)):
+            while True:
+                success, item = get_port.try_get()
+                if not success:
+                    break
+                tid, datum = item
+                received[tid] = datum
+        for tid in sorted(self.results.keys() - self.cmds.keys()):
+            self.logger.critical(f"result {tid}: {self.results[tid]} had no command")
+            passed = False
+        for tid in sorted(self.cmds.keys() - self.results.keys()):
+            self.logger.critical(f"command {tid}: {self.cmds[tid]} had no result")
+            passed = False
+        for tid in sorted(self.cmds.keys() & self.results.keys()):
+            self.check(tid, self.cmds.pop(tid), self.results.pop(tid))
+        if not passed or self.errors:
+            self.bfm.dump_trace()
+        assert passed and self.errors == 0
 
 class SpiEnv(uvm_env):
     def build_phase(self):
@@ -269,7 +371,18 @@ class SpiEnv(uvm_env):
 
 @pyuvm.test()
 class BasicTest(uvm_test):
+    # sequence items the driver lets wait for their result at once
+    max_in_flight = 1
+    # check in run_phase rather than check_phase, and fail at scoreboard_max_errors failures (0: never)
+    scoreboard_online = False
+    scoreboard_max_errors = 0
+    scoreboard_history = 16
+
     def build_phase(self):
+        ConfigDB().set(None, "*", "MAX_IN_FLIGHT", self.max_in_flight)
+        ConfigDB().set(None, "*", "SCB_ONLINE", self.scoreboard_online)
+        ConfigDB().set(None, "*", "SCB_MAX_ERRORS", self.scoreboard_max_errors)
+        ConfigDB().set(None, "*", "SCB_HISTORY", self.scoreboard_history)
         self.env = SpiEnv("env", self)
 
     def end_of_elaboration_phase(self):
@@ -282,6 +395,11 @@ class BasicTest(uvm_test):
         uvm_root().logger.info(f"END TEST")
         self.drop_objection()
 
+    def final_phase(self):
+        SpiBfm().save_coverage()
+        if "SPI_TRACE_DUMP" in os.environ:
+            SpiBfm().dump_trace()
+
 @pyuvm.test()
 class RegTest(BasicTest):
 
@@ -316,4 +434,38 @@ class WidthTest(BasicTest):
 
     def build_phase(self):
         uvm_factory().set_type_override_by_type(TestSeq, WidthSeq)
-        super().build_phase()
\ No newline at end of file
+        super().build_phase()
+
+@pyuvm.test()
+class PipelinedRegTest(RegTest):
+    max_in_flight = 4
+    scoreboard_online = True
+    scoreboard_max_errors = 1
+
+@pyuvm.test()
+class PipelinedWriteTest(WriteTest):
+    max_in_flight = 4
+    scoreboard_online = True
+    scoreboard_max_errors = 1
+
+@pyuvm.test()
+class PipelinedReadTest(ReadTest):
+    max_in_flight = 4
+    scoreboard_online = True
+    scoreboard_max_errors = 1
+
+@pyuvm.test()
+class PipelinedClkdividerTest(ClkdividerTest):
+    max_in_flight = 4
+    scoreboard_online = True
+    scoreboard_max_errors = 1
+
+@pyuvm.test()
+class RandomStreamTest(BasicTest):
+    max_in_flight = 4
+    scoreboard_online = True
+    scoreboard_max_errors = 1
+
+    def build_phase(self):
+        uvm_factory().set_type_override_by_type(TestSeq, TestStreamSeq)
+        super().build_phase()
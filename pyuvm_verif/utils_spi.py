@@ -2,16 +2,17 @@ from pyuvm import *
 import pyuvm
 import random
 import cocotb
-from cocotb.triggers import RisingEdge, ClockCycles, FallingEdge, Combine
-from cocotb.queue import QueueEmpty, Queue
+from cocotb.triggers import RisingEdge, FallingEdge, First, Timer, Event
+from cocotb.queue import Queue
+from cocotb.utils import get_sim_time
+from collections import deque, namedtuple
 import enum
-import logging
+import os
 
 from pyuvm import utility_classes
 
-logging.basicConfig(level=logging.NOTSET)
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+from spi_coverage import SpiCoverage
+from spi_trace import TraceSink
 
 @enum.unique
 class Ops(enum.IntEnum):
@@ -26,16 +27,52 @@ def get_int(signal):
         sig = 0
     return sig
 
+# One strobed access seen on the register bus: `wdata` is sampled with the strobe and `rdata` on
+# the next falling edge of the clock, when the read data is valid. `tid` is the transaction ID the
+# driver gave the operation.
+BusEvent = namedtuple("BusEvent", ["tid", "addr", "op", "wdata", "rdata"])
+
 class SpiBfm(metaclass=utility_classes.Singleton):
+    """Drives and monitors the register bus of `spi_wrap`.
+
+    Nothing waits on every clock cycle while the bus is idle: the driver sleeps on its queue until
+    it has an operation to drive, and a single bus monitor wakes on the rising edge of `wstb` or
+    `rstb`, records the configuration written to addresses 0x0 and 0x4 and fans each access out
+    to the command queue and the checkers' queues. The checkers then wait on `sck` edges, or on a
+    timer computed from the clock period measured in `reset`, rather than counting clock edges.
+
+    Each operation carries a transaction ID, which comes back with its command and its result. With
+    `max_in_flight` at 1 the results arrive in order, each 0xb write being held for 100 cycles
+    after its transfer; with more, they are published as soon as they are known, possibly out of
+    order, and the driver instead holds every access while a transfer is in progress, as writes to
+    the configuration or to 0xb and reads of 0xc would disturb it.
+
+    Everything is traced to `trace`, a `spi_trace.TraceSink` configured from the environment, which
+    is dumped when a check fails, and every transfer is sampled into `coverage` with the
+    configuration decoded so far."""
     def __init__(self):
         self.dut = cocotb.top
+        self.max_in_flight = 1
         self.driver_queue = Queue(maxsize=1)
         self.cmd_mon_queue = Queue(maxsize=0)
         self.result_mon_queue = Queue(maxsize=0)
+        self.checker_queues = []
+        # IDs of the operations driven on the bus, until the bus monitor sees them
+        self.bus_tids = deque()
+        self.spi_idle = Event()
+        self.spi_idle.set()
         self.data_cipo = 0
         self.clk_div = 0
         self.width_num = 0
-        self.width_en = 0
+        self.sck_start = 0
+        self.sck_edge = 0
+        self.clk_period = None
+        self.coverage = SpiCoverage()
+        self.trace = TraceSink.from_env(lambda: get_sim_time(units="step"))
+        self.trace_driver = self.trace.component("driver", uvm_root().logger)
+        self.trace_bus = self.trace.component("bus_mon", uvm_root().logger)
+        self.trace_result = self.trace.component("result_mon", uvm_root().logger)
+        self.trace_checker = self.trace.component("checker", uvm_root().logger)
     def reverse_bits(self, number, bit_size):
         binary = bin(number)
         reverse = binary[-1:1:-1]
@@ -43,8 +80,8 @@ class SpiBfm(metaclass=utility_classes.Singleton):
         reverse = int(reverse, 2)
         return reverse
 
-    async def send_op(self, addr, data, op):
-        command_tuple = (addr, data, op)
+    async def send_op(self, addr, data, op, tid):
+        command_tuple = (addr, data, op, tid)
         await self.driver_queue.put(command_tuple)
 
     async def get_cmd(self):
@@ -54,76 +91,95 @@ class SpiBfm(metaclass=utility_classes.Singleton):
     async def get_result(self):
         result = await self.result_mon_queue.get()
         return result
-    async def cmd_mon_bfm(self):
-        global wid_end
+
+    def subscribe(self):
+        """A queue that receives every `BusEvent` seen by the bus monitor."""
+        queue = Queue(maxsize=0)
+        self.checker_queues.append(queue)
+        return queue
+
+    async def clock_cycles(self, cycles):
+        """Wait until the `cycles`-th rising edge of `clk_test` from now, with a single timer."""
+        await Timer((cycles - 1) * self.clk_period + self.clk_period // 2, units="step")
+        await RisingEdge(self.dut.clk_test)
+
+    def decode_config(self, addr, data):
+        if addr == 0:
+            self.sck_start  = (data & 0x01)
+            self.sck_edge   = (data & 0x02)
+            width_bin = bin(data)[2:].zfill(8)
+            self.width_num = int(width_bin[:5],2)
+            self.trace_bus.info("SCK EDGE: %d SCK START: %d WIDTH NUMBER: %d",
+                                self.sck_edge, self.sck_start, self.width_num)
+        if addr == 4:
+            self.clk_div = data
+            self.trace_bus.info("CLK DIV: %d", self.clk_div)
+
+    async def bus_mon_bfm(self):
         while True:
+            await First(RisingEdge(self.dut.wstb), RisingEdge(self.dut.rstb))
+            # sample as the DUT does, on the clock edge that takes the strobe
             await RisingEdge(self.dut.clk_test)
             wstb = get_int(self.dut.wstb)
             rstb = get_int(self.dut.rstb)
+            if wstb == 0 and rstb == 0:
+                continue
+            tid = self.bus_tids.popleft()
             addr = get_int(self.dut.addr)
             data = get_int(self.dut.wdata)
-            if wstb == 1 or rstb == 1:
-                if wstb == 1:
-                    op = 1
-                    if addr == 0:
-                        self.sck_start  = (data & 0x01)
-                        self.sck_edge   = (data & 0x02)
-                        width_bin = bin(data)[2:].zfill(8)
-                        self.width_num = int(width_bin[:5],2)
-                        uvm_root().logger.info(f"SCK EDGE: {self.sck_edge}")
-                        uvm_root().logger.info(f"SCK START: {self.sck_start}")
-                        uvm_root().logger.info(f"!!!WIDTH NUMBER: {self.width_num}!!!")
-                        wid_end = self.width_num + 10
-                    if addr == 4:
-                        self.clk_div = get_int(self.dut.wdata)
-                        uvm_root().logger.info(f"CLK DIV: {self.clk_div}")
-                    if addr == 11:
-                        self.width_en = 1
-                        for i in range(0,wid_end):
-                            await FallingEdge(self.dut.clk_test)
-                        self.width_en = 0
-                else:
-                    op = 2
-                cmd_tuple = (addr,
-                             data,
-                             op)
-                self.cmd_mon_queue.put_nowait(cmd_tuple)
-                uvm_root().logger.info(f"PUT CMD TUPLE {cmd_tuple}")
+            op = Ops.WR if wstb == 1 else Ops.RD
+            if op == Ops.WR:
+                self.decode_config(addr, data)
+                if addr == 11:
+                    self.coverage.sample(self.sck_start, self.sck_edge >> 1, self.width_num, self.clk_div)
+            self.cmd_mon_queue.put_nowait((tid, (addr, data, int(op))))
+            self.trace_bus.debug("PUT CMD %d: ADDR: %#x DATA: %#x OP: %d", tid, addr, data, op)
+            await FallingEdge(self.dut.clk_test)
+            event = BusEvent(tid, addr, op, data, get_int(self.dut.rdata))
+            for queue in self.checker_queues:
+                queue.put_nowait(event)
+
     async def result_mon_bfm(self):
+        events = self.subscribe()
         while True:
-            await RisingEdge(self.dut.clk_test)
-            wstb = get_int(self.dut.wstb)
-            rstb = get_int(self.dut.rstb)
-            if wstb == 1:
-                await FallingEdge(self.dut.clk_test)
-                result = get_int(self.dut.wdata)
-                addr = get_int(self.dut.addr)
-                if addr in (0,4):
-                    self.result_mon_queue.put_nowait(result)
-                    uvm_root().logger.info(f"PUT WR RESULT {hex(result)}")
-                if addr == 11:
-                    write_result = 0
-                    for i in range(0,8):
-                        if self.sck_start == 1 and self.sck_edge == 2:
-                            await FallingEdge(self.dut.sck)
-                        elif self.sck_start == 0 and self.sck_edge == 2:
-                            await RisingEdge(self.dut.sck)
-                        elif self.sck_start == 1 and self.sck_edge == 0:
-                            await RisingEdge(self.dut.sck)
-                        else:
-                            await FallingEdge(self.dut.sck)
-                        """uvm_root().logger.info(f"I: {i} MOSI: {get_int(self.dut.copi)}")"""
-                        write_result = write_result + get_int(self.dut.copi)*(2**i)
-                    for i in range(0, 100):
-                        await RisingEdge(self.dut.clk_test)
-                    final_result = self.reverse_bits(write_result,8)
-                    self.result_mon_queue.put_nowait(final_result)
-                    uvm_root().logger.info(f"PUT WR DATA RESULT {hex(final_result)}")
-            if rstb == 1:
-                await FallingEdge(self.dut.clk_test)
-                result = get_int(self.dut.rdata)
-                self.result_mon_queue.put_nowait(result)
-                uvm_root().logger.info(f"PUT RD RESULT {hex(result)}")
+            event = await events.get()
+            if event.op == Ops.WR:
+                if event.addr in (0,4):
+                    self.result_mon_queue.put_nowait((event.tid, event.wdata))
+                    self.trace_result.debug("PUT WR RESULT %d: %#x", event.tid, event.wdata)
+                if event.addr == 11:
+                    # collected apart, so that the accesses that follow are not held up
+                    cocotb.start_soon(self.copi_mon_bfm(event.tid))
+            else:
+                self.result_mon_queue.put_nowait((event.tid, event.rdata))
+                self.trace_result.debug("PUT RD RESULT %d: %#x", event.tid, event.rdata)
+
+    async def copi_mon_bfm(self, tid):
+        """Collect the byte a write to 0xb sends on `copi`, and free the bus once all `width_num + 1`
+        bits of the frame are sent; only the first 8 make up the result."""
+        write_result = 0
+        for i in range(0,self.width_num+1):
+            if self.sck_start == 1 and self.sck_edge == 2:
+                await FallingEdge(self.dut.sck)
+            elif self.sck_start == 0 and self.sck_edge == 2:
+                await RisingEdge(self.dut.sck)
+            elif self.sck_start == 1 and self.sck_edge == 0:
+                await RisingEdge(self.dut.sck)
+            else:
+                await FallingEdge(self.dut.sck)
+            if i < 8:
+                write_result = write_result + get_int(self.dut.copi)*(2**i)
+        # a whole sck period covers the last edge and sck back to idle, then the done cycle
+        cocotb.start_soon(self.release_bus(2 * (self.clk_div + 1) + 2))
+        if self.max_in_flight == 1:
+            await self.clock_cycles(100)
+        final_result = self.reverse_bits(write_result,8)
+        self.result_mon_queue.put_nowait((tid, final_result))
+        self.trace_result.debug("PUT WR DATA RESULT %d: %#x", tid, final_result)
+
+    async def release_bus(self, cycles):
+        await self.clock_cycles(cycles)
+        self.spi_idle.set()
 
     async def reset(self):
         await FallingEdge(self.dut.clk_test)
@@ -134,94 +190,106 @@ class SpiBfm(metaclass=utility_classes.Singleton):
         self.dut.wstb.value = 0
         self.dut.cipo.value = 0
         await FallingEdge(self.dut.clk_test)
+        start = get_sim_time(units="step")
         await FallingEdge(self.dut.clk_test)
+        self.clk_period = get_sim_time(units="step") - start
         await FallingEdge(self.dut.clk_test)
         self.dut.rst.value = 0
         await FallingEdge(self.dut.clk_test)
-        uvm_root().logger.info(f"RESET DONE")
+        self.trace_driver.info("RESET DONE, CLOCK PERIOD %d", self.clk_period)
 
     async def driver_bfm(self):
-        uvm_root().logger.info(f"START DRIVER BFM")
+        self.trace_driver.info("START DRIVER BFM")
         self.dut.addr.value = 0
         self.dut.wdata.value = 0
         self.dut.rstb.value = 0
         self.dut.wstb.value = 0
         while True:
+            (addr, data, op, tid) = await self.driver_queue.get()
+            if not self.spi_idle.is_set():
+                await self.spi_idle.wait()
             await FallingEdge(self.dut.clk_test)
-            try:
-                (addr, data, op) = self.driver_queue.get_nowait()
-                uvm_root().logger.info(f"QUEUE NOT EMPTY")
-                if op == Ops.WR:
-                    uvm_root().logger.info(f"WRITE OP START addr: {hex(addr)} data: {hex(data)}")
-                    self.dut.wstb.value = 1
-                    self.dut.addr.value = addr
-                    self.dut.wdata.value = data
-                    data_wr_cipo = bin(data)[2:]
-                    data_wr_rd = (8 - len(data_wr_cipo)) * '0' + data_wr_cipo
-                    self.data_cipo = int(data_wr_rd,2)
-                    binary_cipo = bin(self.data_cipo)[2:]
-                    uvm_root().logger.info(f"DATA EXTEND: {data_wr_rd} DATA MISO: {self.data_cipo } BINARY MISO: {binary_cipo}")
-                    await FallingEdge(self.dut.clk_test)
-                    self.dut.wstb.value = 0
+            if op == Ops.WR:
+                self.bus_tids.append(tid)
+                self.trace_driver.debug("WRITE OP START %d addr: %#x data: %#x", tid, addr, data)
+                if addr == 11:
+                    self.spi_idle.clear()
+                self.dut.wstb.value = 1
+                self.dut.addr.value = addr
+                self.dut.wdata.value = data
+                data_wr_cipo = bin(data)[2:]
+                data_wr_rd = (8 - len(data_wr_cipo)) * '0' + data_wr_cipo
+                self.data_cipo = int(data_wr_rd,2)
+                self.trace_driver.debug("DATA MISO: %#x", self.data_cipo)
+                await FallingEdge(self.dut.clk_test)
+                self.dut.wstb.value = 0
+                await RisingEdge(self.dut.clk_test)
+
+                for bit_cipo in data_wr_rd:
+                    self.dut.cipo.value = int(bit_cipo)
+                    await RisingEdge(self.dut.clk_test)
                     await RisingEdge(self.dut.clk_test)
+            elif op == Ops.RD:
+                self.trace_driver.debug("READ OP START %d addr: %#x", tid, addr)
+                self.bus_tids.append(tid)
+                self.dut.rstb.value = 1
+                self.dut.addr.value = addr
+                await FallingEdge(self.dut.clk_test)
+                self.dut.rstb.value = 0
+            else:
+                 self.trace_driver.error("NOT VALID OP %d: %d", tid, op)
 
-                    for bit_cipo in data_wr_rd:
-                        self.dut.cipo.value = int(bit_cipo)
-                        """uvm_root().logger.info(f"DATA MISO BIT: {int(bit_cipo)}")"""
-                        await RisingEdge(self.dut.clk_test)
-                        await RisingEdge(self.dut.clk_test)
-
-                    """uvm_root().logger.info(f"WRITE OP END addr: {hex(addr)} data: {hex(data)}")"""
-                elif op == Ops.RD:
-                    uvm_root().logger.info(f"READ OP START addr: {hex(addr)}")
-                    self.dut.rstb.value = 1
-                    self.dut.addr.value = addr
-                    await FallingEdge(self.dut.clk_test)
-                    self.dut.rstb.value = 0
-                    """uvm_root().logger.info(f"READ OP END addr: {hex(addr)}")"""
-                else:
-                     uvm_root().logger.error(f"NOT VALID OP!!!")
-            except QueueEmpty:
-                """uvm_root().logger.info(f"QUEUE EMPTY")"""
-                pass
-
-        uvm_root().logger.info(f"FINISH BFM DRIVER")
     async def clkdiv_assert_bfm(self):
+        events = self.subscribe()
         while True:
-            await RisingEdge(self.dut.clk_test)
-            wstb = get_int(self.dut.wstb)
-            if wstb == 1:
-                await FallingEdge(self.dut.clk_test)
-                addr = get_int(self.dut.addr)
-                if addr == 11:
-                    await RisingEdge(self.dut.sck)
-                    clk_div_measr = 0
-                    while self.dut.sck == 1:
-                        await RisingEdge(self.dut.clk_test)
-                        clk_div_measr = clk_div_measr + 1
-                    uvm_root().logger.info(f"CLK DIVIDER MEASURED: {clk_div_measr}")
-                    assert self.clk_div == (clk_div_measr-2), f"CLK DIV {self.clk_div} NOT EQUAL TO CLK DIV MEASURED {clk_div_measr-2}"
+            event = await events.get()
+            if event.op == Ops.WR and event.addr == 11:
+                await RisingEdge(self.dut.sck)
+                start = get_sim_time(units="step")
+                await FallingEdge(self.dut.sck)
+                # clock cycles with sck high
+                sck_high = round((get_sim_time(units="step") - start) / self.clk_period)
+                self.trace_checker.info("CLK DIVIDER MEASURED: %d", sck_high + 1)
+                if self.clk_div != (sck_high - 1):
+                    self.fail(f"CLK DIV {self.clk_div} NOT EQUAL TO CLK DIV MEASURED {sck_high - 1}")
 
     async def width_assert_bfm(self):
+        events = self.subscribe()
         while True:
-            await RisingEdge(self.dut.clk_test)
-            wstb = get_int(self.dut.wstb)
-            if wstb == 1:
-                await FallingEdge(self.dut.clk_test)
-                addr = get_int(self.dut.addr)
-                if addr == 11:
-                    width_measer = 0
-                    while self.width_en == 1:
-                        await RisingEdge(self.dut.sck)
-                        width_measer = width_measer + 1
-                    uvm_root().logger.info(f"!!!! WIDTH OF SPI MEASURED: {width_measer} !!!!")
-                    if self.clk_div == 0:
-                        assert self.width_num == (
-                            width_measer-1), f"WIDTH {self.width_num} NOT EQUAL TO WIDTH MEASURED {width_measer-1}"
+            event = await events.get()
+            if event.op == Ops.WR and event.addr == 11:
+                width_num = self.width_num
+                # the sck rising edges of the frame, which is over at the next access, as the driver
+                # holds it until the transfer is done, or else once sck has been still for two sck
+                # periods, which is longer than its first edge may take after the strobe
+                sck = RisingEdge(self.dut.sck)
+                end = (Timer(4 * (self.clk_div + 1) * self.clk_period, units="step"),
+                       RisingEdge(self.dut.wstb), RisingEdge(self.dut.rstb))
+                width_measer = 0
+                while await First(sck, *end) is sck:
+                    width_measer = width_measer + 1
+                self.trace_checker.info("WIDTH OF SPI MEASURED: %d", width_measer)
+                if width_num + 1 != width_measer:
+                    self.fail(f"WIDTH {width_num} NOT EQUAL TO WIDTH MEASURED {width_measer - 1}")
+
+    def dump_trace(self):
+        """Write the trace ring to SPI_TRACE_DUMP, by default spi_trace.bin."""
+        filename = os.environ.get("SPI_TRACE_DUMP", "spi_trace.bin")
+        self.trace.dump(filename)
+        uvm_root().logger.info(f"TRACE DUMPED TO {filename}")
+
+    def save_coverage(self):
+        """Write the coverage sampled so far to SPI_COVERAGE, by default spi_coverage.npz."""
+        self.coverage.save(os.environ.get("SPI_COVERAGE", "spi_coverage.npz"))
+
+    def fail(self, message):
+        uvm_root().logger.error(message)
+        self.dump_trace()
+        raise AssertionError(message)
 
     def start_bfm(self):
         cocotb.start_soon(self.driver_bfm())
-        cocotb.start_soon(self.cmd_mon_bfm())
+        cocotb.start_soon(self.bus_mon_bfm())
         cocotb.start_soon(self.result_mon_bfm())
         cocotb.start_soon(self.clkdiv_assert_bfm())
-        cocotb.start_soon(self.width_assert_bfm())
\ No newline at end of file
+        cocotb.start_soon(self.width_assert_bfm())